@@ -45,7 +45,8 @@ setup(
             if not l.startswith("-r")
         ],
         interactive=["PyQt5>=5.15.0", "napari>=0.4.7"],
-        all=["PyQt5>=5.15.0", "napari>=0.4.2", "astropy>=4.1"],
+        dask=["distributed>=2.30"],
+        all=["PyQt5>=5.15.0", "napari>=0.4.2", "astropy>=4.1", "distributed>=2.30"],
     ),
     classifiers=[
         "Development Status :: 5 - Production/Stable",
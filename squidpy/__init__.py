@@ -8,6 +8,9 @@ __email__ = ", ".join(
 __version__ = "1.0.0"
 
 from squidpy import datasets
+from squidpy._utils import worker_pool
+from squidpy._settings import settings
+from squidpy._profiling import profile, ProfileReport
 import squidpy.gr
 import squidpy.im
 import squidpy.pl
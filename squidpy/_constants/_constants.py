@@ -94,3 +94,27 @@ class Symbol(ModeEnum):  # noqa: D101
 class SpatialAutocorr(ModeEnum):  # noqa: D101
     MORAN = "moran"
     GEARY = "geary"
+
+
+@unique
+class CoOccurrence(ModeEnum):  # noqa: D101
+    PAIRWISE = "pairwise"
+    RADIUS = "radius"
+
+
+@unique
+class PermutationEngine(ModeEnum):  # noqa: D101
+    NUMBA = "numba"
+    MATMUL = "matmul"
+
+
+@unique
+class TailModel(ModeEnum):  # noqa: D101
+    GPD = "gpd"
+    GAMMA = "gamma"
+
+
+@unique
+class LigrecFormat(ModeEnum):  # noqa: D101
+    SPARSE = "sparse"
+    ARRAY = "array"
@@ -33,7 +33,8 @@ copy
     If `True`, return the result, otherwise save it to the image container."""
 _numba_parallel = """\
 numba_parallel
-    Whether to use :class:`numba.prange` or not. If `None`, it is determined automatically.
+    Whether to use :class:`numba.prange` or not. If `None`, use :attr:`squidpy.settings.numba_parallel` or
+    determine it automatically.
     For small datasets or small number of interactions, it's recommended to set this to `False`."""
 _seed = """\
 seed
@@ -98,11 +99,12 @@ Nothing, just plots the and optionally saves the plot.
 """
 _parallelize = """\
 n_jobs
-    Number of parallel jobs.
+    Number of parallel jobs. If `None`, use :attr:`squidpy.settings.n_jobs`.
 backend
     Parallelization backend to use. See :class:`joblib.Parallel` for available options.
+    If `None`, use the backend of :func:`squidpy.worker_pool` or :attr:`squidpy.settings.backend`.
 show_progress_bar
-    Whether to show the progress bar or not."""
+    Whether to show the progress bar or not. See also :attr:`squidpy.settings.show_progress_bar`."""
 _channels = """\
 channels
     Channels for this feature is computed. If `None`, use all channels."""
@@ -121,6 +123,14 @@ Otherwise, modifies the ``adata`` object with the following key:
 
     - :attr:`anndata.AnnData.uns` ``['{key_added}']`` - the above mentioned :class:`dict`.
 
+If ``result_format = 'array'``, `'means'` and `'pvalues'` are :class:`numpy.ndarray` and the following keys are added:
+
+    - `'interactions'` - :class:`numpy.ndarray` of shape ``(n_interactions, 2)`` containing the interacting molecules.
+    - `'clusters'` - :class:`numpy.ndarray` of shape ``(n_cluster_combinations, 2)`` containing the clusters.
+
+For multiple cluster keys, each of them is stored separately and ``copy = True`` returns a :class:`dict`
+mapping the cluster keys to the above mentioned :class:`dict`.
+
 `NaN` p-values mark combinations for which the mean expression of one of the interacting components was 0
 or it didn't pass the ``threshold`` percentage of cells being expressed within a given cluster."""
 _corr_method = """\
@@ -0,0 +1,346 @@
+"""Opt-in profiling of :mod:`squidpy` functions."""
+from __future__ import annotations
+
+from typing import Any, Dict, List, Tuple, Union, Callable, Optional, Sequence, Generator
+from pathlib import Path
+from functools import wraps
+from threading import Lock, local, current_thread
+from contextlib import ExitStack, contextmanager
+import os
+import sys
+import json
+import time
+import socket
+import tracemalloc
+
+from anndata import AnnData
+
+__all__ = ["profile", "ProfileReport"]
+
+
+class _Frame:
+    """A stage which is currently running."""
+
+    def __init__(self, path: str, compile_time: float, memory: int):
+        self.path = path
+        self.start = time.perf_counter()
+        self.compile_time = compile_time
+        self.memory = memory
+        self.peak = memory
+
+
+class ProfileReport:
+    """
+    Wall time, :mod:`numba` compile time and memory of the stages run within :func:`squidpy.profile`.
+
+    Each stage is identified by the path of the stages it's nested in, e.g. `'gr.ligrec/parallelize'`.
+    All measurements include the nested stages, repeated stages are aggregated.
+
+    Parameters
+    ----------
+    memory
+        Whether to trace the memory allocations with :mod:`tracemalloc`.
+    """
+
+    def __init__(self, memory: bool = True):
+        self.memory = memory
+        self.wall_time: Optional[float] = None
+        self._stages: Dict[str, Dict[str, Any]] = {}
+        self._capacity: Dict[str, float] = {}
+        self._stack: List[_Frame] = []
+        self._thread = current_thread()
+        self._compile_time = 0.0
+        self._compiling = local()
+        self._lock = Lock()
+        self._start = time.perf_counter()
+
+    @property
+    def compile_time(self) -> float:
+        """Time in seconds spent compiling :mod:`numba` functions in this process."""
+        return self._compile_time
+
+    @property
+    def stages(self) -> List[Dict[str, Any]]:
+        """Measurements of the stages, in the order in which they were first started."""
+        return [{"stage": path, **stage} for path, stage in self._stages.items()]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Return the report as a :class:`dict`.
+
+        Returns
+        -------
+        The total wall time and compile time in seconds and the :attr:`stages`, containing:
+
+            - `'n_calls'` - how often the stage was run.
+            - `'wall_time'` - the total wall time in seconds.
+            - `'compile_time'` - the total time in seconds spent compiling :mod:`numba` functions.
+            - `'peak_memory'` - the largest number of bytes allocated on top of the memory at the start of the stage,
+              `None` if the memory isn't traced.
+
+        Stages which parallelize the work also contain the `'backend'`, the number of jobs `'n_jobs'` and chunks
+        `'n_chunks'`, the `'utilization'` of the jobs and the `'workers'` with their busy time, number of chunks
+        and peak resident set size `'max_rss'` in bytes.
+        """
+        wall_time = time.perf_counter() - self._start if self.wall_time is None else self.wall_time
+        return {"wall_time": wall_time, "compile_time": self.compile_time, "stages": self.stages}
+
+    def to_json(self, path: Optional[Union[str, Path]] = None, **kwargs: Any) -> str:
+        """
+        Export the report as JSON.
+
+        Parameters
+        ----------
+        path
+            If not `None`, also write it to this file.
+        kwargs
+            Keyword arguments for :func:`json.dumps`.
+
+        Returns
+        -------
+        The report from :meth:`to_dict` as JSON.
+        """
+        kwargs.setdefault("indent", 2)
+        res = json.dumps(self.to_dict(), **kwargs)
+        if path is not None:
+            Path(path).write_text(res, encoding="utf-8")
+
+        return res
+
+    @contextmanager
+    def _stage(self, name: str) -> Generator[Optional[_Frame], None, None]:
+        if current_thread() is not self._thread:  # e.g. the workers of the `'threading'` backend
+            yield None
+            return
+
+        memory = 0
+        if self.memory:
+            memory, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                self._stack[-1].peak = max(self._stack[-1].peak, peak)
+            _reset_peak()
+
+        path = name if not self._stack else f"{self._stack[-1].path}/{name}"
+        stage = self._stages.setdefault(path, _new_stage())
+        frame = _Frame(path, compile_time=self._compile_time, memory=memory)
+        self._stack.append(frame)
+        try:
+            yield frame
+        finally:
+            self._stack.pop()
+            stage["n_calls"] += 1
+            stage["wall_time"] += time.perf_counter() - frame.start
+            stage["compile_time"] += self._compile_time - frame.compile_time
+            if self.memory:
+                frame.peak = max(frame.peak, tracemalloc.get_traced_memory()[1])
+                stage["peak_memory"] = max(stage["peak_memory"] or 0, frame.peak - frame.memory)
+                if self._stack:
+                    self._stack[-1].peak = max(self._stack[-1].peak, frame.peak)
+                _reset_peak()
+
+    def _add_workers(
+        self, frame: _Frame, stats: Sequence[Dict[str, Any]], n_jobs: int, backend: str, wall_time: float
+    ) -> None:
+        stage = self._stages.setdefault(frame.path, _new_stage())
+        stage.setdefault("backend", backend)
+        stage.setdefault("n_jobs", n_jobs)
+        stage["n_chunks"] = stage.get("n_chunks", 0) + len(stats)
+        # the time for which all jobs could've been busy
+        self._capacity[frame.path] = self._capacity.get(frame.path, 0.0) + n_jobs * wall_time
+        capacity = self._capacity[frame.path]
+
+        workers = {w["worker"]: w for w in stage.get("workers", [])}
+        for s in stats:
+            worker = workers.setdefault(s["worker"], {"worker": s["worker"], "n_chunks": 0, "busy_time": 0.0})
+            worker["n_chunks"] += 1
+            worker["busy_time"] += s["time"]
+            worker["max_rss"] = s["max_rss"]
+        stage["workers"] = list(workers.values())
+        busy = sum(w["busy_time"] for w in stage["workers"])
+        stage["utilization"] = min(1.0, busy / capacity) if capacity > 0 else None
+
+    def _on_compile(self, start: bool) -> None:
+        # only the outermost compilation in each thread, `numba` compiles the called functions in between
+        depth = getattr(self._compiling, "depth", 0) + (1 if start else -1)
+        self._compiling.depth = depth
+        if start and depth == 1:
+            self._compiling.start = time.perf_counter()
+        elif not start and depth == 0:
+            with self._lock:
+                self._compile_time += time.perf_counter() - self._compiling.start
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(n_stages={len(self._stages)}, memory={self.memory})"
+
+
+_report: Optional[ProfileReport] = None
+
+
+def _new_stage() -> Dict[str, Any]:
+    return {"n_calls": 0, "wall_time": 0.0, "compile_time": 0.0, "peak_memory": None}
+
+
+def _reset_peak() -> None:
+    # only available since Python 3.9, otherwise the peaks are since the start of the outermost stage
+    reset = getattr(tracemalloc, "reset_peak", None)
+    if reset is not None:
+        reset()
+
+
+def _compile_listener(report: ProfileReport) -> Any:
+    try:
+        from numba.core.event import Listener
+    except ImportError:  # `numba<0.53`
+        return None
+
+    class CompileListener(Listener):  # type: ignore[misc]
+        def on_start(self, event: Any) -> None:
+            report._on_compile(start=True)
+
+        def on_end(self, event: Any) -> None:
+            report._on_compile(start=False)
+
+    return CompileListener()
+
+
+def _max_rss() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return int(rss if sys.platform == "darwin" else rss * 1024)
+
+
+def _timed(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Tuple[Any, Dict[str, Any]]:
+    """Run ``fn`` in a worker of :func:`squidpy._utils.parallelize` and also return its busy time and memory."""
+    start = time.perf_counter()
+    res = fn(*args, **kwargs)
+    worker = f"{socket.gethostname()}:{os.getpid()}:{current_thread().name}"
+
+    return res, {"worker": worker, "time": time.perf_counter() - start, "max_rss": _max_rss()}
+
+
+@contextmanager
+def _stage(name: str) -> Generator[Optional[_Frame], None, None]:
+    """
+    Record the stage ``name`` if running within :func:`squidpy.profile`.
+
+    Parameters
+    ----------
+    name
+        Name of the stage.
+
+    Returns
+    -------
+    The running stage or `None`, if not profiling.
+    """
+    if _report is None:
+        yield None
+        return
+
+    with _report._stage(name) as frame:
+        yield frame
+
+
+def _record_workers(
+    frame: _Frame, stats: Sequence[Dict[str, Any]], n_jobs: int, backend: str, wall_time: float
+) -> None:
+    """
+    Record the workers which ran the chunks of the stage ``frame``, see :func:`_timed`.
+
+    Parameters
+    ----------
+    frame
+        The running stage.
+    stats
+        The busy time and memory of the worker of each chunk.
+    n_jobs
+        Number of parallel jobs.
+    backend
+        Parallelization backend.
+    wall_time
+        Time in seconds until all chunks were finished.
+
+    Returns
+    -------
+    Nothing, just updates the report.
+    """
+    if _report is not None:
+        _report._add_workers(frame, stats, n_jobs=n_jobs, backend=backend, wall_time=wall_time)
+
+
+def _profiled(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """Record each call of ``fn`` as a stage, e.g. `'gr.ligrec'`, when running within :func:`squidpy.profile`."""
+    name = ".".join([*fn.__module__.split(".")[1:2], fn.__qualname__])
+
+    @wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        if _report is None:
+            return fn(*args, **kwargs)
+        with _stage(name):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def profile(
+    adata: Optional[AnnData] = None, key_added: str = "profile", memory: bool = True
+) -> Generator[ProfileReport, None, None]:
+    """
+    Record where the time and memory go in the :mod:`squidpy` functions called within this context.
+
+    The functions in :mod:`squidpy.gr` and :mod:`squidpy.im`, loading and saving of
+    :class:`squidpy.im.ImageContainer` and downloading the datasets are recorded as stages,
+    as are their parallelized parts, together with the busy time and memory of each worker.
+
+    Parameters
+    ----------
+    adata
+        If not `None`, save the report as JSON in :attr:`anndata.AnnData.uns` ``['{key_added}']`` when exiting.
+    key_added
+        Key in :attr:`anndata.AnnData.uns` where to save the report.
+    memory
+        Whether to trace the memory allocations with :mod:`tracemalloc`. It slows down code which allocates
+        many small objects.
+
+    Returns
+    -------
+    The :class:`squidpy.ProfileReport`, which is complete when exiting the context.
+
+    Examples
+    --------
+    .. code-block:: python
+
+        import squidpy as sq
+
+        with sq.profile(adata) as report:
+            sq.gr.spatial_neighbors(adata)
+            sq.gr.nhood_enrichment(adata, cluster_key="cluster", n_jobs=4)
+        report.to_json("profile.json")
+    """
+    global _report
+
+    prev = _report
+    report = ProfileReport(memory=memory)
+    with ExitStack() as stack:
+        listener = _compile_listener(report)
+        if listener is not None:
+            from numba.core.event import install_listener
+
+            stack.enter_context(install_listener("numba:compile", listener))
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            stack.callback(tracemalloc.stop)
+
+        _report = report
+        try:
+            yield report
+        finally:
+            _report = prev
+            report.wall_time = time.perf_counter() - report._start
+
+    if adata is not None:
+        adata.uns[key_added] = report.to_json()
@@ -0,0 +1,188 @@
+"""Global settings of :mod:`squidpy`."""
+from __future__ import annotations
+
+from typing import Any, Union, Optional, Generator
+from pathlib import Path
+from contextlib import contextmanager
+import os
+
+from scanpy import logging as logg
+
+import numba
+import numpy as np
+
+__all__ = ["settings"]
+
+_THREADING_LAYERS = ("default", "safe", "forksafe", "threadsafe", "tbb", "omp", "workqueue")
+
+
+class SqSettings:
+    """
+    Settings which apply to all functions in :mod:`squidpy.gr` and :mod:`squidpy.im`.
+
+    The arguments passed to a function always take precedence. Use :meth:`override` to change them temporarily.
+
+    Examples
+    --------
+    .. code-block:: python
+
+        import squidpy as sq
+
+        sq.settings.n_jobs = 8
+        with sq.settings.override(backend="loky", show_progress_bar=False):
+            sq.gr.nhood_enrichment(adata, cluster_key="cluster")
+    """
+
+    def __init__(self) -> None:
+        self._n_jobs: Optional[int] = None
+        self._backend: Optional[str] = None
+        self._show_progress_bar = True
+        self._numba_parallel: Optional[bool] = None
+        self._numba_num_threads: Optional[int] = None
+        self._dtype = np.dtype(np.float64)
+        self._cache_dir = Path(os.path.expanduser("~/.cache/squidpy"))
+
+    @property
+    def n_jobs(self) -> Optional[int]:
+        """Number of parallel jobs used when a function is called with ``n_jobs = None``. If `None`, use `1`."""
+        return self._n_jobs
+
+    @n_jobs.setter
+    def n_jobs(self, n_jobs: Optional[int]) -> None:
+        if n_jobs is not None and (not isinstance(n_jobs, int) or n_jobs == 0):
+            raise ValueError(f"Expected `n_jobs` to be `None` or a non-zero integer, found `{n_jobs}`.")
+        self._n_jobs = n_jobs
+
+    @property
+    def backend(self) -> Optional[str]:
+        """
+        Parallelization backend used when a function is called with ``backend = None``.
+
+        If `None`, use the function's default. See :class:`joblib.Parallel` for available options.
+        """
+        return self._backend
+
+    @backend.setter
+    def backend(self, backend: Optional[str]) -> None:
+        if backend is not None and not isinstance(backend, str):
+            raise TypeError(f"Expected `backend` to be `None` or a `str`, found `{type(backend).__name__}`.")
+        self._backend = backend
+
+    @property
+    def show_progress_bar(self) -> bool:
+        """Whether to show progress bars. If `False`, they are disabled regardless of ``show_progress_bar``."""
+        return self._show_progress_bar
+
+    @show_progress_bar.setter
+    def show_progress_bar(self, show_progress_bar: bool) -> None:
+        self._show_progress_bar = bool(show_progress_bar)
+
+    @property
+    def numba_parallel(self) -> Optional[bool]:
+        """Whether to use :class:`numba.prange` when a function is called with ``numba_parallel = None``."""
+        return self._numba_parallel
+
+    @numba_parallel.setter
+    def numba_parallel(self, numba_parallel: Optional[bool]) -> None:
+        self._numba_parallel = None if numba_parallel is None else bool(numba_parallel)
+
+    @property
+    def numba_num_threads(self) -> Optional[int]:
+        """
+        Number of :mod:`numba` threads shared by all parallel jobs.
+
+        If `None`, use all available, i.e. ``NUMBA_NUM_THREADS``.
+        """
+        return self._numba_num_threads
+
+    @numba_num_threads.setter
+    def numba_num_threads(self, n_threads: Optional[int]) -> None:
+        max_threads = numba.config.NUMBA_NUM_THREADS
+        if n_threads is not None and (not isinstance(n_threads, int) or not 0 < n_threads <= max_threads):
+            raise ValueError(
+                f"Expected `numba_num_threads` to be `None` or in `[1, {max_threads}]`, "
+                f"found `{n_threads}`."
+            )
+        self._numba_num_threads = n_threads
+
+    @property
+    def numba_threading_layer(self) -> str:
+        """
+        Threading layer of :mod:`numba`, see :ref:`numba:numba-threading-layer`.
+
+        It can only be changed before the first parallel :mod:`numba` function is run.
+        """
+        return numba.config.THREADING_LAYER  # type: ignore[no-any-return]
+
+    @numba_threading_layer.setter
+    def numba_threading_layer(self, layer: str) -> None:
+        if layer not in _THREADING_LAYERS:
+            raise ValueError(f"Invalid threading layer `{layer}`. Valid options are: `{sorted(_THREADING_LAYERS)}`.")
+        try:
+            logg.warning(
+                f"Threading layer `{numba.threading_layer()}` has already been initialized, "
+                f"setting it to `{layer}` has no effect"
+            )
+        except ValueError:  # not yet initialized
+            pass
+        numba.config.THREADING_LAYER = layer
+
+    @property
+    def dtype(self) -> np.dtype:
+        """
+        Floating point type of the expression data copied for the permutation tests, e.g. in :func:`squidpy.gr.ligrec`.
+
+        :class:`numpy.float32` halves the memory, the test statistics are still accumulated in :class:`numpy.float64`.
+        """
+        return self._dtype
+
+    @dtype.setter
+    def dtype(self, dtype: Union[str, type, np.dtype]) -> None:
+        dtype = np.dtype(dtype)
+        if dtype not in (np.float32, np.float64):
+            raise ValueError(f"Expected `dtype` to be either `float32` or `float64`, found `{dtype}`.")
+        self._dtype = dtype
+
+    @property
+    def cache_dir(self) -> Path:
+        """Directory where the datasets are downloaded to."""
+        return self._cache_dir
+
+    @cache_dir.setter
+    def cache_dir(self, cache_dir: Union[str, Path]) -> None:
+        self._cache_dir = Path(os.path.expanduser(cache_dir))
+
+    @contextmanager
+    def override(self, **kwargs: Any) -> Generator[SqSettings, None, None]:
+        """
+        Temporarily change the settings.
+
+        Parameters
+        ----------
+        kwargs
+            New values of the settings.
+
+        Returns
+        -------
+        These settings, the old values are restored when exiting the context.
+        """
+        invalid = sorted(k for k in kwargs if not isinstance(getattr(type(self), k, None), property))
+        if invalid:
+            raise AttributeError(f"Invalid settings `{invalid}`.")
+
+        old = {k: getattr(self, k) for k in kwargs}
+        try:
+            for k, v in kwargs.items():
+                setattr(self, k, v)
+            yield self
+        finally:
+            for k, v in old.items():
+                if getattr(self, k) != v:
+                    setattr(self, k, v)
+
+    def __repr__(self) -> str:
+        props = [k for k, v in vars(type(self)).items() if isinstance(v, property)]
+        return f"{type(self).__name__}({', '.join(f'{k}={getattr(self, k)!r}' for k in props)})"
+
+
+settings = SqSettings()
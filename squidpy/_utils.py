@@ -4,27 +4,35 @@ from __future__ import annotations
 import joblib as jl
 
 from enum import Enum
-from queue import Queue
 from typing import (
     Any,
     Set,
     List,
+    Dict,
     Tuple,
+    Union,
     Callable,
     Hashable,
     Iterable,
     Optional,
     Sequence,
     Generator,
-    TYPE_CHECKING,
 )
-from threading import Thread
-from contextlib import contextmanager
-from multiprocessing import Manager, cpu_count
-
+from functools import partial
+from threading import Event, Thread, local, main_thread, current_thread
+from contextlib import suppress, nullcontext, contextmanager
+from multiprocessing import cpu_count
+import os
+import time
+import tempfile
+
+import numba
 import numpy as np
 
-__all__ = ["singledispatchmethod", "Signal", "SigQueue"]
+from squidpy._settings import settings
+from squidpy._profiling import _stage, _timed, _record_workers
+
+__all__ = ["singledispatchmethod", "Signal", "SigQueue", "worker_pool"]
 
 
 try:
@@ -45,10 +53,6 @@ except ImportError:
         return wrapper
 
 
-class SigQueue(Queue["Signal"] if TYPE_CHECKING else Queue):  # type: ignore[misc]
-    """Signalling queue."""
-
-
 def _unique_order_preserving(iterable: Iterable[Hashable]) -> Tuple[List[Hashable], Set[Hashable]]:
     """Remove items from an iterable while preserving the order."""
     seen: Set[Hashable] = set()
@@ -65,17 +69,155 @@ class Signal(Enum):
     UPDATE_FINISH = 3
 
 
+class SigQueue:
+    """
+    Signalling channel from a chunk of work to the progress bar of :func:`parallelize`.
+
+    Updates are counted locally and written at most every ``interval`` seconds to the chunk's own row
+    of a memory-mapped file, which is polled in the main process. Only the file name is sent to the workers,
+    which map the file when first writing to it and unmap it when the chunk is finished.
+    """
+
+    def __init__(self, fname: str, n_chunks: int, slot: int, interval: float = 0.1):
+        self._fname = fname
+        self._n_chunks = n_chunks
+        self._slot = slot
+        self._interval = interval
+        self._n = 0
+        self._last = time.monotonic()
+        self._counts: Optional[np.memmap] = None
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return SigQueue, (self._fname, self._n_chunks, self._slot, self._interval)
+
+    def put(self, signal: Signal) -> None:
+        """Record ``signal``, the progress is written only when finishing or after ``interval`` seconds."""
+        if signal is Signal.UPDATE or signal is Signal.UPDATE_FINISH:
+            self._n += 1
+        if signal is Signal.FINISH or signal is Signal.UPDATE_FINISH:
+            self._flush(finished=True)
+            self.close()
+        elif time.monotonic() - self._last >= self._interval:
+            self._flush(finished=False)
+
+    def close(self) -> None:
+        """Unmap the file, so that it can be removed."""
+        self._counts = None  # the last reference, which closes the mapping
+
+    def _flush(self, finished: bool) -> None:
+        if self._counts is None:
+            self._counts = np.memmap(self._fname, dtype=np.int64, mode="r+", shape=(self._n_chunks, 2))
+        self._counts[self._slot, 0] = self._n
+        self._counts[self._slot, 1] = finished
+        self._last = time.monotonic()
+
+
+@contextmanager
+def _progress(pbar: Any, n_chunks: int, interval: float = 0.1) -> Generator[List[SigQueue], None, None]:
+    """Update ``pbar`` from the channels of ``n_chunks`` chunks in a separate thread until exiting the context."""
+
+    def update(counts: np.memmap, stop: Event) -> None:
+        n_prev = 0
+        while True:
+            stopped = stop.wait(interval)
+            n = int(counts[:, 0].sum())
+            if n > n_prev:
+                pbar.update(n - n_prev)
+                n_prev = n
+            if stopped or counts[:, 1].all():
+                break
+        pbar.close()
+
+    fd, fname = tempfile.mkstemp(prefix="squidpy_progress_")
+    os.close(fd)
+    counts = np.memmap(fname, dtype=np.int64, mode="w+", shape=(n_chunks, 2))
+    stop = Event()
+    thread = Thread(target=update, args=(counts, stop), daemon=True)
+    thread.start()
+    queues = [SigQueue(fname, n_chunks, i, interval=interval) for i in range(n_chunks)]
+    try:
+        yield queues
+    finally:
+        stop.set()
+        thread.join()
+        for queue in queues:  # the ones used in this process, e.g. by the `'threading'` backend
+            queue.close()
+        del counts
+        with suppress(OSError):  # on Windows, the workers might still have the file opened
+            os.remove(fname)
+
+
+class _WorkerPool:
+    """Workers shared by all calls to :func:`parallelize` within :func:`worker_pool`."""
+
+    def __init__(self, n_jobs: int, backend: str, max_nbytes: Optional[Union[str, int]]):
+        self.n_jobs = n_jobs
+        self.backend = backend
+        kwargs = {"idle_worker_timeout": 24 * 3600} if backend == "loky" else {}  # only stop them when exiting
+        self.parallel = jl.Parallel(n_jobs=n_jobs, backend=backend, max_nbytes=max_nbytes, mmap_mode="r", **kwargs)
+
+
+_pool: Optional[_WorkerPool] = None
+_local = local()
+_AUTO_CHUNKS_PER_JOB = 16
+
+
+def _run_with_numba_threads(fn: Callable[..., Any], n_threads: Optional[int], *args: Any, **kwargs: Any) -> Any:
+    """Run ``fn`` in a worker which may use at most ``n_threads`` :mod:`numba` threads, see :func:`_numba_threads`."""
+    prev = getattr(_local, "n_threads", None)
+    _local.n_threads = n_threads
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _local.n_threads = prev
+
+
+@contextmanager
+def _numba_threads() -> Generator[Optional[int], None, None]:
+    """
+    Limit the :mod:`numba` threads of the calling worker to its share of the cores in :func:`parallelize`.
+
+    Only enter it right before running a :func:`numba.prange` loop, since it starts the threads of :mod:`numba`,
+    which then can't be safely forked by the `'multiprocessing'` backend.
+
+    Returns
+    -------
+    The number of threads or `None`, if the loop should be run sequentially.
+    """
+    n_threads = getattr(_local, "n_threads", None)
+    if n_threads is None:
+        n_threads = settings.numba_num_threads
+    if n_threads is None:
+        yield numba.get_num_threads()
+        return
+
+    n_threads = min(n_threads, numba.config.NUMBA_NUM_THREADS)
+    if n_threads <= 1 or current_thread() is not main_thread():
+        # the threads of the `'threading'` backend already run in parallel, the threading layers of `numba`
+        # either can't be launched from multiple threads at once (workqueue) or may not shut down afterwards (tbb)
+        yield None
+        return
+
+    prev = numba.get_num_threads()
+    numba.set_num_threads(n_threads)
+    try:
+        yield n_threads
+    finally:
+        numba.set_num_threads(prev)
+
+
 def parallelize(
     callback: Callable[..., Any],
     collection: Sequence[Any],
     n_jobs: int = 1,
-    n_split: Optional[int] = None,
+    n_split: Optional[Union[int, str]] = None,
     unit: str = "",
     use_ixs: bool = False,
-    backend: str = "loky",
+    backend: Optional[str] = None,
     extractor: Optional[Callable[[Sequence[Any]], Any]] = None,
     show_progress_bar: bool = True,
     use_runner: bool = False,
+    max_nbytes: Optional[Union[str, int]] = "1M",
     **_: Any,
 ) -> Any:
     """
@@ -93,24 +235,52 @@ def parallelize(
     n_split
         Split ``collection`` into ``n_split`` chunks.
         If <= 0, ``collection`` is assumed to be already split into chunks.
+        If `'auto'`, split it into many small chunks which :mod:`joblib` groups into batches based on their measured
+        duration and dispatches to the workers as they become idle. Use it when the cost of the items varies.
     unit
         Unit of the progress bar.
     use_ixs
         Whether to pass indices to the callback.
     backend
         Which backend to use for multiprocessing. See :class:`joblib.Parallel` for valid options.
+        If `'dask'`, submit the chunks to the workers of the current :class:`distributed.Client`.
+        If `None`, use the backend of :func:`squidpy.worker_pool`, :attr:`squidpy.settings.backend` or `'loky'`.
     extractor
         Function to apply to the result after all jobs have finished.
     show_progress_bar
-        Whether to show a progress bar.
+        Whether to show a progress bar. Disabled if :attr:`squidpy.settings.show_progress_bar` is `False`.
     use_runner
         Whether the ``callback`` handles only 1 item from the ``collection`` or a chunk.
         The latter grants more control, e.g. using :func:`numba.prange` instead of normal iteration.
+    max_nbytes
+        Arrays larger than this are dumped once into a memory-mapped file which the workers attach to read-only,
+        instead of being pickled to each of them. Only used by process-based backends.
+        With ``backend='dask'``, the arguments larger than this are scattered once to the cluster instead.
+        If `None`, disable memory mapping. See :class:`joblib.Parallel` for more information.
 
     Returns
     -------
     The result depending on ``callable``, ``extractor``.
+
+    Notes
+    -----
+    Within :func:`squidpy.worker_pool`, the workers of the pool are used if ``n_jobs > 1`` and ``backend`` is the
+    same as the pool's. The collection is still split into ``n_split`` chunks, but ``max_nbytes`` is the pool's.
+    The results are always in the order of the chunks, regardless of which of them finished first.
+
+    Each of the ``n_jobs`` workers may use ``cpu_count() // n_jobs`` :mod:`numba` threads, or its share of
+    :attr:`squidpy.settings.numba_num_threads`, within :func:`_numba_threads`,
+    so that the :func:`numba.prange` loops don't oversubscribe the cores. Kernels compiled with ``nogil=True`` run
+    concurrently with ``backend='threading'``, which shares the arrays with the workers instead of pickling them.
+
+    Within :func:`squidpy.profile`, the busy time and memory of each worker are recorded.
+
+    The progress of each chunk is reported through its :class:`SigQueue`, which batches the updates in the worker.
+    With ``backend='dask'``, the workers may run on other machines, so the progress is updated for each finished
+    chunk instead, see :func:`_parallelize_dask`.
     """
+    backend = _get_backend(backend)
+    show_progress_bar = show_progress_bar and settings.show_progress_bar
     if show_progress_bar:
         try:
             from tqdm.notebook import tqdm
@@ -134,49 +304,65 @@ def parallelize(
 
         return result
 
-    def update(pbar: "tqdm.std.tqdm", queue: "SigQueue", n_total: int) -> None:
-        n_finished = 0
-        while n_finished < n_total:
-            try:
-                res = queue.get()
-            except EOFError as e:
-                if not n_finished != n_total:
-                    raise RuntimeError(f"Finished only `{n_finished}` out of `{n_total}` tasks.") from e
-                break
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        with _stage("parallelize") as stage:
+            fn = runner if use_runner else callback
+            if stage is not None:
+                fn = partial(_timed, fn)
+            start = time.perf_counter()
+            res = run(fn, *args, **kwargs)
+            if stage is not None:
+                res, stats = [r for r, _ in res], [s for _, s in res]
+                _record_workers(stage, stats, n_jobs=n_jobs, backend=backend, wall_time=time.perf_counter() - start)
 
-            assert isinstance(res, Signal), f"Invalid type `{type(res).__name__}`."
+        return res if extractor is None else extractor(res)
 
-            if res in (Signal.FINISH, Signal.UPDATE_FINISH):
-                n_finished += 1
-            if pbar is not None and res in (Signal.UPDATE, Signal.UPDATE_FINISH):
-                pbar.update()
+    def run(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> List[Any]:
+        if backend == "dask":
+            pbar = tqdm(total=col_len, unit=unit) if show_progress_bar and len(collections) else None
+            return _parallelize_dask(
+                fn,
+                [(i, cs) if use_ixs else (cs,) for i, cs in enumerate(collections)],
+                args,
+                kwargs,
+                sizes=[len(cs) for cs in collections],
+                pbar=pbar,
+                max_nbytes=max_nbytes,
+            )
 
-        if pbar is not None:
-            pbar.close()
+        # reuse the workers of `worker_pool`, unless running sequentially or with a different backend
+        pool = _pool if _pool is not None and n_jobs > 1 and _pool.backend == backend else None
 
-    def wrapper(*args: Any, **kwargs: Any) -> Any:
-        if pass_queue and show_progress_bar:
-            pbar = None if tqdm is None else tqdm(total=col_len, unit=unit)
-            queue = Manager().Queue()
-            thread = Thread(target=update, args=(pbar, queue, len(collections)))
-            thread.start()
-        else:
-            pbar, queue, thread = None, None, None  # type: ignore[assignment]
-
-        res = jl.Parallel(n_jobs=n_jobs, backend=backend)(
-            jl.delayed(runner if use_runner else callback)(
-                *((i, cs) if use_ixs else (cs,)),
-                *args,
-                **kwargs,
-                queue=queue,
-            )
-            for i, cs in enumerate(collections)
+        parallel = (
+            jl.Parallel(n_jobs=n_jobs, backend=backend, max_nbytes=max_nbytes, mmap_mode="r")
+            if pool is None
+            else pool.parallel
         )
 
-        if thread is not None:
-            thread.join()
+        if pass_queue and show_progress_bar and len(collections):
+            progress = _progress(tqdm(total=col_len, unit=unit), len(collections))
+        else:
+            progress = nullcontext([None] * len(collections))
+
+        # all workers share the cores with their `numba` threads
+        n_threads = (
+            None
+            if n_jobs == 1
+            else (settings.numba_num_threads or cpu_count()) // (n_jobs if pool is None else pool.n_jobs)
+        )
 
-        return res if extractor is None else extractor(res)
+        with progress as queues:
+            return parallel(  # type: ignore[no-any-return]
+                jl.delayed(_run_with_numba_threads)(
+                    fn,
+                    n_threads,
+                    *((i, cs) if use_ixs else (cs,)),
+                    *args,
+                    **kwargs,
+                    queue=queues[i],
+                )
+                for i, cs in enumerate(collections)
+            )
 
     if n_jobs == 0:
         raise ValueError("Number of jobs cannot be `0`.")
@@ -185,14 +371,17 @@ def parallelize(
 
     if n_split is None:
         n_split = n_jobs
+    elif n_split == "auto":
+        n_split = 1 if n_jobs == 1 else max(min(len(collection), n_jobs * _AUTO_CHUNKS_PER_JOB), 1)
 
     if n_split <= 0:
         col_len = sum(map(len, collection))
         collections = collection
     else:
         col_len = len(collection)
-        step = int(np.ceil(len(collection) / n_split))
-        collections = list(filter(len, (collection[i * step : (i + 1) * step] for i in range(col_len))))
+        # the sizes differ by at most 1, i.e. there are `n_split` chunks, unless the collection is smaller
+        bounds = [i * col_len // n_split for i in range(n_split + 1)]
+        collections = list(filter(len, (collection[start:end] for start, end in zip(bounds[:-1], bounds[1:]))))
 
     if use_runner:
         use_ixs = False
@@ -201,6 +390,79 @@ def parallelize(
     return wrapper
 
 
+def _run_chunk(fn: Callable[..., Any], args: Sequence[Any], kwargs: Dict[str, Any]) -> Any:
+    """Run ``fn`` on a :mod:`dask` worker, whose threads already run in parallel, see :func:`_numba_threads`."""
+    return _run_with_numba_threads(fn, 1, *args, **kwargs, queue=None)
+
+
+def _parallelize_dask(
+    fn: Callable[..., Any],
+    chunks: Sequence[Tuple[Any, ...]],
+    args: Sequence[Any],
+    kwargs: Dict[str, Any],
+    sizes: Sequence[int],
+    pbar: Optional[Any] = None,
+    max_nbytes: Optional[Union[str, int]] = "1M",
+) -> List[Any]:
+    """
+    Run ``fn`` for each of the ``chunks`` on the workers of the current :class:`distributed.Client`.
+
+    Parameters
+    ----------
+    fn
+        Function to run.
+    chunks
+        Positional arguments specific to each chunk.
+    args
+        Positional arguments shared by all chunks.
+    kwargs
+        Keyword arguments shared by all chunks.
+    sizes
+        Number of items in each chunk.
+    pbar
+        Progress bar which is updated with the size of each finished chunk.
+    max_nbytes
+        Shared arguments larger than this are scattered once to the cluster. If `None`, send them with each chunk.
+
+    Returns
+    -------
+    The results in the order of the ``chunks``.
+    """
+    try:
+        from distributed import get_client, as_completed
+        from dask.utils import parse_bytes
+        from dask.sizeof import sizeof
+    except ImportError:
+        raise ImportError("Please install `distributed` as `pip install distributed`.") from None
+
+    try:
+        client = get_client()
+    except ValueError:
+        raise ValueError("Unable to find a `distributed.Client`. Create one before using `backend='dask'`.") from None
+
+    if max_nbytes is not None:
+        threshold = parse_bytes(max_nbytes) if isinstance(max_nbytes, str) else max_nbytes
+
+        def scatter(obj: Any) -> Any:
+            # wrap in a list so that containers are scattered as 1 object
+            return client.scatter([obj])[0] if sizeof(obj) > threshold else obj
+
+        args = [scatter(arg) for arg in args]
+        kwargs = {k: scatter(v) for k, v in kwargs.items()}
+
+    futures = [client.submit(_run_chunk, fn, [*chunk, *args], kwargs, pure=False) for chunk in chunks]
+    try:
+        if pbar is not None:
+            size = {fut.key: s for fut, s in zip(futures, sizes)}
+            for fut in as_completed(futures):
+                pbar.update(size[fut.key])
+        return client.gather(futures)  # type: ignore[no-any-return]
+    finally:
+        client.cancel(futures)
+        if pbar is not None:
+            pbar.close()
+
+
 def _get_n_cores(n_cores: Optional[int]) -> int:
     """
     Make number of cores a positive integer.
@@ -210,7 +472,7 @@ def _get_n_cores(n_cores: Optional[int]) -> int:
     Parameters
     ----------
     n_cores
-        Number of cores to use.
+        Number of cores to use. If `None`, use :attr:`squidpy.settings.n_jobs`.
 
     Returns
     -------
@@ -220,13 +482,86 @@ def _get_n_cores(n_cores: Optional[int]) -> int:
     if n_cores == 0:
         raise ValueError("Number of cores cannot be `0`.")
     if n_cores is None:
-        return 1
+        n_cores = settings.n_jobs
+        if n_cores is None:
+            return 1
     if n_cores < 0:
         return cpu_count() + 1 + n_cores
 
     return n_cores
 
 
+def _permutation_rng(seed: Optional[int], perm: int) -> np.random.Generator:
+    """
+    Return the random number generator of the ``perm``-th permutation.
+
+    It's the same as the ``perm``-th generator of ``np.random.SeedSequence(seed).spawn(n_perms)``,
+    so the permutations don't depend on how they are split into chunks. If ``seed = None``, use fresh entropy.
+    """
+    if seed is None:
+        return np.random.default_rng()
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(int(perm),)))
+
+
+def _get_backend(backend: Optional[str], default: str = "loky") -> str:
+    """Return ``backend`` if set, otherwise the one of :func:`worker_pool`, the settings or the ``default``."""
+    if backend is not None:
+        return backend
+    if _pool is not None:
+        return _pool.backend
+    return default if settings.backend is None else settings.backend
+
+
+@contextmanager
+def worker_pool(
+    n_jobs: Optional[int] = -1, backend: str = "loky", max_nbytes: Optional[Union[str, int]] = "1M"
+) -> Generator[None, None, None]:
+    """
+    Keep the same workers alive for all parallelized functions called within this context.
+
+    Otherwise, each call with ``n_jobs > 1`` may start new processes which need to import the libraries and compile
+    the :mod:`numba` kernels again, e.g. when ``n_jobs`` differs between the calls or the workers have been idle.
+
+    Parameters
+    ----------
+    n_jobs
+        Number of workers in the pool. Functions called with ``n_jobs > 1`` use all of them.
+        If `-1`, use all available cores.
+    backend
+        Which backend to use for multiprocessing. See :class:`joblib.Parallel` for valid options.
+        Functions called without ``backend`` use this one, functions called with a different one don't use the pool.
+    max_nbytes
+        Arrays larger than this are memory-mapped to the workers, see :class:`joblib.Parallel`.
+
+    Returns
+    -------
+    Nothing, the workers are stopped when exiting the context.
+
+    Examples
+    --------
+    .. code-block:: python
+
+        import squidpy as sq
+
+        with sq.worker_pool(n_jobs=8):
+            sq.gr.nhood_enrichment(adata, cluster_key="cluster", n_jobs=8)
+            sq.gr.ligrec(adata, cluster_key="cluster", n_jobs=8)
+    """
+    global _pool
+
+    prev = _pool
+    _pool = _WorkerPool(_get_n_cores(n_jobs), backend=backend, max_nbytes=max_nbytes)
+    try:
+        with _pool.parallel:
+            executor = getattr(_pool.parallel._backend, "_workers", None)
+            yield
+        if backend == "loky" and executor is not None:
+            # `joblib` keeps the processes for later calls, they would otherwise never time out
+            executor.shutdown(wait=True, kill_workers=True)
+    finally:
+        _pool = prev
+
+
 @contextmanager
 def verbosity(level: int) -> Generator[None, None, None]:
     """
@@ -10,6 +10,9 @@ from anndata import AnnData
 from scanpy._utils import check_presence_download
 import anndata
 
+from squidpy._settings import settings
+from squidpy._profiling import _profiled
+
 PathLike = Union[os.PathLike, str]
 Function_t = Callable[..., Union[AnnData, Any]]
 
@@ -30,8 +33,6 @@ class Metadata(ABC):
     def __post_init__(self) -> None:
         if self.doc_header is None:
             object.__setattr__(self, "doc_header", f"Download `{self.name.title().replace('_', ' ')}` data.")
-        if self.path is None:
-            object.__setattr__(self, "path", os.path.expanduser(f"~/.cache/squidpy/{self.name}"))
 
     @property
     @abstractmethod
@@ -64,9 +65,12 @@ class Metadata(ABC):
             glob_ns,
         )
 
+    @_profiled
     def download(self, fpath: Optional[PathLike] = None, **kwargs: Any) -> Any:
-        """Download the dataset into ``fpath``."""
-        fpath = str(self.path if fpath is None else fpath)
+        """Download the dataset into ``fpath``, by default into :attr:`squidpy.settings.cache_dir`."""
+        if fpath is None:
+            fpath = settings.cache_dir / self.name if self.path is None else self.path
+        fpath = str(fpath)
         if not fpath.endswith(self._extension):
             fpath += self._extension
 
@@ -102,7 +106,7 @@ class AMetadata(Metadata):
     Parameters
     ----------
     path
-        Path where to save the dataset.
+        Path where to save the dataset. If `None`, save it into :attr:`squidpy.settings.cache_dir`.
     kwargs
         Keyword arguments for :func:`scanpy.read`.
 
@@ -141,7 +145,7 @@ class ImgMetadata(Metadata):
     Parameters
     ----------
     path
-        Path where to save the .tiff image.
+        Path where to save the .tiff image. If `None`, save it into :attr:`squidpy.settings.cache_dir`.
     kwargs
         Keyword arguments for :meth:`squidpy.im.ImageContainer.add_img`.
 
@@ -14,6 +14,7 @@ from sklearn.metrics.pairwise import cosine_similarity, euclidean_distances
 import numpy as np
 
 from squidpy._docs import d, inject_docs
+from squidpy._profiling import _profiled
 from squidpy.gr._utils import _save_data, _assert_positive, _assert_spatial_basis
 from squidpy._constants._constants import CoordType, Transform
 from squidpy._constants._pkg_constants import Key
@@ -21,6 +22,7 @@ from squidpy._constants._pkg_constants import Key
 __all__ = ["spatial_neighbors"]
 
 
+@_profiled
 @d.dedent
 @inject_docs(t=Transform, c=CoordType)
 def spatial_neighbors(
@@ -6,40 +6,64 @@ from abc import ABC
 from types import MappingProxyType
 from typing import (
     Any,
+    Dict,
     List,
     Tuple,
     Union,
     Mapping,
     Iterable,
+    Iterator,
     Optional,
     Sequence,
     TYPE_CHECKING,
 )
 from functools import partial
+from contextlib import nullcontext
 from itertools import product
 from collections import namedtuple
+import os
+import weakref
+import tempfile
 
 from scanpy import logging as logg
 from anndata import AnnData
 
-from numba import njit, prange  # noqa: F401
-from scipy.sparse import csc_matrix
+from numba import njit, prange
+from scipy.sparse import issparse, spmatrix, csc_matrix, csr_matrix
 import numpy as np
 import pandas as pd
 
 from squidpy._docs import d, inject_docs
-from squidpy._utils import Signal, SigQueue, parallelize, _get_n_cores
+from squidpy._settings import settings
+from squidpy._profiling import _profiled
+from squidpy._utils import (
+    Signal,
+    SigQueue,
+    parallelize,
+    _get_backend,
+    _get_n_cores,
+    _numba_threads,
+    _permutation_rng,
+)
 from squidpy.gr._utils import (
     _save_data,
     _assert_positive,
     _create_sparse_df,
     _check_tuple_needles,
     _assert_categorical_obs,
+    _assert_connectivity_key,
+    _assert_non_empty_sequence,
+)
+from squidpy._constants._constants import (
+    CorrAxis,
+    TailModel,
+    LigrecFormat,
+    ComplexPolicy,
+    PermutationEngine,
 )
-from squidpy._constants._constants import CorrAxis, ComplexPolicy
 from squidpy._constants._pkg_constants import Key
 
-__all__ = ["ligrec", "PermutationTest"]
+__all__ = ["ligrec", "ligrec_warmup", "PermutationTest"]
 
 StrSeq = Sequence[str]
 SeqTuple = Sequence[Tuple[str, str]]
@@ -49,121 +73,234 @@ Cluster_t = Union[StrSeq, Tuple[StrSeq, StrSeq], SeqTuple]
 SOURCE = "source"
 TARGET = "target"
 
-TempResult = namedtuple("TempResult", ["means", "pvalues"])
-
-_template = """
-@njit(parallel={parallel}, cache=False, fastmath=False)
-def _test_{n_cls}_{ret_means}_{parallel}(
-    interactions: np.ndarray[np.uint32],
-    interaction_clusters: np.ndarray[np.uint32],
-    data: np.ndarray[np.float64],
-    clustering: np.ndarray[np.uint32],
-    mean: np.ndarray[np.float64],
-    mask: np.ndarray[np.bool_],
-    res: np.ndarray[np.float64],
-    {args}
+TempResult = namedtuple("TempResult", ["means", "pvalues", "n_perms", "null"], defaults=[None, None])
+
+_MATMUL_BATCH_BYTES = 256 * 1024 ** 2  # memory budget of 1 worker for a batch of permutations
+_EARLY_STOPPING_BATCH_SIZE = 50  # combinations are dropped from the active set after each batch
+_TAIL_MIN_EXCEEDANCES = 10  # below this, p-values are extrapolated from the tail model
+_TAIL_MAX_SIZE = 250  # maximum number of the largest permuted statistics used to fit the GPD
+_BACKED_CHUNK_BYTES = 128 * 1024 ** 2  # memory budget for reading a chunk of backed data
+
+
+@njit(cache=True, nogil=True, fastmath=False)
+def _test(
+    interactions: np.ndarray,
+    interaction_clusters: np.ndarray,
+    data: np.ndarray,
+    clustering: np.ndarray,
+    mean: np.ndarray,
+    mask: np.ndarray,
+    res: np.ndarray,
+    res_means: np.ndarray,
+    return_means: bool,
 ) -> None:
+    """
+    Update the exceedance counts in ``res`` with 1 permutation of ``clustering``.
 
-    {init}
-    {loop}
-    {finalize}
+    Compiled once for any number of clusters and cached on disk, see :func:`ligrec_warmup`.
+    """
+    n_cls = mean.shape[1]
+    groups = np.zeros((n_cls, data.shape[1]), dtype=np.float64)
+    sizes = np.zeros((n_cls,), dtype=np.int64)
 
-    for i in prange(len(interactions)):
-        rec, lig = interactions[i]
-        for j in prange(len(interaction_clusters)):
-            c1, c2 = interaction_clusters[j]
-            m1, m2 = mean[rec, c1], mean[lig, c2]
-
-            if m1 > 0 and m2 > 0:
-                {set_means}
-                if mask[rec, c1] and mask[lig, c2]:
-                    res[i, j] += (groups[c1, rec] + groups[c2, lig]) > (m1 + m2)  # division by 2 doesn't matter
-            else:
-                res[i, j] += np.nan
-                # res_means should be initialized all with 0s
-"""
+    # each cell belongs to 1 cluster of every cluster key
+    for row in range(data.shape[0]):
+        for k in range(clustering.shape[1]):
+            cl = clustering[row, k]
+            groups[cl] += data[row]
+            sizes[cl] += 1
+    for cl in range(n_cls):
+        groups[cl] /= sizes[cl]
 
+    for i in range(len(interactions)):
+        _update_res(i, interactions, interaction_clusters, groups, mean, mask, res, res_means, return_means)
 
-def _create_template(n_cls: int, return_means: bool = False, parallel: bool = True) -> str:
-    if n_cls <= 0:
-        raise ValueError(f"Expected number of clusters to be positive, found `{n_cls}`.")
 
-    rng = range(n_cls)
-    init = "".join(
-        f"""
-    g{i} = np.zeros((data.shape[1],), dtype=np.float64); s{i} = 0"""
-        for i in rng
-    )
+@njit(parallel=True, cache=True, nogil=True, fastmath=False)
+def _test_parallel(
+    interactions: np.ndarray,
+    interaction_clusters: np.ndarray,
+    data: np.ndarray,
+    clustering: np.ndarray,
+    mean: np.ndarray,
+    mask: np.ndarray,
+    res: np.ndarray,
+    res_means: np.ndarray,
+    return_means: bool,
+    n_chunks: int = 1,
+) -> None:
+    """Parallel version of :func:`_test`, the rows of ``data`` are split into ``n_chunks`` blocks."""
+    n_cells, n_genes = data.shape
+    n_cls = mean.shape[1]
+    n_chunks = max(1, min(n_chunks, n_cells))
+    step = (n_cells + n_chunks - 1) // n_chunks
+    partial_groups = np.zeros((n_chunks, n_cls, n_genes), dtype=np.float64)
+    partial_sizes = np.zeros((n_chunks, n_cls), dtype=np.int64)
+
+    # each thread accumulates a contiguous block of rows
+    for k in prange(n_chunks):
+        for row in range(k * step, min((k + 1) * step, n_cells)):
+            for key in range(clustering.shape[1]):
+                cl = clustering[row, key]
+                partial_groups[k, cl] += data[row]
+                partial_sizes[k, cl] += 1
+
+    groups = partial_groups.sum(axis=0)
+    sizes = partial_sizes.sum(axis=0)
+    for cl in range(n_cls):
+        groups[cl] /= sizes[cl]
 
-    loop_body = """
-        if cl == 0:
-            g0 += data[row]
-            s0 += 1"""
-    loop_body = loop_body + "".join(
-        f"""
-        elif cl == {i}:
-            g{i} += data[row]
-            s{i} += 1"""
-        for i in range(1, n_cls)
-    )
-    loop = f"""
-    for row in prange(data.shape[0]):
-        cl = clustering[row]
-        {loop_body}
+    for i in prange(len(interactions)):
+        _update_res(i, interactions, interaction_clusters, groups, mean, mask, res, res_means, return_means)
+
+
+@njit(cache=True, nogil=True, fastmath=False)
+def _update_res(
+    i: int,
+    interactions: np.ndarray,
+    interaction_clusters: np.ndarray,
+    groups: np.ndarray,
+    mean: np.ndarray,
+    mask: np.ndarray,
+    res: np.ndarray,
+    res_means: np.ndarray,
+    return_means: bool,
+) -> None:
+    rec, lig = interactions[i, 0], interactions[i, 1]
+    for j in range(len(interaction_clusters)):
+        c1, c2 = interaction_clusters[j, 0], interaction_clusters[j, 1]
+        m1, m2 = mean[rec, c1], mean[lig, c2]
+
+        if m1 > 0 and m2 > 0:
+            if return_means:
+                res_means[i, j] = (m1 + m2) / 2.0
+            if mask[rec, c1] and mask[lig, c2]:
+                res[i, j] += (groups[c1, rec] + groups[c2, lig]) > (m1 + m2)  # division by 2 doesn't matter
         else:
-            assert False, "Unhandled case."
+            res[i, j] += np.nan
+            # res_means should be initialized all with 0s
+
+
+@njit(cache=True, nogil=True, fastmath=False)
+def _group_stats_dense(
+    data: np.ndarray, clustering: np.ndarray, n_cls: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    sums = np.zeros((n_cls, data.shape[1]), dtype=np.float64)
+    nnz = np.zeros((n_cls, data.shape[1]), dtype=np.int64)
+    sizes = np.zeros((n_cls,), dtype=np.int64)
+
+    for row in range(data.shape[0]):
+        for k in range(clustering.shape[1]):
+            cl = clustering[row, k]
+            sizes[cl] += 1
+            for col in range(data.shape[1]):
+                val = data[row, col]
+                sums[cl, col] += val
+                nnz[cl, col] += val > 0
+
+    return sums, nnz, sizes
+
+
+@njit(cache=True, nogil=True, fastmath=False)
+def _group_stats_csr(
+    data: np.ndarray, indices: np.ndarray, indptr: np.ndarray, n_cols: int, clustering: np.ndarray, n_cls: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    sums = np.zeros((n_cls, n_cols), dtype=np.float64)
+    nnz = np.zeros((n_cls, n_cols), dtype=np.int64)
+    sizes = np.zeros((n_cls,), dtype=np.int64)
+
+    for row in range(indptr.shape[0] - 1):
+        for key in range(clustering.shape[1]):
+            cl = clustering[row, key]
+            sizes[cl] += 1
+            for k in range(indptr[row], indptr[row + 1]):
+                val = data[k]
+                sums[cl, indices[k]] += val
+                nnz[cl, indices[k]] += val > 0
+
+    return sums, nnz, sizes
+
+
+def _group_stats(
+    data: Union[np.ndarray, spmatrix], clustering: np.ndarray, n_cls: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
-    finalize = ", ".join(f"g{i} / s{i}" for i in rng)
-    finalize = f"groups = np.stack(({finalize}))"
+    Compute per-cluster statistics of genes in one pass over the data.
 
-    if return_means:
-        args = "res_means: np.ndarray[np.float64]"
-        set_means = "res_means[i, j] = (m1 + m2) / 2.0"
-    else:
-        args = set_means = ""
-
-    return _template.format(
-        n_cls=n_cls,
-        parallel=bool(parallel),
-        ret_means=int(return_means),
-        args=args,
-        init=init,
-        loop=loop,
-        finalize=finalize,
-        set_means=set_means,
-    )
+    Parameters
+    ----------
+    data
+        Array of shape `(n_cells, n_genes)`.
+    clustering
+        Array of shape `(n_cells,)` or `(n_cells, n_cluster_keys)` containing cluster labels ranging from `0` to
+        `n_cls - 1` inclusive. The labels of different cluster keys must not overlap.
+    n_cls
+        Number of clusters.
 
+    Returns
+    -------
+    Tuple of the following format:
 
-def _fdr_correct(
-    pvals: pd.DataFrame, corr_method: str, corr_axis: Union[str, CorrAxis], alpha: float = 0.05
-) -> pd.DataFrame:
-    """Correct p-values for FDR along specific axis in ``pvals``."""
-    from pandas.core.arrays.sparse import SparseArray
-    from statsmodels.stats.multitest import multipletests
-
-    def fdr(pvals: pd.Series[np.float64]) -> SparseArray[np.float64]:
-        _, qvals, _, _ = multipletests(
-            np.nan_to_num(pvals.values, copy=True, nan=1.0),
-            method=corr_method,
-            alpha=alpha,
-            is_sorted=False,
-            returnsorted=False,
+        - array of shape `(n_cls, n_genes)` containing the sum of expression.
+        - array of shape `(n_cls, n_genes)` containing the number of cells with positive expression.
+        - array of shape `(n_cls,)` containing the cluster sizes.
+    """
+    clustering = np.ascontiguousarray(clustering.reshape(clustering.shape[0], -1))
+    if issparse(data):
+        data = csr_matrix(data)
+        return _group_stats_csr(  # type: ignore[no-any-return]
+            data.data, data.indices, data.indptr, data.shape[1], clustering, n_cls
         )
-        qvals[np.isclose(qvals, 1.0)] = np.nan
 
-        return SparseArray(qvals, dtype=qvals.dtype, fill_value=np.nan)
+    return _group_stats_dense(np.asarray(data), clustering, n_cls)  # type: ignore[no-any-return]
 
+
+def _fdr_correct(
+    pvals: np.ndarray, corr_method: str, corr_axis: Union[str, CorrAxis], alpha: float = 0.05
+) -> np.ndarray:
+    """Correct p-values for FDR along specific axis in ``pvals``."""
     corr_axis = CorrAxis(corr_axis)
 
     if corr_axis == CorrAxis.CLUSTERS:
         # clusters are in columns
-        pvals = pvals.apply(fdr)
+        axis = 0
     elif corr_axis == CorrAxis.INTERACTIONS:
-        pvals = pvals.T.apply(fdr).T
+        axis = 1
     else:
         raise NotImplementedError(f"FDR correction for `{corr_axis}` is not implemented.")
 
-    return pvals
+    pvals = np.nan_to_num(pvals, copy=True, nan=1.0)
+    n = pvals.shape[axis]
+    if n == 0:
+        return pvals
+
+    if corr_method in ("fdr_bh", "fdr_by"):
+        # same as in `multipletests`, but for all columns/rows at once
+        shape = [1, 1]
+        shape[axis] = n
+        ecdffactor = (np.arange(1, n + 1) / float(n)).reshape(shape)
+        if corr_method == "fdr_by":
+            ecdffactor = ecdffactor / np.sum(1.0 / np.arange(1, n + 1))
+
+        order = np.argsort(pvals, axis=axis)
+        qvals = np.take_along_axis(pvals, order, axis=axis) / ecdffactor
+        qvals = np.flip(np.minimum.accumulate(np.flip(qvals, axis=axis), axis=axis), axis=axis)
+        qvals[qvals > 1] = 1
+        np.put_along_axis(pvals, order, qvals, axis=axis)
+        qvals = pvals
+    elif corr_method == "bonferroni":
+        qvals = np.minimum(pvals * n, 1.0)
+    else:
+        from statsmodels.stats.multitest import multipletests
+
+        qvals = np.apply_along_axis(
+            lambda p: multipletests(p, method=corr_method, alpha=alpha, is_sorted=False, returnsorted=False)[1],
+            axis,
+            pvals,
+        )
+    qvals[np.isclose(qvals, 1.0)] = np.nan
+
+    return qvals  # type: ignore[no-any-return]
 
 
 @d.get_full_description(base="PT")
@@ -181,6 +318,8 @@ class PermutationTestABC(ABC):
     Parameters
     ----------
     %(adata)s
+        If it's opened in backed mode, only the columns of the interacting genes are read, in chunks of cells,
+        and stored in a temporary memory-mapped file in :func:`tempfile.gettempdir`.
     use_raw
         Whether to access :attr:`anndata.AnnData.raw`.
     """
@@ -201,9 +340,11 @@ class PermutationTestABC(ABC):
                 raise ValueError(f"Expected `{adata.n_obs}` cells in `.raw` object, found `{adata.raw.n_obs}`.")
             adata = adata.raw
 
-        self._data = pd.DataFrame.sparse.from_spmatrix(
-            csc_matrix(adata.X), index=adata.obs_names, columns=adata.var_names
-        )
+        self._obs_names = adata.obs_names
+        # (n_cells, n_genes), backed data is only read when needed
+        self._data = adata.X if self._adata.isbacked else csc_matrix(adata.X)
+        # maps gene names to columns of `_data`
+        self._genes = pd.Series(np.arange(adata.n_vars), index=adata.var_names)
 
         self._interactions: Optional[pd.DataFrame] = None
         self._filtered_data: Optional[pd.DataFrame] = None
@@ -279,7 +420,7 @@ class PermutationTestABC(ABC):
             raise ValueError("The interactions are empty")
 
         # first uppercaseA, then drop duplicates
-        self._data.columns = self._data.columns.str.upper()
+        self._genes.index = self._genes.index.str.upper()
         self.interactions[SOURCE] = self.interactions[SOURCE].str.upper()
         self.interactions[TARGET] = self.interactions[TARGET].str.upper()
 
@@ -287,10 +428,10 @@ class PermutationTestABC(ABC):
         self.interactions.drop_duplicates(subset=(SOURCE, TARGET), inplace=True, keep="first")
 
         logg.debug("DEBUG: Removing duplicate genes in the data")
-        n_genes_prior = self._data.shape[1]
-        self._data = self._data.loc[:, ~self._data.columns.duplicated()]
-        if self._data.shape[1] != n_genes_prior:
-            logg.warning(f"Removed `{n_genes_prior - self._data.shape[1]}` duplicate gene(s)")
+        n_genes_prior = len(self._genes)
+        self._genes = self._genes[~self._genes.index.duplicated()]
+        if len(self._genes) != n_genes_prior:
+            logg.warning(f"Removed `{n_genes_prior - len(self._genes)}` duplicate gene(s)")
 
         self._filter_interactions_complexes(complex_policy)
         self._filter_interactions_by_genes()
@@ -301,14 +442,23 @@ class PermutationTestABC(ABC):
 
         return self
 
+    @_profiled
     @d.get_full_description(base="PT_test")
     @d.get_sections(base="PT_test", sections=["Parameters"])
     @d.dedent
-    @inject_docs(src=SOURCE, tgt=TARGET, fa=CorrAxis)
+    @inject_docs(
+        src=SOURCE,
+        tgt=TARGET,
+        fa=CorrAxis,
+        pe=PermutationEngine,
+        tm=TailModel,
+        lf=LigrecFormat,
+        min_exc=_TAIL_MIN_EXCEEDANCES,
+    )
     def test(
         self,
-        cluster_key: str,
-        clusters: Optional[Cluster_t] = None,
+        cluster_key: Union[str, Sequence[str]],
+        clusters: Optional[Union[Cluster_t, Mapping[str, Cluster_t]]] = None,
         n_perms: int = 1000,
         threshold: float = 0.01,
         seed: Optional[int] = None,
@@ -318,17 +468,27 @@ class PermutationTestABC(ABC):
         copy: bool = False,
         key_added: Optional[str] = None,
         numba_parallel: Optional[bool] = None,
+        engine: Union[str, PermutationEngine] = PermutationEngine.NUMBA.s,
+        early_stopping: Optional[int] = None,
+        tail_model: Optional[Union[str, TailModel]] = None,
+        connectivity_key: Optional[str] = None,
+        sample_key: Optional[str] = None,
+        result_format: Union[str, LigrecFormat] = LigrecFormat.SPARSE.s,
         **kwargs: Any,
-    ) -> Optional[Mapping[str, pd.DataFrame]]:
+    ) -> Optional[Mapping[str, Any]]:
         """
         Perform the permutation test as described in :cite:`cellphonedb`.
 
         Parameters
         ----------
-        %(cluster_key)s
+        cluster_key
+            Key in :attr:`anndata.AnnData.obs` where clustering is stored. If a sequence of keys, e.g. annotations
+            at several granularities, all of them are tested at once using the same permutations of the cells.
         clusters
             Clusters from :attr:`anndata.AnnData.obs` ``['{{cluster_key}}']``. Can be specified either as a sequence
             of :class:`tuple` or just a sequence of cluster names, in which case all combinations considered.
+            For multiple cluster keys, it can be a :class:`dict` mapping the keys to their clusters. Only cells
+            belonging to the selected clusters of every cluster key are used.
         %(n_perms)s
         threshold
             Do not perform permutation test if any of the interacting components is being expressed
@@ -345,8 +505,53 @@ class PermutationTestABC(ABC):
         %(copy)s
         key_added
             Key in :attr:`anndata.AnnData.uns` where the result is stored if ``copy = False``.
-            If `None`, ``'{{cluster_key}}_ligrec'`` will be used.
+            If `None`, ``'{{cluster_key}}_ligrec'`` will be used. For multiple cluster keys, it's used as a prefix,
+            i.e. ``'{{key_added}}_{{cluster_key}}'``.
         %(numba_parallel)s
+        engine
+            How to compute the permuted cluster means. Valid options are:
+
+                - `{pe.NUMBA.s!r}` - accumulate the means of each permutation in a compiled loop.
+                - `{pe.MATMUL.s!r}` - multiply a sparse one-hot matrix of a batch of permuted labels with the data.
+                  Avoids compiling a kernel for each number of clusters.
+
+            Both options yield the same results for the same ``seed``.
+        early_stopping
+            Stop permuting an interaction and cluster combination once its test statistic has been exceeded
+            ``early_stopping`` times, as in the sequential test of :cite:`besag1991`. Its p-value is then computed
+            from the number of permutations performed so far. This way, only combinations with small p-values
+            use all ``n_perms`` permutations. If `None`, always run all permutations.
+            Only available if ``engine = {pe.MATMUL.s!r}``.
+        tail_model
+            Model of the tail of the permutation null distribution used to compute p-values of combinations whose
+            test statistic has been exceeded less than `{min_exc}` times, see :cite:`knijnenburg2009`.
+            This gives p-values smaller than ``1 / n_perms``. Valid options are:
+
+                - `{tm.GPD.s!r}` - fit a generalized Pareto distribution to the largest permuted statistics.
+                - `{tm.GAMMA.s!r}` - fit a gamma distribution to the permuted statistics by the method of moments.
+                - `None` - use the empirical p-values.
+
+            Only available if ``engine = {pe.MATMUL.s!r}``.
+        connectivity_key
+            Key in :attr:`anndata.AnnData.obsp` where the spatial connectivities are stored.
+            If not `None`, only pairs of neighboring cells are considered. The test statistic of an interaction and
+            cluster combination is then the mean of ``{src!r}`` expression in the first cell times ``{tgt!r}``
+            expression in the second cell over all edges from the first to the second cluster.
+            Only available if ``engine = {pe.NUMBA.s!r}``.
+        sample_key
+            Key in :attr:`anndata.AnnData.obs` containing the samples, e.g. patients or conditions. If not `None`,
+            the test is run separately for each sample, reusing the filtered interactions and data. Samples are
+            distributed among the jobs by their number of cells and the results are stacked along the columns,
+            with ``sample_key`` as the outermost level. FDR correction is performed within each sample.
+        result_format
+            How to store the means and p-values. Valid options are:
+
+                - `{lf.SPARSE.s!r}` - :class:`pandas.DataFrame` with sparse columns, indexed by the interactions
+                  and cluster combinations.
+                - `{lf.ARRAY.s!r}` - dense :class:`numpy.ndarray` of type :class:`numpy.float32` with `NaN` p-values
+                  for combinations which were not tested. The rows and columns are described by the
+                  `'interactions'` and `'clusters'` arrays, the latter with ``sample_key`` as the first column.
+                  Faster to create and to write to `.h5ad` for many cluster combinations.
         %(parallelize)s
 
         Returns
@@ -354,110 +559,255 @@ class PermutationTestABC(ABC):
         %(ligrec_test_returns)s
         """
         _assert_positive(n_perms, name="n_perms")
-        _assert_categorical_obs(self._adata, key=cluster_key)
+        cluster_keys = _assert_non_empty_sequence(cluster_key, name="cluster keys")
+        for ck in cluster_keys:
+            _assert_categorical_obs(self._adata, key=ck)
+            if len(self._adata.obs[ck].cat.categories) <= 1:
+                raise ValueError(f"Expected at least `2` clusters, found `{len(self._adata.obs[ck].cat.categories)}`.")
+        if sample_key is not None:
+            _assert_categorical_obs(self._adata, key=sample_key)
+        engine = PermutationEngine(engine)
+        result_format = LigrecFormat(result_format)
+        if early_stopping is not None:
+            _assert_positive(early_stopping, name="early_stopping")
+            if engine != PermutationEngine.MATMUL:
+                raise ValueError(f"Early stopping is only available if `engine={PermutationEngine.MATMUL.s!r}`.")
+        if tail_model is not None:
+            tail_model = TailModel(tail_model)
+            if engine != PermutationEngine.MATMUL:
+                raise ValueError(f"Tail model is only available if `engine={PermutationEngine.MATMUL.s!r}`.")
+            if n_perms <= _TAIL_MIN_EXCEEDANCES:
+                raise ValueError(
+                    f"Expected `n_perms` to be greater than `{_TAIL_MIN_EXCEEDANCES}` "
+                    f"when using tail model, found `{n_perms}`."
+                )
+        if connectivity_key is not None:
+            _assert_connectivity_key(self._adata, connectivity_key)
+            if engine != PermutationEngine.NUMBA:
+                raise ValueError(
+                    f"Spatially constrained test is only available if `engine={PermutationEngine.NUMBA.s!r}`."
+                )
+            if len(cluster_keys) > 1:
+                raise ValueError("Spatially constrained test is only available for `1` cluster key.")
 
         if corr_method is not None:
             corr_axis = CorrAxis(corr_axis)
         if TYPE_CHECKING:
             assert isinstance(corr_axis, CorrAxis)
 
-        if len(self._adata.obs[cluster_key].cat.categories) <= 1:
-            raise ValueError(
-                f"Expected at least `2` clusters, found `{len(self._adata.obs[cluster_key].cat.categories)}`."
-            )
         if TYPE_CHECKING:
             assert isinstance(self.interactions, pd.DataFrame)
             assert isinstance(self._filtered_data, pd.DataFrame)
 
         interactions = self.interactions[[SOURCE, TARGET]]
-        self._filtered_data["clusters"] = self._adata.obs[cluster_key].astype("string").astype("category").values
-
-        if clusters is None:
-            clusters = list(map(str, self._adata.obs[cluster_key].cat.categories))
-        if all(isinstance(c, str) for c in clusters):
-            clusters = list(product(clusters, repeat=2))  # type: ignore[no-redef,assignment]
-        clusters = sorted(
-            _check_tuple_needles(
-                clusters,  # type: ignore[arg-type]
-                self._filtered_data["clusters"].cat.categories,
-                msg="Invalid cluster `{0!r}`.",
-                reraise=True,
+        keep = np.ones((self._adata.n_obs,), dtype=bool)
+        labels, cluster_combs = {}, {}
+        for ck in cluster_keys:
+            labels[ck] = self._adata.obs[ck].astype("string").astype("category").values
+            clusters_ = clusters.get(ck) if isinstance(clusters, Mapping) else clusters
+            if clusters_ is None:
+                clusters_ = list(map(str, self._adata.obs[ck].cat.categories))
+            if all(isinstance(c, str) for c in clusters_):
+                clusters_ = list(product(clusters_, repeat=2))  # type: ignore[no-redef,assignment]
+            cluster_combs[ck] = sorted(
+                _check_tuple_needles(
+                    clusters_,  # type: ignore[arg-type]
+                    labels[ck].categories,
+                    msg="Invalid cluster `{0!r}`.",
+                    reraise=True,
+                )
             )
-        )
-        clusters_flat = list({c for cs in clusters for c in cs})
-
-        data = self._filtered_data.loc[np.isin(self._filtered_data["clusters"], clusters_flat), :]
-        data["clusters"] = data["clusters"].cat.remove_unused_categories()
-        cat = data["clusters"].cat
-
-        cluster_mapper = dict(zip(cat.categories, range(len(cat.categories))))
-        gene_mapper = dict(zip(data.columns[:-1], range(len(data.columns) - 1)))  # -1 for 'clusters'
-
-        data.columns = [gene_mapper[c] if c != "clusters" else c for c in data.columns]
-        clusters_ = np.array([[cluster_mapper[c1], cluster_mapper[c2]] for c1, c2 in clusters], dtype=np.uint32)
+            clusters_flat = {c for cs in cluster_combs[ck] for c in cs}
+            # the same permutation is used for all cluster keys, so the cells must be the same
+            keep &= np.isin(labels[ck], list(clusters_flat))
+            labels[ck] = labels[ck].set_categories([c for c in labels[ck].categories if c in clusters_flat])
+
+        # memory-mapped for backed data, subsetting it doesn't load it into memory
+        data = _take_rows(self._filtered_data.values, keep)
+        gene_mapper = dict(zip(self._filtered_data.columns, range(len(self._filtered_data.columns))))
+
+        # cluster labels are consecutive across the cluster keys
+        offset, clusters_, clustering = 0, [], pd.DataFrame(index=np.arange(data.shape[0]))
+        for ck in cluster_keys:
+            cat = labels[ck][keep]
+            cluster_mapper = dict(zip(cat.categories, range(offset, offset + len(cat.categories))))
+            clusters_.append([[cluster_mapper[c1], cluster_mapper[c2]] for c1, c2 in cluster_combs[ck]])
+            clustering[ck] = cat.rename_categories(cluster_mapper)
+            offset += len(cat.categories)
+        n_combs = [len(cs) for cs in clusters_]
+        clusters_ = np.array([cs for css in clusters_ for cs in css], dtype=np.uint32)
 
-        cat.rename_categories(cluster_mapper, inplace=True)
         # much faster than applymap (tested on 1M interactions)
-        interactions_ = np.vectorize(lambda g: gene_mapper[g])(interactions.values)
+        interactions_ = np.vectorize(lambda g: gene_mapper[g])(interactions.values).astype(np.uint32)
 
         n_jobs = _get_n_cores(kwargs.pop("n_jobs", None))
-        start = logg.info(
-            f"Running `{n_perms}` permutations on `{len(interactions)}` interactions "
-            f"and `{len(clusters)}` cluster combinations using `{n_jobs}` core(s)"
-        )
-        res = _analysis(
-            data,
-            interactions_,
-            clusters_,
-            threshold=threshold,
-            n_perms=n_perms,
-            seed=seed,
-            n_jobs=n_jobs,
-            numba_parallel=numba_parallel,
-            **kwargs,
-        )
-
-        res = {
-            "means": _create_sparse_df(
-                res.means,
-                index=pd.MultiIndex.from_frame(interactions, names=[SOURCE, TARGET]),
-                columns=pd.MultiIndex.from_tuples(clusters, names=["cluster_1", "cluster_2"]),
-                fill_value=0,
-            ),
-            "pvalues": _create_sparse_df(
-                res.pvalues,
-                index=pd.MultiIndex.from_frame(interactions, names=[SOURCE, TARGET]),
-                columns=pd.MultiIndex.from_tuples(clusters, names=["cluster_1", "cluster_2"]),
-                fill_value=np.nan,
-            ),
-            "metadata": self.interactions[self.interactions.columns.difference([SOURCE, TARGET])],
+        graph = None if connectivity_key is None else csr_matrix(self._adata.obsp[connectivity_key])[keep][:, keep]
+        analysis_kwargs = {
+            "threshold": threshold,
+            "n_perms": n_perms,
+            "seed": seed,
+            "numba_parallel": numba_parallel,
+            "engine": engine,
+            "early_stopping": early_stopping,
+            "tail_model": tail_model,
         }
-        res["metadata"].index = res["means"].index.copy()
-
-        if TYPE_CHECKING:
-            assert isinstance(res, dict)
+        if sample_key is None:
+            start = logg.info(
+                f"Running `{n_perms}` permutations on `{len(interactions)}` interactions "
+                f"and `{len(clusters_)}` cluster combinations using `{n_jobs}` core(s)"
+            )
+            results = {
+                None: _analysis(
+                    data,
+                    clustering,
+                    interactions_,
+                    clusters_,
+                    n_jobs=n_jobs,
+                    graph=graph,
+                    **analysis_kwargs,
+                    **kwargs,
+                )
+            }
+        else:
+            samples = pd.Categorical(self._adata.obs[sample_key].values[keep]).remove_unused_categories()
+            start = logg.info(
+                f"Running `{n_perms}` permutations on `{len(interactions)}` interactions "
+                f"and `{len(clusters_)}` cluster combinations in `{len(samples.categories)}` samples "
+                f"using `{n_jobs}` core(s)"
+            )
+            results = _analysis_samples(
+                data,
+                clustering,
+                interactions_,
+                clusters_,
+                samples,
+                n_jobs=n_jobs,
+                graph=graph,
+                **analysis_kwargs,
+                **kwargs,
+            )
 
         if corr_method is not None:
             logg.info(
                 f"Performing FDR correction across the `{corr_axis.v}` "
                 f"using method `{corr_method}` at level `{alpha}`"
             )
-            res["pvalues"] = _fdr_correct(res["pvalues"], corr_method, corr_axis, alpha=alpha)
+
+        res = {}
+        for ck, end in zip(cluster_keys, np.cumsum(n_combs)):
+            cols = slice(end - len(cluster_combs[ck]), end)
+            res[ck] = self._format_result(
+                {k: TempResult(means=r.means[:, cols], pvalues=r.pvalues[:, cols]) for k, r in results.items()},
+                cluster_combs[ck],
+                corr_method=corr_method,
+                corr_axis=corr_axis,
+                alpha=alpha,
+                sample_key=sample_key,
+                result_format=result_format,
+            )
 
         if copy:
             logg.info("Finish", time=start)
-            return res
+            return res[cluster_key] if isinstance(cluster_key, str) else res
 
-        _save_data(self._adata, attr="uns", key=Key.uns.ligrec(cluster_key, key_added), data=res, time=start)
+        for ck in cluster_keys:
+            if key_added is not None and not isinstance(cluster_key, str):
+                key = Key.uns.ligrec(ck, f"{key_added}_{ck}")
+            else:
+                key = Key.uns.ligrec(ck, key_added)
+            _save_data(self._adata, attr="uns", key=key, data=res[ck], time=start)
+
+    def _format_result(
+        self,
+        results: Mapping[Any, TempResult],
+        clusters: Sequence[Tuple[str, str]],
+        corr_method: Optional[str],
+        corr_axis: CorrAxis,
+        alpha: float,
+        sample_key: Optional[str],
+        result_format: LigrecFormat,
+    ) -> Dict[str, Union[pd.DataFrame, np.ndarray]]:
+        """
+        Correct the p-values and store the results of 1 cluster key in the requested format.
+
+        Parameters
+        ----------
+        results
+            Results of :func:`_analysis` for each sample or for `None`, if ``sample_key = None``.
+        clusters
+            Cluster combinations of the results' columns.
+        corr_method
+            Correction method for multiple testing.
+        corr_axis
+            Axis over which to perform the FDR correction.
+        alpha
+            Significance level for FDR correction.
+        sample_key
+            Key in :attr:`anndata.AnnData.obs` containing the samples.
+        result_format
+            How to store the means and p-values.
+
+        Returns
+        -------
+        The results, see :meth:`test`.
+        """
+        if TYPE_CHECKING:
+            assert isinstance(self.interactions, pd.DataFrame)
+
+        interactions = self.interactions[[SOURCE, TARGET]]
+        means = {k: r.means for k, r in results.items()}
+        # `0` is not stored in the sparse format, where the fill value of p-values is `NaN`
+        pvalues = {k: np.where(r.pvalues == 0, np.nan, r.pvalues) for k, r in results.items()}
+        if corr_method is not None:
+            pvalues = {k: _fdr_correct(v, corr_method, corr_axis, alpha=alpha) for k, v in pvalues.items()}
+
+        metadata = self.interactions[self.interactions.columns.difference([SOURCE, TARGET])]
+        if result_format == LigrecFormat.ARRAY:
+            cls = np.asarray(clusters, dtype=object)
+            return {
+                "means": np.concatenate(list(means.values()), axis=1).astype(np.float32),
+                "pvalues": np.concatenate(list(pvalues.values()), axis=1).astype(np.float32),
+                "interactions": interactions.values.astype(object),
+                "clusters": cls
+                if sample_key is None
+                else np.vstack(
+                    [np.hstack([np.full((len(cls), 1), str(k), dtype=object), cls]) for k in results.keys()]
+                ),
+                "metadata": metadata.reset_index(drop=True),
+            }
+
+        index = pd.MultiIndex.from_frame(interactions, names=[SOURCE, TARGET])
+        columns = pd.MultiIndex.from_tuples(clusters, names=["cluster_1", "cluster_2"])
+        means = {k: _create_sparse_df(v, index=index, columns=columns, fill_value=0) for k, v in means.items()}
+        pvalues = {
+            # don't store the `NaN` explicitly
+            k: _create_sparse_df(np.nan_to_num(v, nan=0.0), index=index, columns=columns, fill_value=np.nan)
+            for k, v in pvalues.items()
+        }
+        res = {
+            "means": means[None] if sample_key is None else pd.concat(means, axis=1, names=[sample_key]),
+            "pvalues": pvalues[None] if sample_key is None else pd.concat(pvalues, axis=1, names=[sample_key]),
+            "metadata": metadata,
+        }
+        res["metadata"].index = res["means"].index.copy()
+
+        return res
 
     def _trim_data(self) -> None:
-        """Subset genes :attr:`_data` to those present in interactions."""
+        """Subset and densify genes in :attr:`_data` to those present in interactions."""
         if TYPE_CHECKING:
-            assert isinstance(self._data, pd.DataFrame)
             assert isinstance(self.interactions, pd.DataFrame)
 
         logg.debug("DEBUG: Removing genes not in any interaction")
-        self._filtered_data = self._data.loc[:, set(self.interactions[SOURCE]) | set(self.interactions[TARGET])]
+        genes = pd.unique(self.interactions[[SOURCE, TARGET]].values.ravel())
+        if self._adata.isbacked:
+            data = _create_memmap((len(self._obs_names), len(genes)))
+            for rows, cols, chunk in _iter_backed_columns(self._data, self._genes[genes].values):
+                data[rows, cols] = chunk
+            data.flush()
+        else:
+            data = self._data[:, self._genes[genes].values].toarray()
+        self._filtered_data = pd.DataFrame(data, index=self._obs_names, columns=genes)
 
     def _filter_interactions_by_genes(self) -> None:
         """Subset :attr:`interactions` to only those for which we have the data."""
@@ -466,7 +816,7 @@ class PermutationTestABC(ABC):
 
         logg.debug("DEBUG: Removing interactions with no genes in the data")
         self._interactions = self.interactions[
-            self.interactions[SOURCE].isin(self._data.columns) & self.interactions[TARGET].isin(self._data.columns)
+            self.interactions[SOURCE].isin(self._genes.index) & self.interactions[TARGET].isin(self._genes.index)
         ]
 
         if self.interactions.empty:
@@ -496,32 +846,23 @@ class PermutationTestABC(ABC):
         but no filtering happens at this stage - genes not present in the data are filtered at a later stage.
         """
 
-        def find_min_gene_in_complex(_complex: str) -> Optional[str]:
-            if "_" not in _complex:
-                return _complex
-            complexes = [c for c in _complex.split("_") if c in self._data.columns]
-            if not len(complexes):
-                return None
-            if len(complexes) == 1:
-                return complexes[0]
-
-            df = self._data[complexes].mean()
-
-            return str(df.index[df.argmin()])
-
         if TYPE_CHECKING:
             assert isinstance(self._interactions, pd.DataFrame)
             assert isinstance(self.interactions, pd.DataFrame)
 
         if complex_policy == ComplexPolicy.MIN:
             logg.debug("DEBUG: Selecting genes from complexes based on minimum average expression")
-            self.interactions[SOURCE] = self.interactions[SOURCE].apply(find_min_gene_in_complex)
-            self.interactions[TARGET] = self.interactions[TARGET].apply(find_min_gene_in_complex)
+            mapper = self._find_min_genes_in_complexes(
+                pd.unique(self.interactions[[SOURCE, TARGET]].values.ravel())  # type: ignore[arg-type]
+            )
+            for key in (SOURCE, TARGET):
+                is_complex = self.interactions[key].str.contains("_", regex=False)
+                self.interactions[key] = self.interactions[key].where(~is_complex, self.interactions[key].map(mapper))
         elif complex_policy == ComplexPolicy.ALL:
             logg.debug("DEBUG: Creating all gene combinations within complexes")
-            src = self.interactions.pop(SOURCE).apply(lambda s: s.split("_")).explode()
+            src = self.interactions.pop(SOURCE).str.split("_").explode()
             src.name = SOURCE
-            tgt = self.interactions.pop(TARGET).apply(lambda s: s.split("_")).explode()
+            tgt = self.interactions.pop(TARGET).str.split("_").explode()
             tgt.name = TARGET
 
             self._interactions = pd.merge(self.interactions, src, how="left", left_index=True, right_index=True)
@@ -529,6 +870,44 @@ class PermutationTestABC(ABC):
         else:
             raise NotImplementedError(f"Complex policy {complex_policy!r} is not implemented.")
 
+    def _find_min_genes_in_complexes(self, names: Sequence[str]) -> pd.Series:
+        """
+        Select the gene with the minimum average expression from each complex.
+
+        Parameters
+        ----------
+        names
+            Names of genes and complexes, components of the latter are separated by `'_'`.
+
+        Returns
+        -------
+        Series mapping complexes to the selected genes, `None` if none of the components are in the data.
+        Ties are resolved by the order of the components.
+        """
+        complexes = pd.Series([n for n in names if "_" in n], dtype=object)
+        if complexes.empty:
+            return pd.Series([], dtype=object)
+
+        parts = complexes.str.split("_").explode().rename("gene").to_frame()
+        parts["complex"] = complexes.values[parts.index]
+        parts = parts[parts["gene"].isin(self._genes.index)]
+
+        # single pass over all the genes present in any complex
+        genes = pd.unique(parts["gene"].values)
+        if self._adata.isbacked:
+            sums = np.zeros((len(genes),), dtype=np.float64)
+            for _, cols, chunk in _iter_backed_columns(self._data, self._genes[genes].values):
+                sums[cols] += chunk.sum(axis=0)
+            means = pd.Series(sums / len(self._obs_names), index=genes)
+        else:
+            means = pd.Series(np.asarray(self._data[:, self._genes[genes].values].mean(axis=0)).ravel(), index=genes)
+        parts["mean"] = means[parts["gene"].values].values
+
+        parts = parts.reset_index(drop=True).sort_values(["complex", "mean"], kind="mergesort")
+        mapper = parts.drop_duplicates(subset="complex", keep="first").set_index("complex")["gene"]
+
+        return mapper.reindex(complexes.values).astype(object).where(lambda s: s.notna(), None)
+
     @property
     def interactions(self) -> Optional[pd.DataFrame]:
         """The interactions."""  # noqa: D401
@@ -554,6 +933,7 @@ class PermutationTest(PermutationTestABC):
     %(PT.parameters)s
     """  # noqa: D400
 
+    @_profiled
     @d.get_sections(base="PT_prepare_full", sections=["Parameters"])
     @d.dedent
     def prepare(
@@ -616,10 +996,11 @@ class PermutationTest(PermutationTestABC):
         return self
 
 
+@_profiled
 @d.dedent
 def ligrec(
     adata: AnnData,
-    cluster_key: str,
+    cluster_key: Union[str, Sequence[str]],
     interactions: Optional[Interaction_t] = None,
     complex_policy: str = ComplexPolicy.MIN.v,
     threshold: float = 0.01,
@@ -629,7 +1010,7 @@ def ligrec(
     copy: bool = False,
     key_added: Optional[str] = None,
     **kwargs: Any,
-) -> Optional[Mapping[str, pd.DataFrame]]:
+) -> Optional[Mapping[str, Any]]:
     """
     %(PT_test.full_desc)s
 
@@ -660,7 +1041,8 @@ def ligrec(
 
 @d.dedent
 def _analysis(
-    data: pd.DataFrame,
+    data: np.ndarray,
+    clustering: pd.DataFrame,
     interactions: np.ndarray,
     interaction_clusters: np.ndarray,
     threshold: float = 0.1,
@@ -668,6 +1050,10 @@ def _analysis(
     seed: Optional[int] = None,
     n_jobs: int = 1,
     numba_parallel: Optional[bool] = None,
+    engine: PermutationEngine = PermutationEngine.NUMBA,
+    early_stopping: Optional[int] = None,
+    tail_model: Optional[TailModel] = None,
+    graph: Optional[csr_matrix] = None,
     **kwargs: Any,
 ) -> TempResult:
     """
@@ -678,7 +1064,10 @@ def _analysis(
     Parameters
     ----------
     data
-        Array of shape `(n_cells, n_genes)`.
+        Array of shape `(n_cells, n_genes)`. It's not copied if it's memory-mapped.
+    clustering
+        Categorical column for each cluster key whose categories are the cluster labels.
+        The labels must not overlap between the cluster keys.
     interactions
         Array of shape `(n_interactions, 2)`.
     interaction_clusters
@@ -690,9 +1079,21 @@ def _analysis(
     n_jobs
         Number of parallel jobs to launch.
     numba_parallel
-        Whether to use :class:`numba.prange` or not. If `None`, it's determined automatically.
+        Whether to use :class:`numba.prange` or not. If `None`, use :attr:`squidpy.settings.numba_parallel` or
+        determine it automatically.
+    engine
+        Whether to compute the permuted means using :func:`_analysis_helper` or :func:`_analysis_helper_matmul`.
+    early_stopping
+        Number of exceedances after which a combination is no longer permuted. If not `None`, the jobs permute
+        disjoint sets of combinations, each with all permutations, so that the results don't depend on ``n_jobs``.
+    tail_model
+        Model of the tail of the permutation null distribution. If `None`, use the empirical p-values.
+    graph
+        Spatial connectivities of shape `(n_cells, n_cells)`. If not `None`, use :func:`_analysis_helper_spatial`.
     kwargs
         Keyword arguments for :func:`squidpy._utils.parallelize`, such as ``n_jobs`` or ``backend``.
+        Unless using ``engine = 'matmul'``, ``backend`` defaults to the one of :func:`squidpy.worker_pool`,
+        :attr:`squidpy.settings.backend` or `'threading'`.
 
     Returns
     -------
@@ -711,22 +1112,90 @@ def _analysis(
         if TYPE_CHECKING:
             assert isinstance(means, np.ndarray)
 
-        pvalues = np.sum([r.pvalues for r in res if r.pvalues is not None], axis=0) / float(n_perms)
+        counts = np.sum([r.pvalues for r in res if r.pvalues is not None], axis=0)
+        # with early stopping, each job permutes all combinations it owns, the others are `0` unless not tested
+        n_done = float(n_perms) if early_stopping is None else np.max([r.n_perms for r in res], axis=0)
+        pvalues = counts / n_done
+        if tail_model is not None:
+            stat, _, tested = _combination_stats(mean, mask, interactions, interaction_clusters)
+            nulls = np.concatenate([r.null for r in res], axis=0)
+            if tail_model == TailModel.GPD:
+                null = np.partition(nulls, -(n_tail + 1), axis=0)[-(n_tail + 1) :]
+            else:
+                null = np.sum(nulls.reshape(n_jobs, 2, -1), axis=0)
+            ti, tj = np.nonzero(tested)
+            pvalues[ti, tj] = _tail_pvalues(
+                pvalues[ti, tj],
+                counts[ti, tj],
+                n_done if early_stopping is None else n_done[ti, tj],
+                stat[ti, tj],
+                null,
+                n_perms=n_perms,
+                tail_model=tail_model,
+            )
         assert means.shape == pvalues.shape, f"Means and p-values differ in shape: `{means.shape}`, `{pvalues.shape}`."
 
         return TempResult(means=means, pvalues=pvalues)
 
-    groups = data.groupby("clusters")
-    clustering = np.array(data["clusters"].values, dtype=np.int32)
-
-    mean = groups.mean().values.T  # (n_genes, n_clusters)
-    mask = groups.apply(lambda c: ((c > 0).sum() / len(c)) >= threshold).values.T  # (n_genes, n_clusters)
+    n_cls = sum(len(clustering[c].cat.categories) for c in clustering.columns)
+    # (n_cells, n_cluster_keys)
+    clustering = np.array(np.stack([clustering[c].values for c in clustering.columns], axis=1), dtype=np.int32)
     # (n_cells, n_genes)
-    data = np.array(data[data.columns.difference(["clusters"])].values, dtype=np.float64, order="C")
+    data = np.asarray(data, dtype=settings.dtype, order="C")
+
+    sums, nnz, sizes = _group_stats(data, clustering, n_cls)
+    with np.errstate(divide="ignore", invalid="ignore"):  # clusters can be missing in a sample
+        mean = np.ascontiguousarray((sums / sizes[:, np.newaxis]).T)  # (n_genes, n_clusters)
+        mask = np.ascontiguousarray((nnz / sizes[:, np.newaxis] >= threshold).T)  # (n_genes, n_clusters)
     # all 3 should be C contiguous
 
+    if graph is not None:
+        callback, cb_kwargs = _analysis_helper_spatial, {
+            "indptr": graph.indptr.astype(np.int64),
+            "indices": graph.indices.astype(np.int32),
+        }
+        # the kernels release the GIL, threads don't need to spawn processes or receive a copy of the data
+        kwargs["backend"] = _get_backend(kwargs.get("backend"), default="threading")
+    elif engine == PermutationEngine.MATMUL:
+        n_tail = min(_TAIL_MAX_SIZE, max(_TAIL_MIN_EXCEEDANCES, n_perms // 4))
+        callback, cb_kwargs = _analysis_helper_matmul, {
+            "sizes": sizes,
+            "early_stopping": early_stopping,
+            "tail_model": tail_model,
+            "n_tail": n_tail,
+        }
+        if early_stopping is not None:
+            # the stopping rule needs all permutations of a combination in order, split the combinations instead
+            _, _, tested = _combination_stats(mean, mask, interactions, interaction_clusters)
+            combinations = [np.arange(i, int(tested.sum()), n_jobs) for i in range(n_jobs)]
+            return parallelize(  # type: ignore[no-any-return]
+                _analysis_helper_matmul_combinations,
+                combinations,
+                n_jobs=n_jobs,
+                n_split=0,
+                unit="combination",
+                use_ixs=True,
+                extractor=extractor,
+                **kwargs,
+            )(
+                data,
+                mean,
+                mask,
+                interactions,
+                interaction_clusters=interaction_clusters,
+                clustering=clustering,
+                seed=seed,
+                n_perms=n_perms,
+                **cb_kwargs,
+            )
+    else:
+        if numba_parallel is None:
+            numba_parallel = settings.numba_parallel
+        callback, cb_kwargs = _analysis_helper, {"numba_parallel": numba_parallel}
+        kwargs["backend"] = _get_backend(kwargs.get("backend"), default="threading")
+
     return parallelize(  # type: ignore[no-any-return]
-        _analysis_helper,
+        callback,
         np.arange(n_perms, dtype=np.int32),
         n_jobs=n_jobs,
         unit="permutation",
@@ -740,10 +1209,124 @@ def _analysis(
         interaction_clusters=interaction_clusters,
         clustering=clustering,
         seed=seed,
-        numba_parallel=numba_parallel,
+        **cb_kwargs,
     )
 
 
+def _analysis_samples(
+    data: np.ndarray,
+    clustering: pd.DataFrame,
+    interactions: np.ndarray,
+    interaction_clusters: np.ndarray,
+    samples: pd.Categorical,
+    n_jobs: int = 1,
+    graph: Optional[csr_matrix] = None,
+    backend: Optional[str] = None,
+    show_progress_bar: bool = True,
+    **kwargs: Any,
+) -> Mapping[Any, TempResult]:
+    """
+    Run :func:`_analysis` separately for each sample.
+
+    Parameters
+    ----------
+    data
+        Array of shape `(n_cells, n_genes)`.
+    clustering
+        Categorical column for each cluster key, see :func:`_analysis`.
+    interactions
+        Array of shape `(n_interactions, 2)`.
+    interaction_clusters
+        Array of shape `(n_interaction_clusters, 2)`.
+    samples
+        Array of shape `(n_cells,)` containing the samples.
+    n_jobs
+        Number of parallel jobs to launch.
+    graph
+        Spatial connectivities of shape `(n_cells, n_cells)`.
+    backend
+        Which backend to use for multiprocessing. See :class:`joblib.Parallel` for valid options.
+    show_progress_bar
+        Whether to show the progress bar.
+    kwargs
+        Keyword arguments for :func:`_analysis` and :func:`squidpy._utils.parallelize`.
+
+    Returns
+    -------
+    The results of :func:`_analysis` for each sample, in the order of the categories of ``samples``.
+    """
+    sizes = np.bincount(samples.codes, minlength=len(samples.categories))
+    # largest samples first, each goes to the least loaded job
+    bins: List[List[int]] = [[] for _ in range(min(n_jobs, len(sizes)))]
+    loads = np.zeros((len(bins),), dtype=np.int64)
+    for ix in np.argsort(-sizes, kind="stable"):
+        b = int(np.argmin(loads))
+        bins[b].append(ix)
+        loads[b] += sizes[ix]
+
+    res = parallelize(
+        _analysis_samples_helper,
+        bins,
+        n_jobs=len(bins),
+        n_split=0,
+        unit="sample",
+        extractor=lambda rs: dict(kv for r in rs for kv in r),
+        backend=backend,
+        show_progress_bar=show_progress_bar,
+        max_nbytes=kwargs.pop("max_nbytes", "1M"),
+    )(
+        data,
+        clustering,
+        interactions,
+        interaction_clusters,
+        codes=samples.codes,
+        graph=graph,
+        **kwargs,
+    )
+
+    return {cat: res[i] for i, cat in enumerate(samples.categories)}
+
+
+def _analysis_samples_helper(
+    ixs: Sequence[int],
+    data: np.ndarray,
+    clustering: pd.DataFrame,
+    interactions: np.ndarray,
+    interaction_clusters: np.ndarray,
+    codes: np.ndarray,
+    graph: Optional[csr_matrix] = None,
+    queue: Optional[SigQueue] = None,
+    **kwargs: Any,
+) -> List[Tuple[int, TempResult]]:
+    """Run :func:`_analysis` sequentially for the samples with codes ``ixs``."""
+    res = []
+    for ix in ixs:
+        mask = codes == ix
+        res.append(
+            (
+                ix,
+                _analysis(
+                    _take_rows(data, mask),
+                    clustering.iloc[mask],
+                    interactions,
+                    interaction_clusters,
+                    n_jobs=1,
+                    graph=None if graph is None else graph[mask][:, mask],
+                    show_progress_bar=False,
+                    **kwargs,
+                ),
+            )
+        )
+
+        if queue is not None:
+            queue.put(Signal.UPDATE)
+
+    if queue is not None:
+        queue.put(Signal.FINISH)
+
+    return res
+
+
 def _analysis_helper(
     perms: np.ndarray,
     data: np.ndarray,
@@ -762,7 +1345,7 @@ def _analysis_helper(
     Parameters
     ----------
     perms
-        Permutation indices. Only used to set the ``seed``.
+        Permutation indices. Only used to select the random number generators, see :func:`_permutation_rng`.
     data
         Array of shape `(n_cells, n_genes)`.
     mean
@@ -775,9 +1358,9 @@ def _analysis_helper(
     interaction_clusters
         Array of shape `(n_interaction_clusters, 2)`.
     clustering
-        Array of shape `(n_cells,)` containing the original clustering.
+        Array of shape `(n_cells, n_cluster_keys)` containing the original clustering.
     seed
-        Random seed for :class:`numpy.random.RandomState`.
+        Random seed of the permutations.
     numba_parallel
         Whether to use :class:`numba.prange` or not. If `None`, it's determined automatically.
     queue
@@ -792,36 +1375,295 @@ def _analysis_helper(
         - `'pvalues'` - array of shape `(n_interactions, n_interaction_clusters)`  containing `np.sum(T0 > T)`
           where `T0` is the test statistic under null hypothesis and `T` is the true test statistic.
     """
-    rs = np.random.RandomState(None if seed is None else perms[0] + seed)
-
-    clustering = clustering.copy()
-    n_cls = mean.shape[1]
-    return_means = np.min(perms) == 0
+    orig_clustering, clustering = clustering, clustering.copy()
+    return_means = bool(np.min(perms) == 0)
 
     # ideally, these would be both sparse array, but there is no numba impl. (sparse.COO is read-only and very limited)
     # keep it f64, because we're setting NaN
     res = np.zeros((len(interactions), len(interaction_clusters)), dtype=np.float64)
+    res_means = np.zeros_like(res) if return_means else np.zeros((0, 0), dtype=np.float64)
     numba_parallel = (
         (np.prod(res.shape) >= 2 ** 20 or clustering.shape[0] >= 2 ** 15) if numba_parallel is None else numba_parallel
     )
+    with _numba_threads() if numba_parallel else nullcontext() as n_threads:
+        test = _test if n_threads is None else partial(_test_parallel, n_chunks=n_threads)
 
-    fn_key = f"_test_{n_cls}_{int(return_means)}_{bool(numba_parallel)}"
-    if fn_key not in globals():
-        exec(
-            compile(_create_template(n_cls, return_means=return_means, parallel=numba_parallel), "", "exec"), globals()
-        )
-    _test = globals()[fn_key]
+        for perm in perms:
+            clustering[:] = _permutation_rng(seed, perm).permutation(orig_clustering)
+            test(interactions, interaction_clusters, data, clustering, mean, mask, res, res_means, return_means)
 
-    if return_means:
-        res_means: Optional[np.ndarray] = np.zeros((len(interactions), len(interaction_clusters)), dtype=np.float64)
-        test = partial(_test, res_means=res_means)
-    else:
-        res_means = None
-        test = _test
+            if queue is not None:
+                queue.put(Signal.UPDATE)
+
+    if queue is not None:
+        queue.put(Signal.FINISH)
+
+    return TempResult(means=res_means if return_means else None, pvalues=res)
+
+
+def _analysis_helper_matmul(
+    perms: np.ndarray,
+    data: np.ndarray,
+    mean: np.ndarray,
+    mask: np.ndarray,
+    interactions: np.ndarray,
+    interaction_clusters: np.ndarray,
+    clustering: np.ndarray,
+    sizes: np.ndarray,
+    seed: Optional[int] = None,
+    early_stopping: Optional[int] = None,
+    tail_model: Optional[TailModel] = None,
+    n_tail: int = _TAIL_MAX_SIZE,
+    combinations: Optional[np.ndarray] = None,
+    queue: Optional[SigQueue] = None,
+) -> TempResult:
+    """
+    Run the shuffled analysis by multiplying a sparse one-hot matrix of permuted labels with the data.
 
-    for _ in perms:
-        rs.shuffle(clustering)
-        test(interactions, interaction_clusters, data, clustering, mean, mask, res=res)
+    Permutations are processed in batches whose size is determined by :data:`_MATMUL_BATCH_BYTES`.
+    The random state is advanced in the same way as in :func:`_analysis_helper`.
+
+    Parameters
+    ----------
+    perms
+        Permutation indices. Only used to select the random number generators, see :func:`_permutation_rng`.
+    data
+        Array of shape `(n_cells, n_genes)`.
+    mean
+        Array of shape `(n_genes, n_clusters)` representing mean expression per cluster.
+    mask
+        Array of shape `(n_genes, n_clusters)` containing `True` if the a gene within a cluster is
+        expressed at least in ``threshold`` percentage of cells.
+    interactions
+        Array of shape `(n_interactions, 2)`.
+    interaction_clusters
+        Array of shape `(n_interaction_clusters, 2)`.
+    clustering
+        Array of shape `(n_cells, n_cluster_keys)` containing the original clustering.
+    sizes
+        Array of shape `(n_clusters,)` containing the number of cells in each cluster.
+    seed
+        Random seed of the permutations.
+    early_stopping
+        Stop permuting a combination once its test statistic has been exceeded this many times.
+    tail_model
+        Model of the tail of the permutation null distribution.
+    n_tail
+        Number of the largest permuted statistics used to fit :attr:`squidpy.constants.TailModel.GPD`.
+    combinations
+        Positions of the tested combinations to permute, in the order of :func:`numpy.nonzero`.
+        If `None`, permute all of them. Otherwise, the progress is reported for each decided combination.
+    queue
+        Signalling queue to update progress bar.
+
+    Returns
+    -------
+    The same as :func:`_analysis_helper`. If ``early_stopping != None``, `'n_perms'` is an array of shape
+    `(n_interactions, n_interaction_clusters)` containing the number of permutations performed, `0` for
+    the tested combinations not in ``combinations``.
+    If ``tail_model != None``, `'null'` is an array of shape `(n_tail + 1, n_tested)` containing the largest
+    permuted statistics or of shape `(2, n_tested)` containing their sum and the sum of their squares.
+    """
+    n_cells, n_genes = data.shape
+    n_cls, n_keys = mean.shape[1], clustering.shape[1]
+
+    rec, lig = interactions[:, 0].astype(np.intp), interactions[:, 1].astype(np.intp)
+    c1, c2 = interaction_clusters[:, 0].astype(np.intp), interaction_clusters[:, 1].astype(np.intp)
+    stat, valid, tested = _combination_stats(mean, mask, interactions, interaction_clusters)
+
+    res = np.where(valid, 0.0, np.nan)
+    res_means = np.where(valid, stat / 2.0, 0.0) if np.min(perms) == 0 else None
+    res_perms = np.full(res.shape, len(perms), dtype=np.int64) if early_stopping is not None else None
+    if combinations is not None and res_perms is not None:
+        res_perms[tested] = 0
+
+    # the one-hot matrix, permuted means and test statistics of 1 permutation
+    perm_bytes = 8 * (3 * n_cells * n_keys + n_cls * n_genes + 3 * int(tested.sum()))
+    null: Optional[np.ndarray] = None
+    if tail_model == TailModel.GPD:
+        null = np.full((n_tail + 1, int(tested.sum())), -np.inf)
+        perm_bytes += 8 * null.size  # partitioning the candidates
+    elif tail_model == TailModel.GAMMA:
+        null = np.zeros((2, int(tested.sum())))
+    batch_size = int(np.clip(_MATMUL_BATCH_BYTES // perm_bytes, 1, len(perms)))
+    if early_stopping is not None:
+        batch_size = min(batch_size, _EARLY_STOPPING_BATCH_SIZE)
+    cols = np.repeat(np.arange(n_cells, dtype=np.int32), n_keys)
+
+    ai, aj = np.nonzero(tested)  # combinations which are still being permuted
+    act = np.arange(len(ai))  # their position among all tested combinations
+    if combinations is not None:
+        ai, aj, act = ai[combinations], aj[combinations], act[combinations]
+        if res_perms is not None:
+            res_perms[ai, aj] = len(perms)
+    genes, inv = np.unique(np.concatenate([rec[ai], lig[ai]]), return_inverse=True)
+    # `data` can be a read-only memory-mapped array shared by all workers, only copy if needed
+    sub_data = data if len(genes) == n_genes else np.ascontiguousarray(data[:, genes])
+
+    for start in range(0, len(perms), batch_size):
+        n_batch = min(batch_size, len(perms) - start)
+        n_decided = 0
+        if len(ai):
+            labels = np.empty((n_batch, n_cells, n_keys), dtype=np.int64)
+            for b in range(n_batch):
+                labels[b] = _permutation_rng(seed, perms[start + b]).permutation(clustering)
+            labels += n_cls * np.arange(n_batch)[:, None, None]
+
+            # (n_batch * n_clusters, n_cells), each cell is in 1 cluster of every cluster key
+            onehot = csr_matrix(
+                (np.ones(labels.size, dtype=np.float64), (labels.ravel(), np.tile(cols, n_batch))),
+                shape=(n_batch * n_cls, n_cells),
+            )
+            with np.errstate(divide="ignore", invalid="ignore"):  # clusters can be missing in a sample
+                groups = (onehot @ sub_data).reshape(n_batch, n_cls, len(genes)) / sizes[None, :, None]
+            n_active = len(ai)
+            perm_stat = groups[:, c1[aj], inv[:n_active]] + groups[:, c2[aj], inv[n_active:]]
+            exceeded = perm_stat > stat[ai, aj]  # (n_batch, n_active)
+
+            if tail_model == TailModel.GPD:
+                cand = np.concatenate([null[:, act], perm_stat], axis=0)
+                null[:, act] = np.partition(cand, -(n_tail + 1), axis=0)[-(n_tail + 1) :]
+            elif tail_model == TailModel.GAMMA:
+                null[0, act] += perm_stat.sum(axis=0)
+                null[1, act] += (perm_stat ** 2).sum(axis=0)
+
+            if early_stopping is None:
+                res[ai, aj] += exceeded.sum(axis=0)
+            else:
+                cumsum = res[ai, aj][None, :] + np.cumsum(exceeded, axis=0)
+                done = cumsum[-1] >= early_stopping
+                res[ai, aj] = np.minimum(cumsum[-1], early_stopping)
+                # number of permutations until the `early_stopping`-th exceedance
+                res_perms[ai[done], aj[done]] = start + np.argmax(cumsum[:, done] >= early_stopping, axis=0) + 1
+
+                n_decided = int(np.sum(done))
+                if n_decided:
+                    ai, aj, act = ai[~done], aj[~done], act[~done]
+                    genes_, inv = np.unique(np.concatenate([rec[ai], lig[ai]]), return_inverse=True)
+                    if len(genes_) < len(genes):
+                        genes, sub_data = genes_, np.ascontiguousarray(data[:, genes_])
+
+        if queue is not None:
+            for _ in range(n_batch if combinations is None else n_decided):
+                queue.put(Signal.UPDATE)
+
+    if queue is not None:
+        # the remaining combinations were decided after all permutations
+        for _ in range(0 if combinations is None else len(ai)):
+            queue.put(Signal.UPDATE)
+        queue.put(Signal.FINISH)
+
+    return TempResult(means=res_means, pvalues=res, n_perms=res_perms, null=null)
+
+
+def _analysis_helper_matmul_combinations(
+    ix: int, combinations: np.ndarray, *args: Any, n_perms: int, **kwargs: Any
+) -> TempResult:
+    """
+    Run :func:`_analysis_helper_matmul` with all ``n_perms`` permutations for a subset of the tested combinations.
+
+    All jobs draw the same permutations, so that the sequential stopping rule sees them in the same order
+    as when running a single job.
+
+    Parameters
+    ----------
+    ix
+        Index of the job, only the first one returns the means.
+    combinations
+        Positions of the tested combinations to permute.
+    args
+        Positional arguments for :func:`_analysis_helper_matmul`.
+    n_perms
+        Number of permutations.
+    kwargs
+        Keyword arguments for :func:`_analysis_helper_matmul`.
+
+    Returns
+    -------
+    The same as :func:`_analysis_helper_matmul`.
+    """
+    res = _analysis_helper_matmul(np.arange(n_perms, dtype=np.int32), *args, combinations=combinations, **kwargs)
+
+    return res if ix == 0 else res._replace(means=None)
+
+
+def _analysis_helper_spatial(
+    perms: np.ndarray,
+    data: np.ndarray,
+    mean: np.ndarray,
+    mask: np.ndarray,
+    interactions: np.ndarray,
+    interaction_clusters: np.ndarray,
+    clustering: np.ndarray,
+    indptr: np.ndarray,
+    indices: np.ndarray,
+    seed: Optional[int] = None,
+    queue: Optional[SigQueue] = None,
+) -> TempResult:
+    """
+    Run the shuffled analysis restricted to pairs of neighboring cells.
+
+    Parameters
+    ----------
+    perms
+        Permutation indices. Only used to select the random number generators, see :func:`_permutation_rng`.
+    data
+        Array of shape `(n_cells, n_genes)`.
+    mean
+        Array of shape `(n_genes, n_clusters)` representing mean expression per cluster.
+    mask
+        Array of shape `(n_genes, n_clusters)` containing `True` if the a gene within a cluster is
+        expressed at least in ``threshold`` percentage of cells.
+    interactions
+        Array of shape `(n_interactions, 2)`.
+    interaction_clusters
+        Array of shape `(n_interaction_clusters, 2)`.
+    clustering
+        Array of shape `(n_cells, n_cluster_keys)` containing the original clustering.
+    indptr
+        :attr:`scipy.sparse.csr_matrix.indptr` of the spatial connectivities.
+    indices
+        :attr:`scipy.sparse.csr_matrix.indices` of the spatial connectivities.
+    seed
+        Random seed of the permutations.
+    queue
+        Signalling queue to update progress bar.
+
+    Returns
+    -------
+    The same as :func:`_analysis_helper`, `'means'` contain the mean product over the edges.
+    """
+    orig_clustering = clustering[:, 0]  # only 1 cluster key is supported
+    clustering = orig_clustering.copy()
+    n_cls = mean.shape[1]
+    pair_ixs = np.full((n_cls, n_cls), -1, dtype=np.int64)
+    pairs = np.unique(interaction_clusters.astype(np.int64), axis=0)
+    pair_ixs[pairs[:, 0], pairs[:, 1]] = np.arange(len(pairs))
+    cols = pair_ixs[interaction_clusters[:, 0], interaction_clusters[:, 1]]
+
+    sums = np.zeros((len(pairs), len(interactions)), dtype=np.float64)
+    n_edges = np.zeros((len(pairs),), dtype=np.int64)
+
+    def edge_means() -> np.ndarray:
+        sums[:] = 0
+        n_edges[:] = 0
+        _edge_sums(interactions, data, clustering, indptr, indices, pair_ixs, sums, n_edges)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # (n_interactions, n_interaction_clusters)
+            return np.where(n_edges[:, None] > 0, sums / n_edges[:, None], 0.0)[cols].T
+
+    rec, lig = interactions[:, 0].astype(np.intp), interactions[:, 1].astype(np.intp)
+    c1, c2 = interaction_clusters[:, 0].astype(np.intp), interaction_clusters[:, 1].astype(np.intp)
+    stat = edge_means()
+    valid = stat > 0
+    tested = valid & mask[rec[:, None], c1[None, :]] & mask[lig[:, None], c2[None, :]]
+
+    res = np.where(valid, 0.0, np.nan)
+    res_means = np.where(valid, stat, 0.0) if np.min(perms) == 0 else None
+
+    for perm in perms:
+        clustering[:] = _permutation_rng(seed, perm).permutation(orig_clustering)
+        res += (edge_means() > stat) & tested
 
         if queue is not None:
             queue.put(Signal.UPDATE)
@@ -830,3 +1672,275 @@ def _analysis_helper(
         queue.put(Signal.FINISH)
 
     return TempResult(means=res_means, pvalues=res)
+
+
+@njit(cache=True, nogil=True, fastmath=False)
+def _edge_sums(
+    interactions: np.ndarray,
+    data: np.ndarray,
+    clustering: np.ndarray,
+    indptr: np.ndarray,
+    indices: np.ndarray,
+    pair_ixs: np.ndarray,
+    sums: np.ndarray,
+    n_edges: np.ndarray,
+) -> None:
+    """
+    Walk the edge list once and accumulate source expression of the first times target expression of the second cell.
+
+    Parameters
+    ----------
+    interactions
+        Array of shape `(n_interactions, 2)`.
+    data
+        Array of shape `(n_cells, n_genes)`.
+    clustering
+        Array of shape `(n_cells,)` containing the clustering.
+    indptr
+        :attr:`scipy.sparse.csr_matrix.indptr` of the spatial connectivities.
+    indices
+        :attr:`scipy.sparse.csr_matrix.indices` of the spatial connectivities.
+    pair_ixs
+        Array of shape `(n_clusters, n_clusters)` containing the row in ``sums`` of each cluster pair,
+        `-1` if the pair is not tested.
+    sums
+        Array of shape `(n_pairs, n_interactions)` where the sums are accumulated.
+    n_edges
+        Array of shape `(n_pairs,)` where the number of edges is accumulated.
+
+    Returns
+    -------
+    Nothing, just updates ``sums`` and ``n_edges``.
+    """
+    for i in range(len(indptr) - 1):
+        c1 = clustering[i]
+        for e in range(indptr[i], indptr[i + 1]):
+            j = indices[e]
+            p = pair_ixs[c1, clustering[j]]
+            if p < 0:
+                continue
+            n_edges[p] += 1
+            for k in range(len(interactions)):
+                sums[p, k] += data[i, interactions[k, 0]] * data[j, interactions[k, 1]]
+
+
+def _combination_stats(
+    mean: np.ndarray, mask: np.ndarray, interactions: np.ndarray, interaction_clusters: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Compute the test statistic of each interaction and cluster combination.
+
+    Parameters
+    ----------
+    mean
+        Array of shape `(n_genes, n_clusters)` representing mean expression per cluster.
+    mask
+        Array of shape `(n_genes, n_clusters)` containing `True` if the a gene within a cluster is
+        expressed at least in ``threshold`` percentage of cells.
+    interactions
+        Array of shape `(n_interactions, 2)`.
+    interaction_clusters
+        Array of shape `(n_interaction_clusters, 2)`.
+
+    Returns
+    -------
+    Arrays of shape `(n_interactions, n_interaction_clusters)` containing the test statistic, whether both
+    means are positive and whether the combination is tested.
+    """
+    rec, lig = interactions[:, 0].astype(np.intp), interactions[:, 1].astype(np.intp)
+    c1, c2 = interaction_clusters[:, 0].astype(np.intp), interaction_clusters[:, 1].astype(np.intp)
+    m1, m2 = mean[rec[:, None], c1[None, :]], mean[lig[:, None], c2[None, :]]
+    valid = (m1 > 0) & (m2 > 0)
+    tested = valid & mask[rec[:, None], c1[None, :]] & mask[lig[:, None], c2[None, :]]
+
+    return m1 + m2, valid, tested  # division by 2 doesn't matter
+
+
+@d.dedent
+def _tail_pvalues(
+    pvalues: np.ndarray,
+    counts: np.ndarray,
+    n_done: Union[float, np.ndarray],
+    stat: np.ndarray,
+    null: np.ndarray,
+    n_perms: int,
+    tail_model: TailModel,
+) -> np.ndarray:
+    """
+    Replace the empirical p-values of rarely exceeded combinations by the ones from a model of the null tail.
+
+    Parameters
+    ----------
+    pvalues
+        Array of shape `(n_tested,)` containing the empirical p-values.
+    counts
+        Array of shape `(n_tested,)` containing the number of exceedances.
+    n_done
+        Number of permutations performed for each combination.
+    stat
+        Array of shape `(n_tested,)` containing the true test statistic.
+    null
+        Either the largest permuted statistics or their sum and sum of squares, see :func:`_analysis_helper_matmul`.
+    %(n_perms)s
+    tail_model
+        Model of the tail of the permutation null distribution.
+
+    Returns
+    -------
+    Array of shape `(n_tested,)` containing the p-values.
+    """
+    from scipy.stats import gamma
+
+    pvalues = pvalues.copy()
+    rare = (counts < _TAIL_MIN_EXCEEDANCES) & (n_done == n_perms)
+
+    if tail_model == TailModel.GAMMA:
+        mu = null[0, rare] / n_perms
+        var = null[1, rare] / n_perms - mu ** 2
+        ok = var > 0
+        ix = np.where(rare)[0][ok]
+        pvalues[ix] = gamma.sf(stat[ix], a=mu[ok] ** 2 / var[ok], scale=var[ok] / mu[ok])
+        return pvalues
+
+    # probability weighted moments estimator of Hosking and Wallis (1987), exceedances are sorted ascendingly
+    null = np.sort(null[:, rare], axis=0)
+    thresh = (null[0] + null[1]) / 2.0
+    exc = null[1:] - thresh
+    n_tail = exc.shape[0]
+    weights = 1.0 - (np.arange(1, n_tail + 1) - 0.35) / n_tail
+    a0 = exc.mean(axis=0)
+    a1 = (weights[:, None] * exc).mean(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        k = a0 / (a0 - 2 * a1) - 2
+        sigma = 2 * a0 * a1 / (a0 - 2 * a1)
+        z = stat[rare] - thresh
+        base = np.clip(1.0 - k * z / sigma, 0, None)
+        sf = np.where(np.abs(k) < 1e-8, np.exp(-z / sigma), base ** (1.0 / k))
+    ok = np.isfinite(sf) & (sigma > 0)
+    ix = np.where(rare)[0][ok]
+    pvalues[ix] = (n_tail / n_perms) * sf[ok]
+
+    return pvalues
+
+
+def _iter_backed_columns(X: Any, cols: np.ndarray) -> Iterator[Tuple[slice, np.ndarray, np.ndarray]]:
+    """
+    Read columns of backed data in chunks which fit into :data:`_BACKED_CHUNK_BYTES`.
+
+    Parameters
+    ----------
+    X
+        Backed :attr:`anndata.AnnData.X` of shape `(n_cells, n_genes)`, i.e. a dense :class:`h5py.Dataset` or
+        a sparse dataset in CSR or CSC format.
+    cols
+        Indices of the columns to read.
+
+    Yields
+    ------
+    The rows, the positions in ``cols`` and the dense chunk of shape `(n_rows, n_cols)`.
+    """
+    n_obs, n_vars = X.shape
+    if getattr(X, "format_str", None) == "csc":
+        # columns are contiguous on disk, they need to be read in increasing order
+        order = np.argsort(cols, kind="stable")
+        step = max(1, _BACKED_CHUNK_BYTES // (8 * n_obs))
+        for start in range(0, len(cols), step):
+            pos = order[start : start + step]
+            yield slice(0, n_obs), pos, X[:, cols[pos]].toarray()
+        return
+
+    pos = np.arange(len(cols))
+    step = max(1, _BACKED_CHUNK_BYTES // (8 * n_vars))
+    for start in range(0, n_obs, step):
+        rows = slice(start, min(start + step, n_obs))
+        chunk = X[rows][:, cols]
+        yield rows, pos, chunk.toarray() if issparse(chunk) else np.asarray(chunk)
+
+
+def _create_memmap(shape: Tuple[int, int]) -> np.memmap:
+    """Create a temporary memory-mapped array of :attr:`squidpy.settings.dtype`, removed once it's not referenced."""
+    fd, path = tempfile.mkstemp(prefix="squidpy_ligrec_", suffix=".dat")
+    os.close(fd)
+    arr = np.memmap(path, dtype=settings.dtype, mode="w+", shape=shape)
+    weakref.finalize(arr, os.remove, path)
+
+    return arr
+
+
+def _take_rows(data: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Select the rows in ``mask``, memory-mapped data is copied in chunks to a new memory-mapped array."""
+    if np.all(mask):
+        return data
+    base = data
+    while isinstance(base, np.ndarray) and not isinstance(base, np.memmap):
+        base = base.base
+    if not isinstance(base, np.memmap):
+        return data[mask]
+
+    rows = np.flatnonzero(mask)
+    res = _create_memmap((len(rows), data.shape[1]))
+    step = max(1, _BACKED_CHUNK_BYTES // (res.itemsize * data.shape[1]))
+    for start in range(0, len(rows), step):
+        res[start : start + step] = data[rows[start : start + step]]
+    res.flush()
+
+    return res
+
+
+def ligrec_warmup(dtypes: Sequence[Union[str, type, np.dtype]] = (np.float32, np.float64)) -> None:
+    """
+    Compile the :mod:`numba` kernels used by :func:`squidpy.gr.ligrec` and store them in the on-disk cache.
+
+    Useful e.g. when building a container image, so that the first call doesn't need to compile them.
+    The kernels are cached next to this module or in ``NUMBA_CACHE_DIR``, if set.
+
+    Parameters
+    ----------
+    dtypes
+        Floating point types of the data, see :attr:`squidpy.settings.dtype`.
+
+    Returns
+    -------
+    Nothing, just compiles the kernels.
+    """
+    interactions = np.array([[0, 1]], dtype=np.uint32)
+    interaction_clusters = np.array([[0, 1]], dtype=np.uint32)
+    clustering = np.array([[0], [1]], dtype=np.int32)
+    graph = csr_matrix(np.array([[0, 1], [1, 0]]))
+    pair_ixs = np.array([[-1, 0], [-1, -1]], dtype=np.int64)
+
+    def read_only(arr: np.ndarray) -> np.ndarray:
+        arr = arr.copy()
+        arr.flags.writeable = False
+        return arr
+
+    for dtype in dtypes:
+        data = np.ones((2, 2), dtype=dtype)
+
+        sums, nnz, sizes = _group_stats(data, clustering, 2)
+        _group_stats(csr_matrix(data), clustering, 2)
+        mean = np.ascontiguousarray((sums / sizes[:, np.newaxis]).T)
+        mask = np.ascontiguousarray((nnz / sizes[:, np.newaxis] > 0).T)
+
+        # large arrays are memory-mapped read-only to the workers, see `squidpy._utils.parallelize`
+        variants = [
+            (data, mean, mask),
+            (read_only(data), mean, mask),
+            (read_only(data), read_only(mean), read_only(mask)),
+        ]
+        for fn in (_test, _test_parallel):
+            for x, m, msk in variants:
+                res = np.zeros((1, 1), dtype=np.float64)
+                fn(interactions, interaction_clusters, x, clustering, m, msk, res, np.zeros_like(res), True)
+
+        for x in (data, read_only(data)):
+            _edge_sums(
+                interactions,
+                x,
+                clustering[:, 0].copy(),
+                graph.indptr.astype(np.int64),
+                graph.indices.astype(np.int32),
+                pair_ixs,
+                np.zeros((1, 1), dtype=np.float64),
+                np.zeros((1,), dtype=np.int64),
+            )
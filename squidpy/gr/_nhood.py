@@ -2,6 +2,7 @@
 
 from typing import Any, Tuple, Union, Callable, Iterable, Optional, Sequence
 from functools import partial
+from contextlib import nullcontext
 
 from scanpy import logging as logg
 from anndata import AnnData
@@ -9,12 +10,21 @@ from anndata import AnnData
 from numba import njit, prange  # noqa: F401
 import numpy as np
 import pandas as pd
-import numba.types as nt
 
 import networkx as nx
 
 from squidpy._docs import d, inject_docs
-from squidpy._utils import Signal, SigQueue, parallelize, _get_n_cores
+from squidpy._settings import settings
+from squidpy._profiling import _profiled
+from squidpy._utils import (
+    Signal,
+    SigQueue,
+    parallelize,
+    _get_backend,
+    _get_n_cores,
+    _numba_threads,
+    _permutation_rng,
+)
 from squidpy.gr._utils import (
     _save_data,
     _assert_positive,
@@ -26,10 +36,10 @@ from squidpy._constants._pkg_constants import Key
 
 __all__ = ["nhood_enrichment", "centrality_scores", "interaction_matrix"]
 
-dt = nt.uint32  # data type aliases (both for numpy and numba should match)
 ndt = np.uint32
+# no explicit signature, the arrays can be read-only when memory-mapped to the workers
 _template = """
-@njit(dt[:, :](dt[:], dt[:], dt[:]), parallel={parallel}, fastmath=True)
+@njit(parallel={parallel}, nogil=True, fastmath=True)
 def _nenrich_{n_cls}_{parallel}(indices: np.ndarray, indptr: np.ndarray, clustering: np.ndarray) -> np.ndarray:
     '''
     Count how many times clusters :math:`i` and :math:`j` are connected.
@@ -113,6 +123,7 @@ def _create_function(n_cls: int, parallel: bool = False) -> Callable[[np.ndarray
     return globals()[fn_key]  # type: ignore[no-any-return]
 
 
+@_profiled
 @d.get_sections(base="nhood_ench", sections=["Parameters"])
 @d.dedent
 def nhood_enrichment(
@@ -120,11 +131,11 @@ def nhood_enrichment(
     cluster_key: str,
     connectivity_key: Optional[str] = None,
     n_perms: int = 1000,
-    numba_parallel: bool = False,
+    numba_parallel: Optional[bool] = None,
     seed: Optional[int] = None,
     copy: bool = False,
     n_jobs: Optional[int] = None,
-    backend: str = "loky",
+    backend: Optional[str] = None,
     show_progress_bar: bool = True,
 ) -> Optional[Tuple[np.ndarray, np.ndarray]]:
     """
@@ -163,6 +174,7 @@ def nhood_enrichment(
     indices, indptr = (adj.indices.astype(ndt), adj.indptr.astype(ndt))
     n_cls = len(clust_map)
 
+    numba_parallel = bool(settings.numba_parallel if numba_parallel is None else numba_parallel)
     _test = _create_function(n_cls, parallel=numba_parallel)
     count = _test(indices, indptr, int_clust)
 
@@ -174,9 +186,17 @@ def nhood_enrichment(
         collection=np.arange(n_perms),
         extractor=np.vstack,
         n_jobs=n_jobs,
-        backend=backend,
+        backend=_get_backend(backend, default="threading"),
         show_progress_bar=show_progress_bar,
-    )(callback=_test, indices=indices, indptr=indptr, int_clust=int_clust, n_cls=n_cls, seed=seed)
+    )(
+        callback=_test,
+        indices=indices,
+        indptr=indptr,
+        int_clust=int_clust,
+        n_cls=n_cls,
+        seed=seed,
+        numba_parallel=numba_parallel,
+    )
     zscore = (count - perms.mean(axis=0)) / perms.std(axis=0)
 
     if copy:
@@ -191,6 +211,7 @@ def nhood_enrichment(
     )
 
 
+@_profiled
 @d.dedent
 @inject_docs(c=Centrality)
 def centrality_scores(
@@ -200,7 +221,7 @@ def centrality_scores(
     connectivity_key: Optional[str] = None,
     copy: bool = False,
     n_jobs: Optional[int] = None,
-    backend: str = "loky",
+    backend: Optional[str] = None,
     show_progress_bar: bool = False,
 ) -> Optional[pd.DataFrame]:
     """
@@ -268,6 +289,7 @@ def centrality_scores(
             collection=cat,
             extractor=pd.concat,
             n_jobs=n_jobs,
+            n_split="auto",
             backend=backend,
             show_progress_bar=show_progress_bar,
         )(clusters=clusters, fun=v, method=k)
@@ -280,6 +302,7 @@ def centrality_scores(
     _save_data(adata, attr="uns", key=Key.uns.centrality_scores(cluster_key), data=df, time=start)
 
 
+@_profiled
 @d.dedent
 def interaction_matrix(
     adata: AnnData,
@@ -391,18 +414,21 @@ def _nhood_enrichment_helper(
     int_clust: np.ndarray,
     n_cls: int,
     seed: Optional[int] = None,
+    numba_parallel: bool = False,
     queue: Optional[SigQueue] = None,
 ) -> np.ndarray:
     perms = np.empty((len(ixs), n_cls, n_cls), dtype=np.float64)
-    int_clust = int_clust.copy()  # threading
-    rs = np.random.RandomState(seed=None if seed is None else seed + ixs[0])
+    perm_clust = int_clust.copy()  # threading
 
-    for i in range(len(ixs)):
-        rs.shuffle(int_clust)
-        perms[i, ...] = callback(indices, indptr, int_clust)
+    with _numba_threads() if numba_parallel else nullcontext() as n_threads:
+        if numba_parallel and n_threads is None:
+            callback = _create_function(n_cls, parallel=False)
+        for i in range(len(ixs)):
+            perm_clust[:] = _permutation_rng(seed, ixs[i]).permutation(int_clust)
+            perms[i, ...] = callback(indices, indptr, perm_clust)
 
-        if queue is not None:
-            queue.put(Signal.UPDATE)
+            if queue is not None:
+                queue.put(Signal.UPDATE)
 
     if queue is not None:
         queue.put(Signal.FINISH)
@@ -1,6 +1,5 @@
 """Functions for point patterns spatial statistics."""
 from typing import Any, Dict, Tuple, Union, Iterable, Optional, Sequence, TYPE_CHECKING
-from itertools import chain
 from typing_extensions import Literal  # < 3.8
 
 from scanpy import logging as logg
@@ -11,8 +10,10 @@ from scanpy.metrics._morans_i import _morans_i
 
 from numba import njit
 from scipy import stats
+from scipy.special import gamma
 from numpy.random import default_rng
 from scipy.sparse import spmatrix
+from scipy.spatial import cKDTree
 from sklearn.metrics import pairwise_distances
 from sklearn.preprocessing import normalize
 from statsmodels.stats.multitest import multipletests
@@ -21,7 +22,8 @@ import pandas as pd
 import numba.types as nt
 
 from squidpy._docs import d, inject_docs
-from squidpy._utils import Signal, SigQueue, parallelize, _get_n_cores
+from squidpy._profiling import _profiled
+from squidpy._utils import Signal, SigQueue, parallelize, _get_n_cores, _permutation_rng
 from squidpy.gr._utils import (
     _save_data,
     _assert_positive,
@@ -30,7 +32,7 @@ from squidpy.gr._utils import (
     _assert_connectivity_key,
     _assert_non_empty_sequence,
 )
-from squidpy._constants._constants import SpatialAutocorr
+from squidpy._constants._constants import CoOccurrence, SpatialAutocorr
 from squidpy._constants._pkg_constants import Key
 
 __all__ = ["ripley_k", "spatial_autocorr", "co_occurrence"]
@@ -42,7 +44,13 @@ tt = nt.UniTuple
 ip = np.int32
 fp = np.float32
 
+_RADIUS_CHUNK_SIZE = 2_048  # max. number of query points per chunk when using the radius query
+_RADIUS_MAX_PAIRS = 2 ** 23  # expected number of pairs per chunk of query points, each needs 24 bytes
+_RADIUS_QUADRATIC_FRACTION = 0.25  # warn if a query point is expected to have more neighbors than this fraction
+_INTERVAL_SUBSAMPLE_SIZE = 10_000  # number of observations used to estimate the distance thresholds
 
+
+@_profiled
 @d.dedent
 @inject_docs(key=Key.obsm.spatial)
 def ripley_k(
@@ -125,6 +133,7 @@ def ripley_k(
     _save_data(adata, attr="uns", key=Key.uns.ripley_k(cluster_key), data=df)
 
 
+@_profiled
 @d.dedent
 @inject_docs(key=Key.obsp.spatial_conn(), sp=SpatialAutocorr)
 def spatial_autocorr(
@@ -141,7 +150,7 @@ def spatial_autocorr(
     use_raw: bool = False,
     copy: bool = False,
     n_jobs: Optional[int] = None,
-    backend: str = "loky",
+    backend: Optional[str] = None,
     show_progress_bar: bool = True,
 ) -> Optional[pd.DataFrame]:
     """
@@ -285,11 +294,10 @@ def _score_helper(
     queue: Optional[SigQueue] = None,
 ) -> pd.DataFrame:
     score_perms = np.empty((len(perms), vals.shape[0]))
-    rng = default_rng(None if seed is None else ix + seed)
     func = _morans_i if mode == SpatialAutocorr.MORAN else _gearys_c
 
     for i in range(len(perms)):
-        idx_shuffle = rng.permutation(g.shape[0])
+        idx_shuffle = _permutation_rng(seed, perms[i]).permutation(g.shape[0])
         score_perms[i, :] = func(g[idx_shuffle, :], vals)
 
         if queue is not None:
@@ -302,8 +310,9 @@ def _score_helper(
 
 
 @njit(
-    ft[:, :, :](tt(it[:], 2), ft[:, :], it[:], ft[:]),
+    nt.int64[:, :, :](tt(it[:], 2), ft[:, :], it[:], ft[:]),
     parallel=False,
+    nogil=True,
     fastmath=True,
 )
 def _occur_count(
@@ -313,30 +322,18 @@ def _occur_count(
     interval: np.ndarray,
 ) -> np.ndarray:
     num = labs_unique.shape[0]
-    out = np.zeros((num, num, interval.shape[0] - 1), dtype=ft)
+    out = np.zeros((num, num, interval.shape[0] - 1), dtype=np.int64)
+    clust_x, clust_y = clust
 
     for idx in range(interval.shape[0] - 1):
-        co_occur = np.zeros((num, num), dtype=ft)
-        probs_con = np.zeros((num, num), dtype=ft)
-
         thres_min = interval[idx]
         thres_max = interval[idx + 1]
-        clust_x, clust_y = clust
 
         idx_x, idx_y = np.nonzero((pw_dist <= thres_max) & (pw_dist > thres_min))
         x = clust_x[idx_x]
         y = clust_y[idx_y]
         for i, j in zip(x, y):
-            co_occur[i, j] += 1
-
-        probs_matrix = co_occur / np.sum(co_occur)
-        probs = np.sum(probs_matrix, axis=1)
-
-        for c in labs_unique:
-            probs_conditional = co_occur[c] / np.sum(co_occur[c])
-            probs_con[c, :] = probs_conditional / probs
-
-        out[:, :, idx] = probs_con
+            out[i, j, idx] += 1
 
     return out
 
@@ -348,17 +345,21 @@ def _co_occurrence_helper(
     labs_unique: np.ndarray,
     interval: np.ndarray,
     queue: Optional[SigQueue] = None,
-) -> pd.DataFrame:
+) -> np.ndarray:
+    num = labs_unique.shape[0]
+    out = np.zeros((num, num, interval.shape[0] - 1), dtype=np.int64)
 
-    out_lst = []
     for t in idx_splits:
         idx_x, idx_y = t
         labs_x = labs_splits[idx_x]
         labs_y = labs_splits[idx_y]
         dist = pairwise_distances(spatial_splits[idx_x], spatial_splits[idx_y])
 
-        out = _occur_count((labs_x, labs_y), dist, labs_unique, interval)
-        out_lst.append(out)
+        counts = _occur_count((labs_x, labs_y), dist, labs_unique, interval)
+        out += counts
+        if idx_x != idx_y:
+            # only the upper triangle of the split combinations is computed
+            out += counts.transpose(1, 0, 2)
 
         if queue is not None:
             queue.put(Signal.UPDATE)
@@ -366,19 +367,91 @@ def _co_occurrence_helper(
     if queue is not None:
         queue.put(Signal.FINISH)
 
-    return out_lst
+    return out
+
+
+@njit(nogil=True, fastmath=True)
+def _occur_count_pairs(
+    labs_x: np.ndarray,
+    labs_y: np.ndarray,
+    dist: np.ndarray,
+    interval: np.ndarray,
+    n_cls: int,
+) -> np.ndarray:
+    out = np.zeros((n_cls, n_cls, interval.shape[0] - 1), dtype=np.int64)
+
+    for k in range(dist.shape[0]):
+        # same binning as in `_occur_count`: `interval[b] < dist <= interval[b + 1]`
+        b = np.searchsorted(interval, dist[k]) - 1
+        if 0 <= b < interval.shape[0] - 1:
+            out[labs_x[k], labs_y[k], b] += 1
+
+    return out
 
 
+def _occur_probs(co_occur: np.ndarray) -> np.ndarray:
+    """
+    Compute the co-occurrence probability ratio from the counts.
+
+    Parameters
+    ----------
+    co_occur
+        Array of shape ``(n_clusters, n_clusters, n_intervals)`` containing the co-occurrence counts.
+
+    Returns
+    -------
+    Array of the same shape as ``co_occur`` containing :math:`p(j | i) / p(j)` for each interval.
+    """
+    co_occur = co_occur.astype(np.float64, copy=False)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        probs = co_occur.sum(axis=1) / co_occur.sum(axis=(0, 1))
+        probs_con = co_occur / co_occur.sum(axis=1, keepdims=True)
+        out = probs_con / probs[np.newaxis, ...]
+
+    return out.astype(fp)
+
+
+def _co_occurrence_radius_helper(
+    idx_splits: Iterable[np.ndarray],
+    spatial: np.ndarray,
+    labs: np.ndarray,
+    n_cls: int,
+    interval: np.ndarray,
+    queue: Optional[SigQueue] = None,
+) -> np.ndarray:
+    tree = cKDTree(spatial)
+    max_dist = float(interval[-1])
+    out = np.zeros((n_cls, n_cls, interval.shape[0] - 1), dtype=np.int64)
+
+    for idx in idx_splits:
+        # only the pairs within the largest threshold are ever materialized
+        pairs = cKDTree(spatial[idx]).sparse_distance_matrix(tree, max_distance=max_dist, output_type="ndarray")
+        out += _occur_count_pairs(labs[idx][pairs["i"]], labs[pairs["j"]], pairs["v"].astype(fp), interval, n_cls)
+
+        if queue is not None:
+            queue.put(Signal.UPDATE)
+
+    if queue is not None:
+        queue.put(Signal.FINISH)
+
+    return out
+
+
+@_profiled
 @d.dedent
+@inject_docs(co=CoOccurrence)
 def co_occurrence(
     adata: AnnData,
     cluster_key: str,
     spatial_key: str = Key.obsm.spatial,
     n_steps: int = 50,
+    interval: Optional[np.ndarray] = None,
+    method: str = CoOccurrence.PAIRWISE.s,
     copy: bool = False,
     n_splits: Optional[int] = None,
     n_jobs: Optional[int] = None,
-    backend: str = "loky",
+    backend: Optional[str] = None,
     show_progress_bar: bool = True,
 ) -> Optional[Tuple[np.ndarray, np.ndarray]]:
     """
@@ -392,12 +465,26 @@ def co_occurrence(
     %(cluster_key)s
     %(spatial_key)s
     n_steps
-        Number of distance thresholds at which co-occurrence is computed.
+        Number of distance thresholds at which co-occurrence is computed. Only used when ``interval = None``.
+    interval
+        Strictly increasing distance thresholds at which co-occurrence is computed. Useful to compare
+        multiple runs on the same dataset, e.g. using the ``'interval'`` of a previous run.
+        If `None`, ``n_steps`` thresholds are spaced evenly between the median nearest neighbor distance of
+        a subsample of the observations and half of the diagonal of the bounding box of the coordinates.
+    method
+        How to find the pairs of observations. Valid options are:
+
+            - `{co.PAIRWISE.s!r}` - compute the pairwise distances between all splits of the coordinates.
+            - `{co.RADIUS.s!r}` - query a :class:`scipy.spatial.cKDTree` for pairs within the largest distance
+              threshold. Runtime and memory scale with the number of such pairs rather than quadratically
+              in the number of observations, as long as the largest threshold is small compared to the
+              extent of the coordinates.
 
     %(copy)s
     n_splits
         Number of splits in which to divide the spatial coordinates in
-        :attr:`anndata.AnnData.obsm` ``['{spatial_key}']``.
+        :attr:`anndata.AnnData.obsm` ``['{{spatial_key}}']``. If ``method = {co.RADIUS.s!r}``, these are
+        the chunks of query points, by default small enough to bound the memory of the pairs found for each.
     %(parallelize)s
 
     Returns
@@ -406,20 +493,18 @@ def co_occurrence(
 
     Otherwise, modifies the ``adata`` with the following keys:
 
-        - :attr:`anndata.AnnData.uns` ``['{cluster_key}_co_occurrence']['occ']`` - the co-occurrence probabilities
-          across interval thresholds.
-        - :attr:`anndata.AnnData.uns` ``['{cluster_key}_co_occurrence']['interval']`` - the distance thresholds
-          computed at ``n_steps``.
+        - :attr:`anndata.AnnData.uns` ``['{{cluster_key}}_co_occurrence']['occ']`` - the co-occurrence
+          probabilities across interval thresholds.
+        - :attr:`anndata.AnnData.uns` ``['{{cluster_key}}_co_occurrence']['interval']`` - the distance thresholds
+          computed at ``n_steps`` or the specified ``interval``.
     """
     _assert_categorical_obs(adata, key=cluster_key)
     _assert_spatial_basis(adata, key=spatial_key)
+    method = CoOccurrence(method)  # type: ignore[assignment]
 
     spatial = adata.obsm[spatial_key].astype(fp)
     original_clust = adata.obs[cluster_key]
 
-    # find minimum, second minimum and maximum for thresholding
-    thres_min, thres_max = _find_min_max(spatial)
-
     # annotate cluster idx
     clust_map = {v: i for i, v in enumerate(original_clust.cat.categories.values)}
     labs = np.array([clust_map[c] for c in original_clust], dtype=ip)
@@ -427,58 +512,94 @@ def co_occurrence(
     labs_unique = np.array(list(clust_map.values()), dtype=ip)
 
     # create intervals thresholds
-    interval = np.linspace(thres_min, thres_max, num=n_steps, dtype=fp)
-
-    n_obs = spatial.shape[0]
-    if n_splits is None:
-        size_arr = (n_obs ** 2 * 4) / 1024 / 1024  # calc expected mem usage
-        if size_arr > 2_000:
-            s = 1
-            while 2_048 < (n_obs / s):
-                s += 1
-            n_splits = s
-            logg.warning(
-                f"`n_splits` was automatically set to: {n_splits}\n"
-                f"preventing a NxN with N={n_obs} distance matrix to be created"
+    if interval is None:
+        thres_min, thres_max = _find_min_max(spatial)
+        interval = np.linspace(thres_min, thres_max, num=n_steps, dtype=fp)
+    else:
+        interval = np.asarray(interval, dtype=fp)
+        if interval.ndim != 1 or interval.shape[0] < 2:
+            raise ValueError(
+                f"Expected `interval` to be a 1-dimensional array with at least `2` elements, "
+                f"found shape `{interval.shape}`."
             )
-        else:
-            n_splits = 1
-
-    n_splits = max(min(n_splits, n_obs), 1)
-
-    # split array and labels
-    spatial_splits = tuple(s for s in np.array_split(spatial, n_splits, axis=0) if len(s))
-    labs_splits = tuple(s for s in np.array_split(labs, n_splits, axis=0) if len(s))
-    # create idx array including unique combinations and self-comparison
-    x, y = np.triu_indices_from(np.empty((n_splits, n_splits)))
-    idx_splits = [(i, j) for i, j in zip(x, y)]
+        if np.any(np.diff(interval) <= 0):
+            raise ValueError("Expected `interval` to be strictly increasing.")
 
+    n_obs = spatial.shape[0]
     n_jobs = _get_n_cores(n_jobs)
     start = logg.info(
-        f"Calculating co-occurrence probabilities for\
-            `{len(interval)}` intervals\
-            `{len(idx_splits)}` split combinations\
-            using `{n_jobs}` core(s)"
+        f"Calculating co-occurrence probabilities for `{len(interval)}` intervals "
+        f"using method `{method}` and `{n_jobs}` core(s)"
     )
 
-    out_lst = parallelize(
-        _co_occurrence_helper,
-        collection=idx_splits,
-        extractor=chain.from_iterable,
-        n_jobs=n_jobs,
-        backend=backend,
-        show_progress_bar=show_progress_bar,
-    )(
-        spatial_splits=spatial_splits,
-        labs_splits=labs_splits,
-        labs_unique=labs_unique,
-        interval=interval,
-    )
-
-    if len(idx_splits) == 1:
-        out = list(out_lst)[0]
+    if method == CoOccurrence.RADIUS:
+        n_neighs = _expected_n_neighbors(spatial, float(interval[-1]))
+        if n_neighs > _RADIUS_QUADRATIC_FRACTION * n_obs:
+            logg.warning(
+                f"Each observation is expected to have `{int(n_neighs)}` out of `{n_obs}` observations within "
+                f"the largest distance threshold `{interval[-1]}`. The number of pairs grows quadratically, "
+                f"consider using a smaller `interval`"
+            )
+        if n_splits is None:
+            # bound the memory of the pairs found for each chunk, not just the number of query points
+            chunk_size = int(min(_RADIUS_CHUNK_SIZE, max(1, _RADIUS_MAX_PAIRS // max(n_neighs, 1))))
+            n_splits = int(np.ceil(n_obs / chunk_size))
+        n_splits = max(min(n_splits, n_obs), 1)
+
+        # spatially compact chunks of query points make the per-chunk trees small
+        order = np.argsort(spatial[:, 0], kind="stable")
+        idx_splits = [s for s in np.array_split(order, n_splits) if len(s)]
+
+        counts = parallelize(
+            _co_occurrence_radius_helper,
+            collection=idx_splits,
+            extractor=sum,
+            n_jobs=n_jobs,
+            backend=backend,
+            show_progress_bar=show_progress_bar,
+        )(spatial=spatial, labs=labs, n_cls=len(labs_unique), interval=interval)
+        out = _occur_probs(counts)
+    elif method == CoOccurrence.PAIRWISE:
+        if n_splits is None:
+            size_arr = (n_obs ** 2 * 4) / 1024 / 1024  # calc expected mem usage
+            if size_arr > 2_000:
+                s = 1
+                while 2_048 < (n_obs / s):
+                    s += 1
+                n_splits = s
+                logg.warning(
+                    f"`n_splits` was automatically set to: {n_splits}\n"
+                    f"preventing a NxN with N={n_obs} distance matrix to be created"
+                )
+            else:
+                n_splits = 1
+
+        n_splits = max(min(n_splits, n_obs), 1)
+
+        # split array and labels
+        spatial_splits = tuple(s for s in np.array_split(spatial, n_splits, axis=0) if len(s))
+        labs_splits = tuple(s for s in np.array_split(labs, n_splits, axis=0) if len(s))
+        # create idx array including unique combinations and self-comparison
+        x, y = np.triu_indices_from(np.empty((n_splits, n_splits)))
+        idx_splits = [(i, j) for i, j in zip(x, y)]
+
+        counts = parallelize(
+            _co_occurrence_helper,
+            collection=idx_splits,
+            extractor=sum,
+            n_jobs=n_jobs,
+            n_split="auto",
+            backend=backend,
+            show_progress_bar=show_progress_bar,
+        )(
+            spatial_splits=spatial_splits,
+            labs_splits=labs_splits,
+            labs_unique=labs_unique,
+            interval=interval,
+        )
+        out = _occur_probs(counts)
     else:
-        out = sum(list(out_lst)) / len(idx_splits)
+        raise NotImplementedError(f"Method `{method}` is not yet implemented.")
 
     if copy:
         logg.info("Finish", time=start)
@@ -489,20 +610,65 @@ def co_occurrence(
     )
 
 
-def _find_min_max(spatial: np.ndarray) -> Tuple[float, float]:
-
-    coord_sum = np.sum(spatial, axis=1)
-    min_idx, min_idx2 = np.argpartition(coord_sum, 2)[0:2]
-    max_idx = np.argmax(coord_sum)
-    thres_max = (
-        pairwise_distances(spatial[min_idx, :].reshape(1, -1), spatial[max_idx, :].reshape(1, -1),)[
-            0
-        ][0]
-        / 2.0
-    ).astype(fp)
-    thres_min = pairwise_distances(spatial[min_idx, :].reshape(1, -1), spatial[min_idx2, :].reshape(1, -1),)[0][
-        0
-    ].astype(fp)
+def _expected_n_neighbors(spatial: np.ndarray, radius: float) -> float:
+    """
+    Estimate the number of observations within ``radius`` of an observation.
+
+    Assumes that the observations are distributed uniformly within the bounding box of the coordinates, which
+    overestimates it for those close to its border.
+
+    Parameters
+    ----------
+    spatial
+        Array of shape ``(n_obs, n_dims)`` containing the spatial coordinates.
+    radius
+        Radius of the query.
+
+    Returns
+    -------
+    The expected number of neighbors, at most ``n_obs``.
+    """
+    n_obs, n_dims = spatial.shape
+    if n_obs == 0:
+        return 0.0
+    extent = (spatial.max(axis=0) - spatial.min(axis=0)).astype(np.float64)
+    extent = extent[extent > 0]  # e.g. all observations on a line
+    ball = np.pi ** (len(extent) / 2) / gamma(len(extent) / 2 + 1) * radius ** len(extent)
+
+    return float(min(n_obs, n_obs * ball / np.prod(extent))) if len(extent) else float(n_obs)
+
+
+def _find_min_max(spatial: np.ndarray, seed: int = 0) -> Tuple[float, float]:
+    """
+    Estimate the smallest and the largest distance threshold.
+
+    The smallest threshold is the median nearest neighbor distance of a random subsample of the observations,
+    the largest one is half of the diagonal of the bounding box of the coordinates.
+
+    Parameters
+    ----------
+    spatial
+        Array of shape ``(n_obs, n_dims)`` containing the spatial coordinates.
+    seed
+        Random seed used when subsampling the observations.
+
+    Returns
+    -------
+    The smallest and the largest threshold.
+    """
+    n_obs = spatial.shape[0]
+    if n_obs > _INTERVAL_SUBSAMPLE_SIZE:
+        query = spatial[default_rng(seed).choice(n_obs, size=_INTERVAL_SUBSAMPLE_SIZE, replace=False)]
+    else:
+        query = spatial
+
+    # the closest point is the query point itself
+    dist, _ = cKDTree(spatial).query(query, k=2)
+    dist = dist[:, 1]
+    dist = dist[np.isfinite(dist) & (dist > 0)]
+
+    thres_min = fp(np.median(dist)) if len(dist) else fp(0)
+    thres_max = fp(np.linalg.norm(spatial.max(axis=0) - spatial.min(axis=0)) / 2.0)
 
     return thres_min, thres_max
 
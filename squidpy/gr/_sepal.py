@@ -0,0 +1,327 @@
+"""Functions for identifying spatially variable genes by simulating diffusion."""
+from typing import Tuple, Union, Optional, Sequence
+from typing_extensions import Literal  # < 3.8
+
+from scanpy import logging as logg
+from anndata import AnnData
+from scanpy.get import _get_obs_rep
+
+from numba import njit
+from scipy.sparse import issparse, spmatrix
+from scipy.spatial import cKDTree
+import numpy as np
+import pandas as pd
+
+from squidpy._docs import d, inject_docs
+from squidpy._profiling import _profiled
+from squidpy._utils import Signal, SigQueue, parallelize, _get_n_cores
+from squidpy.gr._utils import (
+    _save_data,
+    _assert_positive,
+    _assert_spatial_basis,
+    _assert_connectivity_key,
+    _assert_non_empty_sequence,
+)
+from squidpy._constants._pkg_constants import Key
+
+__all__ = ["sepal"]
+
+_GENE_BLOCK_SIZE = 64  # number of genes diffused simultaneously by 1 worker
+
+
+@_profiled
+@d.dedent
+@inject_docs(key=Key.obsp.spatial_conn())
+def sepal(
+    adata: AnnData,
+    max_neighs: Literal[4, 6],
+    genes: Optional[Union[str, Sequence[str]]] = None,
+    n_iter: int = 30000,
+    dt: float = 0.001,
+    thresh: float = 1e-8,
+    connectivity_key: str = Key.obsp.spatial_conn(),
+    spatial_key: str = Key.obsm.spatial,
+    layer: Optional[str] = None,
+    use_raw: bool = False,
+    copy: bool = False,
+    n_jobs: Optional[int] = None,
+    backend: Optional[str] = None,
+    show_progress_bar: bool = True,
+) -> Optional[pd.DataFrame]:
+    """
+    Identify spatially variable genes with *Sepal*.
+
+    *Sepal* simulates a diffusion process of each gene's expression on a regular lattice and scores
+    each gene by the time it takes to reach a steady state. Genes with spatial structure take longer to diffuse.
+    See :cite:`andersson2021` for reference.
+
+    Parameters
+    ----------
+    %(adata)s
+    max_neighs
+        Number of neighbors of an observation in the lattice. Use `6` for hexagonal grids (e.g. Visium)
+        and `4` for rectangular grids.
+    genes
+        List of gene names, as stored in :attr:`anndata.AnnData.var_names`, for which to compute the score.
+
+        If `None`, it's computed for :attr:`anndata.AnnData.var` ``['highly_variable']``, if present.
+        Otherwise, it's computed for all genes.
+    n_iter
+        Maximum number of iterations of the diffusion simulation.
+    dt
+        Time step of the diffusion simulation.
+    thresh
+        Entropy threshold for convergence of the diffusion simulation.
+    %(conn_key)s
+        The graph must not contain observations with more than ``max_neighs`` neighbors,
+        see :func:`squidpy.gr.spatial_neighbors`.
+    %(spatial_key)s
+    layer
+        Layer in :attr:`anndata.AnnData.layers` to use. If `None`, use :attr:`anndata.AnnData.X`.
+    use_raw
+        Whether to access :attr:`anndata.AnnData.raw`.
+    %(copy)s
+    %(parallelize)s
+
+    Returns
+    -------
+    If ``copy = True``, returns a :class:`pandas.DataFrame` with the `'sepal_score'` column, sorted in
+    descending order. Genes whose simulation didn't converge in ``n_iter`` iterations have a `NaN` score.
+
+    Otherwise, modifies the ``adata`` with the following key:
+
+        - :attr:`anndata.AnnData.uns` ``['sepal_score']`` - the above mentioned dataframe.
+    """
+    _assert_connectivity_key(adata, connectivity_key)
+    _assert_spatial_basis(adata, key=spatial_key)
+    _assert_positive(n_iter, name="n_iter")
+    _assert_positive(dt, name="dt")
+    if max_neighs not in (4, 6):
+        raise ValueError(f"Expected `max_neighs` to be either `4` or `6`, found `{max_neighs}`.")
+
+    if genes is None:
+        if "highly_variable" in adata.var.columns:
+            genes = adata[:, adata.var.highly_variable.values].var_names.values
+        else:
+            genes = adata.var_names.values
+    genes = _assert_non_empty_sequence(genes, name="genes")
+
+    g = adata.obsp[connectivity_key].tocsr()
+    n_neighs = np.diff(g.indptr)
+    if n_neighs.max() > max_neighs:
+        raise ValueError(f"Expected at most `{max_neighs}` neighbors, found observation with `{n_neighs.max()}`.")
+
+    sat, sat_idx, unsat, unsat_idx = _compute_idxs(g, adata.obsm[spatial_key], max_neighs)
+
+    if use_raw:
+        if layer is not None:
+            raise ValueError("Cannot use `use_raw=True` and `layer` at the same time.")
+        if adata.raw is None:
+            raise AttributeError("No `.raw` attribute found. Try specifying `use_raw=False`.")
+        # `_get_obs_rep` doesn't subset `.raw`
+        vals = adata.raw[:, genes].X
+    else:
+        vals = _get_obs_rep(adata[:, genes], layer=layer)
+    if issparse(vals):
+        vals = vals.tocsc()
+
+    n_jobs = _get_n_cores(n_jobs)
+    start = logg.info(f"Calculating sepal score for `{len(genes)}` genes using `{n_jobs}` core(s)")
+
+    score = parallelize(
+        _score_helper,
+        collection=np.arange(len(genes)),
+        extractor=np.concatenate,
+        n_jobs=n_jobs,
+        unit="gene",
+        backend=backend,
+        show_progress_bar=show_progress_bar,
+    )(
+        vals=vals,
+        max_neighs=max_neighs,
+        n_iter=n_iter,
+        sat=sat,
+        sat_idx=sat_idx,
+        unsat=unsat,
+        unsat_idx=unsat_idx,
+        dt=dt,
+        thresh=thresh,
+    )
+
+    key_added = "sepal_score"
+    df = pd.DataFrame(score, index=genes, columns=[key_added])
+    if df[key_added].isna().any():
+        logg.warning("Found `NaN` in sepal scores, consider increasing `n_iter`")
+    df.sort_values(by=key_added, ascending=False, inplace=True)
+
+    if copy:
+        logg.info("Finish", time=start)
+        return df
+
+    _save_data(adata, attr="uns", key=key_added, data=df, time=start)
+
+
+def _score_helper(
+    ixs: Sequence[int],
+    vals: Union[spmatrix, np.ndarray],
+    max_neighs: int,
+    n_iter: int,
+    sat: np.ndarray,
+    sat_idx: np.ndarray,
+    unsat: np.ndarray,
+    unsat_idx: np.ndarray,
+    dt: float,
+    thresh: float,
+    queue: Optional[SigQueue] = None,
+) -> np.ndarray:
+    # 7-point stencil on a hexagonal grid has an additional factor of `2/3` compared to the 5-point one
+    scale = 2.0 / 3.0 if max_neighs == 6 else 1.0
+    score = np.empty((len(ixs),), dtype=np.float64)
+
+    for i in range(0, len(ixs), _GENE_BLOCK_SIZE):
+        block = ixs[i : i + _GENE_BLOCK_SIZE]
+        conc = vals[:, block]
+        conc = np.array(conc.A if issparse(conc) else conc, dtype=np.float64, order="C")
+
+        n_steps = _diffusion(conc, sat, sat_idx, unsat, unsat_idx, n_iter=n_iter, dt=dt, thresh=thresh, scale=scale)
+        score[i : i + len(block)] = dt * n_steps
+
+        if queue is not None:
+            for _ in range(len(block)):
+                queue.put(Signal.UPDATE)
+
+    if queue is not None:
+        queue.put(Signal.FINISH)
+
+    return score
+
+
+@njit(nogil=True, fastmath=True)
+def _diffusion(
+    conc: np.ndarray,
+    sat: np.ndarray,
+    sat_idx: np.ndarray,
+    unsat: np.ndarray,
+    unsat_idx: np.ndarray,
+    n_iter: int,
+    dt: float,
+    thresh: float,
+    scale: float,
+) -> np.ndarray:
+    """
+    Simulate diffusion of a block of genes on a regular lattice.
+
+    Parameters
+    ----------
+    conc
+        Array of shape ``(n_cells, n_genes)`` containing the concentrations. Modified in place.
+    sat
+        Array of shape ``(n_saturated,)`` containing indices of observations with all neighbors present.
+    sat_idx
+        Array of shape ``(n_saturated, max_neighs)`` containing indices of the neighbors of ``sat``.
+    unsat
+        Array of shape ``(n_unsaturated,)`` containing indices of the remaining observations.
+    unsat_idx
+        Array of shape ``(n_unsaturated,)`` containing the position in ``sat`` of the closest saturated observation.
+    n_iter
+        Maximum number of iterations.
+    dt
+        Time step.
+    thresh
+        Entropy threshold for convergence.
+    scale
+        Scaling factor of the Laplacian stencil.
+
+    Returns
+    -------
+    Array of shape ``(n_genes,)`` containing the number of iterations until convergence, `NaN` if not converged.
+    """
+    n_sat, n_neighs = sat_idx.shape
+    n_genes = conc.shape[1]
+
+    n_steps = np.full((n_genes,), np.nan)
+    active = np.ones((n_genes,), dtype=np.bool_)
+    prev_ent = np.ones((n_genes,))
+    dcdt = np.zeros((n_sat, n_genes))
+    s1 = np.empty((n_genes,))
+    s2 = np.empty((n_genes,))
+    n_active = n_genes
+
+    for it in range(n_iter):
+        for j in range(n_sat):
+            c = sat[j]
+            for g in range(n_genes):
+                if active[g]:
+                    nhood = 0.0
+                    for k in range(n_neighs):
+                        nhood += conc[sat_idx[j, k], g]
+                    dcdt[j, g] = scale * (nhood - n_neighs * conc[c, g])
+
+        for j in range(n_sat):
+            c = sat[j]
+            for g in range(n_genes):
+                if active[g]:
+                    conc[c, g] = max(conc[c, g] + dt * dcdt[j, g], 0.0)
+        for j in range(unsat.shape[0]):
+            c, s = unsat[j], unsat_idx[j]
+            for g in range(n_genes):
+                if active[g]:
+                    conc[c, g] = max(conc[c, g] + dt * dcdt[s, g], 0.0)
+
+        # entropy over the saturated observations: log(sum(x)) - sum(x * log(x)) / sum(x)
+        s1[:] = 0.0
+        s2[:] = 0.0
+        for j in range(n_sat):
+            c = sat[j]
+            for g in range(n_genes):
+                x = conc[c, g]
+                if active[g] and x > 0:
+                    s1[g] += x
+                    s2[g] += x * np.log(x)
+
+        for g in range(n_genes):
+            if active[g]:
+                ent = (np.log(s1[g]) - s2[g] / s1[g]) / n_sat if s1[g] > 0 else 0.0
+                if np.abs(ent - prev_ent[g]) < thresh:
+                    n_steps[g] = it
+                    active[g] = False
+                    n_active -= 1
+                else:
+                    prev_ent[g] = ent
+
+        if n_active == 0:
+            break
+
+    return n_steps
+
+
+def _compute_idxs(
+    g: spmatrix, spatial: np.ndarray, max_neighs: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Get the saturated and unsaturated observations of the lattice.
+
+    Parameters
+    ----------
+    g
+        Connectivity matrix in CSR format.
+    spatial
+        Spatial coordinates.
+    max_neighs
+        Number of neighbors of a saturated observation.
+
+    Returns
+    -------
+    Indices of the saturated observations, indices of their neighbors, indices of the unsaturated observations
+    and the position of the closest saturated observation for each unsaturated one.
+    """
+    n_neighs = np.diff(g.indptr)
+    sat = np.where(n_neighs == max_neighs)[0].astype(np.int32)
+    unsat = np.where(n_neighs < max_neighs)[0].astype(np.int32)
+    if not len(sat):
+        raise ValueError(f"No observations with `{max_neighs}` neighbors have been found.")
+
+    sat_idx = np.vstack([g.indices[g.indptr[i] : g.indptr[i + 1]] for i in sat]).astype(np.int32)
+    _, unsat_idx = cKDTree(spatial[sat]).query(spatial[unsat])
+
+    return sat, sat_idx, unsat, np.asarray(unsat_idx, dtype=np.int32).reshape(-1)
@@ -35,6 +35,7 @@ from skimage.util import img_as_float
 from skimage.transform import rescale
 
 from squidpy._docs import d
+from squidpy._profiling import _profiled
 from squidpy._utils import singledispatchmethod
 from squidpy.gr._utils import (
     _assert_in_range,
@@ -111,6 +112,7 @@ class ImageContainer(FeatureMixin):
             self.add_img(img, layer=layer, chunks=chunks, **kwargs)
 
     @classmethod
+    @_profiled
     def load(cls, path: Pathlike_t, lazy: bool = True, chunks: Optional[int] = None) -> "ImageContainer":
         """
         Load data from a *Zarr* store.
@@ -133,6 +135,7 @@ class ImageContainer(FeatureMixin):
 
         return res
 
+    @_profiled
     def save(self, path: Pathlike_t, **kwargs: Any) -> None:
         """
         Save the container into a *Zarr* store.
@@ -161,6 +164,7 @@ class ImageContainer(FeatureMixin):
         iterator = chain.from_iterable(pat.finditer(k) for k in self.data.keys())
         return f"{layer}_{(max(map(lambda m: int(m.groups()[0]), iterator), default=-1) + 1)}"
 
+    @_profiled
     @d.get_sections(base="add_img", sections=["Parameters", "Raises"])
     @d.dedent
     def add_img(
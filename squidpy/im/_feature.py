@@ -7,6 +7,7 @@ from anndata import AnnData
 import pandas as pd
 
 from squidpy._docs import d, inject_docs
+from squidpy._profiling import _profiled
 from squidpy._utils import Signal, SigQueue, parallelize, _get_n_cores
 from squidpy.gr._utils import _save_data
 from squidpy.im._container import ImageContainer
@@ -15,6 +16,7 @@ from squidpy._constants._constants import ImageFeature
 __all__ = ["calculate_image_features"]
 
 
+@_profiled
 @d.dedent
 @inject_docs(f=ImageFeature)
 def calculate_image_features(
@@ -26,7 +28,7 @@ def calculate_image_features(
     key_added: str = "img_features",
     copy: bool = False,
     n_jobs: Optional[int] = None,
-    backend: str = "loky",
+    backend: Optional[str] = None,
     show_progress_bar: bool = True,
     **kwargs: Any,
 ) -> Optional[pd.DataFrame]:
@@ -88,6 +90,7 @@ def calculate_image_features(
         collection=adata.obs_names,
         extractor=pd.concat,
         n_jobs=n_jobs,
+        n_split="auto",
         backend=backend,
         show_progress_bar=show_progress_bar,
     )(adata, img, layer=layer, features=features, features_kwargs=features_kwargs, **kwargs)
@@ -9,6 +9,7 @@ import skimage
 import skimage.filters
 
 from squidpy._docs import d, inject_docs
+from squidpy._profiling import _profiled
 from squidpy.im._container import ImageContainer
 from squidpy._constants._constants import Processing
 from squidpy._constants._pkg_constants import Key
@@ -16,6 +17,7 @@ from squidpy._constants._pkg_constants import Key
 __all__ = ["process"]
 
 
+@_profiled
 @d.dedent
 @inject_docs(p=Processing)
 def process(
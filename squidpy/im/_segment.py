@@ -14,6 +14,7 @@ from skimage.segmentation import watershed
 import skimage
 
 from squidpy._docs import d, inject_docs
+from squidpy._profiling import _profiled
 from squidpy._utils import (
     Signal,
     SigQueue,
@@ -219,6 +220,7 @@ class SegmentationBlob(SegmentationCustom):
         return blob_mask
 
 
+@_profiled
 @d.dedent
 @inject_docs(m=SegmentationBackend)
 def segment(
@@ -231,7 +233,7 @@ def segment(
     copy: bool = False,
     show_progress_bar: bool = True,
     n_jobs: Optional[int] = None,
-    backend: str = "loky",
+    backend: Optional[str] = None,
     **kwargs: Any,
 ) -> Optional[ImageContainer]:
     """
@@ -302,6 +304,7 @@ def segment(
         unit="crop",
         extractor=lambda res: list(chain.from_iterable(res)),
         n_jobs=n_jobs,
+        n_split="auto",
         backend=backend,
         show_progress_bar=show_progress_bar and len(crops) > 1,
     )(model=segmentation_model, layer=layer, layer_new=layer_new, channel=channel, **kwargs)
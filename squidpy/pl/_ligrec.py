@@ -111,6 +111,7 @@ def ligrec(
     figsize: Optional[Tuple[float, float]] = None,
     dpi: Optional[int] = None,
     save: Optional[Union[str, Path]] = None,
+    sample: Optional[str] = None,
     **kwargs: Any,
 ) -> None:
     """
@@ -124,7 +125,8 @@ def ligrec(
     Parameters
     ----------
     %(adata)s
-        It can also be a :class:`dict`, as returned by :func:`squidpy.gr.ligrec`.
+        It can also be a :class:`dict`, as returned by :func:`squidpy.gr.ligrec`, with the results
+        either as :class:`pandas.DataFrame` or as :class:`numpy.ndarray`.
     %(cluster_key)s
         Only used when ``adata`` is of type :class:`AnnData`.
     source_groups
@@ -150,6 +152,8 @@ def ligrec(
     alpha
         Significance threshold. All elements with p-values <= ``alpha`` will be marked by tori instead of dots.
     %(plotting)s
+    sample
+        Which sample to plot if the result was computed with ``sample_key``. Can be omitted if there is only 1.
     kwargs
         Keyword arguments for :meth:`scanpy.pl.DotPlot.style` or :meth:`scanpy.pl.DotPlot.legend`.
 
@@ -203,13 +207,15 @@ def ligrec(
     if alpha is not None and not (0 <= alpha <= 1):
         raise ValueError(f"Expected `alpha` to be in range `[0, 1]`, found `{alpha}`.")
 
+    adata = _select_sample(adata, sample)
+    is_array = isinstance(adata["pvalues"], np.ndarray)
     if source_groups is None:
-        source_groups = adata["pvalues"].columns.get_level_values(0)
+        source_groups = adata["clusters"][:, 0] if is_array else adata["pvalues"].columns.get_level_values(0)
     elif isinstance(source_groups, str):
         source_groups = (source_groups,)
 
     if target_groups is None:
-        target_groups = adata["pvalues"].columns.get_level_values(1)
+        target_groups = adata["clusters"][:, 1] if is_array else adata["pvalues"].columns.get_level_values(1)
     if isinstance(target_groups, str):
         target_groups = (target_groups,)
     if title is None:
@@ -218,14 +224,18 @@ def ligrec(
     source_groups, _ = _unique_order_preserving(source_groups)  # type: ignore[no-redef,assignment]
     target_groups, _ = _unique_order_preserving(target_groups)  # type: ignore[no-redef,assignment]
 
-    pvals: pd.DataFrame = adata["pvalues"].loc[:, (source_groups, target_groups)]
-    means: pd.DataFrame = adata["means"].loc[:, (source_groups, target_groups)]
+    if is_array:
+        pvals, means = _select_arrays(adata, source_groups, target_groups, means_range, pvalue_threshold)
+    else:
+        pvals = adata["pvalues"].loc[:, (source_groups, target_groups)]
+        means = adata["means"].loc[:, (source_groups, target_groups)]
 
     if pvals.empty:
         raise ValueError("No valid clusters have been selected.")
 
-    means = means[(means >= means_range[0]) & (means <= means_range[1])]
-    pvals = pvals[pvals <= pvalue_threshold]
+    if not is_array:
+        means = means[(means >= means_range[0]) & (means <= means_range[1])]
+        pvals = pvals[pvals <= pvalue_threshold]
 
     if remove_empty_interactions:
         mask = ~(pd.isnull(means) | pd.isnull(pvals))
@@ -362,3 +372,96 @@ def ligrec(
 
     if save is not None:
         save_fig(dp.fig, save)
+
+
+def _select_sample(res: Mapping[str, Any], sample: Optional[str]) -> Mapping[str, Any]:
+    """
+    Select the results of one sample.
+
+    Parameters
+    ----------
+    res
+        Result of :func:`squidpy.gr.ligrec`.
+    sample
+        Sample to select. If `None`, the result must contain at most 1 sample.
+
+    Returns
+    -------
+    The result without the samples.
+    """
+    if isinstance(res["pvalues"], np.ndarray):
+        clusters = np.asarray(res["clusters"])
+        if clusters.shape[1] == 2:
+            samples = None
+        else:
+            samples, _ = _unique_order_preserving(clusters[:, 0])
+    else:
+        samples = None if res["pvalues"].columns.nlevels == 2 else res["pvalues"].columns.unique(level=0).tolist()
+
+    if samples is None:
+        if sample is not None:
+            raise ValueError(f"Unable to select sample `{sample}`, the result was computed without `sample_key`.")
+        return res
+    if sample is None:
+        if len(samples) != 1:
+            raise ValueError(f"Please select a sample using `sample`. Valid options are: `{samples}`.")
+        sample = samples[0]
+    if sample not in samples:
+        raise ValueError(f"Invalid sample `{sample}`. Valid options are: `{samples}`.")
+
+    if isinstance(res["pvalues"], np.ndarray):
+        mask = clusters[:, 0] == sample
+        return {
+            **res,
+            "means": res["means"][:, mask],
+            "pvalues": res["pvalues"][:, mask],
+            "clusters": clusters[mask, 1:],
+        }
+
+    return {**res, "means": res["means"][sample], "pvalues": res["pvalues"][sample]}
+
+
+def _select_arrays(
+    res: Mapping[str, Any],
+    source_groups: Sequence[str],
+    target_groups: Sequence[str],
+    means_range: Tuple[float, float],
+    pvalue_threshold: float,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Select the cluster combinations and filter the values of results stored as arrays.
+
+    Parameters
+    ----------
+    res
+        Result of :func:`squidpy.gr.ligrec` with ``result_format = 'array'``.
+    source_groups
+        Source interaction clusters.
+    target_groups
+        Target interaction clusters.
+    means_range
+        Closed interval of the means to keep.
+    pvalue_threshold
+        Maximum p-value to keep.
+
+    Returns
+    -------
+    The p-values and the means of the selected combinations, in the same order as
+    :meth:`pandas.DataFrame.loc` would select them. Filtered values are set to `NaN`.
+    """
+    clusters = np.asarray(res["clusters"])
+    src = pd.Index(source_groups).get_indexer(clusters[:, 0])
+    tgt = pd.Index(target_groups).get_indexer(clusters[:, 1])
+    ixs = np.where((src >= 0) & (tgt >= 0))[0]
+    ixs = ixs[np.lexsort((tgt[ixs], src[ixs]))]
+
+    means = np.asarray(res["means"][:, ixs], dtype=np.float64)
+    pvals = np.asarray(res["pvalues"][:, ixs], dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        means[(means < means_range[0]) | (means > means_range[1])] = np.nan
+        pvals[~(pvals <= pvalue_threshold)] = np.nan
+
+    index = pd.MultiIndex.from_arrays(np.asarray(res["interactions"]).T, names=["source", "target"])
+    columns = pd.MultiIndex.from_arrays(clusters[ixs].T, names=["cluster_1", "cluster_2"])
+
+    return pd.DataFrame(pvals, index=index, columns=columns), pd.DataFrame(means, index=index, columns=columns)
@@ -1,5 +1,5 @@
 from abc import ABC, ABCMeta
-from typing import Tuple, Mapping, Callable, Optional, Sequence
+from typing import Tuple, Union, Mapping, Callable, Optional, Sequence
 from pathlib import Path
 from functools import wraps
 from itertools import product
@@ -182,6 +182,23 @@ def ligrec_result() -> Mapping[str, pd.DataFrame]:
     )
 
 
+@pytest.fixture(scope="session")
+def ligrec_result_array() -> Mapping[str, Union[pd.DataFrame, np.ndarray]]:
+    adata = _adata.copy()
+    interactions = tuple(product(adata.raw.var_names[:5], adata.raw.var_names[:5]))
+    return sp.gr.ligrec(
+        adata,
+        "leiden",
+        interactions=interactions,
+        n_perms=25,
+        n_jobs=1,
+        show_progress_bar=False,
+        copy=True,
+        seed=0,
+        result_format="array",
+    )
+
+
 @pytest.fixture(autouse=True)
 def _logging_state():
     # modified from scanpy
@@ -9,11 +9,13 @@ from scanpy.datasets import blobs
 import scanpy as sc
 
 from pandas.testing import assert_frame_equal
+import numba
 import numpy as np
 import pandas as pd
 
-from squidpy.gr import ligrec
-from squidpy.gr._ligrec import PermutationTest
+from squidpy.gr import ligrec, ligrec_warmup, spatial_neighbors
+from squidpy.gr._ligrec import PermutationTest, _fdr_correct, _group_stats
+from squidpy._settings import settings
 from squidpy._constants._pkg_constants import Key
 
 _CK = "leiden"
@@ -63,6 +65,31 @@ class TestInvalidBehavior:
         with pytest.raises(ValueError, match=r"Expected `n_perms` to be positive"):
             ligrec(adata, _CK, interactions=interactions, n_perms=0)
 
+    def test_invalid_engine(self, adata: AnnData, interactions: Interactions_t):
+        with pytest.raises(ValueError, match=r"Invalid option `foobar` for `PermutationEngine`."):
+            ligrec(adata, _CK, interactions=interactions, engine="foobar")
+
+    def test_early_stopping_invalid_engine(self, adata: AnnData, interactions: Interactions_t):
+        with pytest.raises(ValueError, match=r"Early stopping is only available if `engine='matmul'`."):
+            ligrec(adata, _CK, interactions=interactions, early_stopping=10, engine="numba")
+
+    def test_tail_model_invalid(self, adata: AnnData, interactions: Interactions_t):
+        with pytest.raises(ValueError, match=r"Tail model is only available if `engine='matmul'`."):
+            ligrec(adata, _CK, interactions=interactions, tail_model="gpd", engine="numba")
+        with pytest.raises(ValueError, match=r"Expected `n_perms` to be greater than `10`"):
+            ligrec(adata, _CK, interactions=interactions, tail_model="gpd", engine="matmul", n_perms=10)
+
+    def test_sample_key_not_categorical(self, adata: AnnData, interactions: Interactions_t):
+        adata.obs["sample"] = np.arange(adata.n_obs) % 2
+        with pytest.raises(TypeError, match=r"Expected `adata.obs\['sample'\]` to be `categorical`"):
+            ligrec(adata, _CK, interactions=interactions, sample_key="sample")
+
+    def test_multiple_cluster_keys_spatial(self, adata: AnnData, interactions: Interactions_t):
+        adata.obs["foo"] = adata.obs[_CK].copy()
+        spatial_neighbors(adata)
+        with pytest.raises(ValueError, match=r"only available for `1` cluster key"):
+            ligrec(adata, [_CK, "foo"], interactions=interactions, connectivity_key="spatial_connectivities")
+
     def test_invalid_interactions_type(self, adata: AnnData):
         with pytest.raises(TypeError, match=r"Expected either a `pandas.DataFrame`"):
             ligrec(adata, _CK, interactions=42)
@@ -111,7 +138,7 @@ class TestValidBehavior:
         genes = pd.Series([g for gs in pt.interactions[["source", "target"]].values for g in gs], dtype="string")
 
         np.testing.assert_array_equal(genes.values, genes.str.upper().values)
-        np.testing.assert_array_equal(pt._data.columns, pt._data.columns.str.upper())
+        np.testing.assert_array_equal(pt._genes.index, pt._genes.index.str.upper())
 
     def test_complex_policy_min(self, adata: AnnData, complexes: Complexes_t):
         g = adata.raw.var_names
@@ -266,6 +293,22 @@ class TestValidBehavior:
         np.testing.assert_array_equal(r["metadata"].columns, ["metadata"])
         np.testing.assert_array_equal(r["metadata"]["metadata"], interactions["metadata"])
 
+    @pytest.mark.parametrize("engine", ["numba", "matmul", "spatial"])
+    def test_reproducibility_n_jobs(self, adata: AnnData, interactions: Interactions_t, engine: str):
+        kwargs = dict(n_perms=25, copy=True, show_progress_bar=False, seed=42)
+        if engine == "spatial":
+            spatial_neighbors(adata)
+            kwargs["connectivity_key"] = Key.obsp.spatial_conn()
+        else:
+            kwargs["engine"] = engine
+
+        r1 = ligrec(adata, _CK, interactions=interactions, n_jobs=1, **kwargs)
+        r4 = ligrec(adata, _CK, interactions=interactions, n_jobs=4, backend="threading", **kwargs)
+
+        # each permutation has its own random number generator, regardless of the chunks
+        np.testing.assert_array_equal(r1["means"], r4["means"])
+        np.testing.assert_array_equal(r1["pvalues"], r4["pvalues"])
+
     @pytest.mark.parametrize("n_jobs", [1, 2])
     def test_reproducibility_cores(self, adata: AnnData, interactions: Interactions_t, n_jobs: int):
         r1 = ligrec(
@@ -307,6 +350,41 @@ class TestValidBehavior:
         assert not np.allclose(r3["pvalues"], r1["pvalues"])
         assert not np.allclose(r3["pvalues"], r2["pvalues"])
 
+    @pytest.mark.parametrize("numba_parallel", [False, True])
+    def test_threading_backend(self, adata: AnnData, interactions: Interactions_t, numba_parallel: bool):
+        kwargs = dict(n_perms=25, copy=True, show_progress_bar=False, seed=42, n_jobs=2, numba_parallel=numba_parallel)
+        expected = ligrec(adata, _CK, interactions=interactions, backend="loky", **kwargs)
+        res = ligrec(adata, _CK, interactions=interactions, **kwargs)
+
+        np.testing.assert_array_equal(res["means"].sparse.to_dense(), expected["means"].sparse.to_dense())
+        np.testing.assert_array_equal(res["pvalues"].sparse.to_dense(), expected["pvalues"].sparse.to_dense())
+
+    def test_settings_dtype(self, adata: AnnData, interactions: Interactions_t):
+        kwargs = dict(n_perms=25, copy=True, show_progress_bar=False, seed=42)
+        expected = ligrec(adata, _CK, interactions=interactions, **kwargs)
+        with settings.override(dtype=np.float32):
+            res = ligrec(adata, _CK, interactions=interactions, **kwargs)
+
+        np.testing.assert_allclose(
+            res["means"].sparse.to_dense(), expected["means"].sparse.to_dense(), rtol=1e-5, atol=1e-6
+        )
+        np.testing.assert_allclose(res["pvalues"].sparse.to_dense(), expected["pvalues"].sparse.to_dense())
+
+    def test_warmup(self, monkeypatch):
+        from squidpy.gr._ligrec import _test, _edge_sums, _test_parallel, _group_stats_csr, _group_stats_dense
+
+        # only the kernels are compiled, no analysis is run
+        monkeypatch.setattr("squidpy.gr._ligrec.parallelize", None)
+        ligrec_warmup()
+
+        # kernel and position of the data in its signature
+        kernels = [(_test, 2), (_test_parallel, 2), (_edge_sums, 1)]
+        for fn, pos in kernels + [(_group_stats_dense, 0), (_group_stats_csr, 0)]:
+            assert {numba.float32, numba.float64} <= {sig[pos].dtype for sig in fn.signatures}, fn
+        for fn, pos in kernels:
+            # the data can be memory-mapped read-only
+            assert {numba.float32, numba.float64} <= {sig[pos].dtype for sig in fn.signatures if not sig[pos].mutable}
+
     def test_reproducibility_numba_parallel_off(self, adata: AnnData, interactions: Interactions_t):
         t1 = time()
         r1 = ligrec(
@@ -340,6 +418,205 @@ class TestValidBehavior:
         np.testing.assert_allclose(r1["means"], r2["means"])
         np.testing.assert_allclose(r1["pvalues"], r2["pvalues"])
 
+    @pytest.mark.parametrize("n_jobs", [1, 2])
+    def test_engine_matmul(self, adata: AnnData, interactions: Interactions_t, n_jobs: int):
+        kwargs = dict(n_perms=25, copy=True, show_progress_bar=False, seed=42, n_jobs=n_jobs)
+        r1 = ligrec(adata, _CK, interactions=interactions, engine="numba", **kwargs)
+        r2 = ligrec(adata, _CK, interactions=interactions, engine="matmul", **kwargs)
+
+        np.testing.assert_array_equal(r1["means"], r2["means"])
+        np.testing.assert_array_equal(r1["pvalues"], r2["pvalues"])
+
+    @pytest.mark.parametrize("engine", ["numba", "matmul"])
+    def test_memory_mapped_data(self, adata: AnnData, interactions: Interactions_t, engine: str):
+        kwargs = dict(n_perms=25, copy=True, show_progress_bar=False, seed=42, n_jobs=2, engine=engine)
+        r1 = ligrec(adata, _CK, interactions=interactions, max_nbytes=None, **kwargs)
+        # memory-map all arrays
+        r2 = ligrec(adata, _CK, interactions=interactions, max_nbytes=0, **kwargs)
+
+        np.testing.assert_array_equal(r1["means"], r2["means"])
+        np.testing.assert_array_equal(r1["pvalues"], r2["pvalues"])
+
+    def test_early_stopping(self, adata: AnnData, interactions: Interactions_t):
+        kwargs = dict(n_perms=50, copy=True, show_progress_bar=False, seed=42, engine="matmul")
+        r1 = ligrec(adata, _CK, interactions=interactions, **kwargs)
+        # never reached, the results must be the same
+        r2 = ligrec(adata, _CK, interactions=interactions, early_stopping=51, **kwargs)
+        r3 = ligrec(adata, _CK, interactions=interactions, early_stopping=1, **kwargs)
+
+        np.testing.assert_array_equal(r1["pvalues"], r2["pvalues"])
+        np.testing.assert_array_equal(r1["means"], r3["means"])
+        pvals = r3["pvalues"].sparse.to_dense().values
+        assert np.nanmin(pvals) > 0
+        assert np.nanmax(pvals) <= 1
+        # most combinations are decided after only a few permutations
+        assert np.nanmean(pvals) >= np.nanmean(r1["pvalues"].sparse.to_dense().values)
+
+    @pytest.mark.parametrize("tail_model", [None, "gpd", "gamma"])
+    def test_early_stopping_n_jobs(self, adata: AnnData, interactions: Interactions_t, tail_model: Optional[str]):
+        kwargs = dict(n_perms=50, copy=True, show_progress_bar=False, seed=42, engine="matmul", tail_model=tail_model)
+        r1 = ligrec(adata, _CK, interactions=interactions, early_stopping=5, n_jobs=1, **kwargs)
+        r2 = ligrec(adata, _CK, interactions=interactions, early_stopping=5, n_jobs=3, backend="threading", **kwargs)
+
+        np.testing.assert_array_equal(r1["means"], r2["means"])
+        np.testing.assert_array_equal(r1["pvalues"], r2["pvalues"])
+        if tail_model is None:
+            # the stopping rule applies to all permutations, not to the ones of each job
+            pvals = r1["pvalues"].sparse.to_dense().values
+            full = ligrec(adata, _CK, interactions=interactions, **kwargs)["pvalues"].sparse.to_dense().values
+            stopped = full >= 5 / 50
+            assert np.any(stopped)
+            assert np.all(pvals[stopped] >= 5 / 50)
+            np.testing.assert_array_equal(pvals[full < 5 / 50], full[full < 5 / 50])
+
+    @pytest.mark.parametrize("tail_model", ["gpd", "gamma"])
+    def test_tail_model(self, adata: AnnData, interactions: Interactions_t, tail_model: str):
+        kwargs = dict(n_perms=50, copy=True, show_progress_bar=False, seed=42, engine="matmul")
+        r1 = ligrec(adata, _CK, interactions=interactions, **kwargs)
+        r2 = ligrec(adata, _CK, interactions=interactions, tail_model=tail_model, **kwargs)
+
+        p1 = r1["pvalues"].sparse.to_dense().values
+        p2 = r2["pvalues"].sparse.to_dense().values
+        # often exceeded combinations keep their empirical p-values
+        common = p1 >= 10 / 50
+        np.testing.assert_array_equal(p1[common], p2[common])
+        assert np.nanmax(p2) <= 1
+        assert np.nanmin(p2) < 1 / 50
+
+    def test_spatial(self, adata: AnnData, interactions: Interactions_t):
+        spatial_neighbors(adata)
+        res = ligrec(
+            adata,
+            _CK,
+            interactions=interactions,
+            n_perms=25,
+            copy=True,
+            show_progress_bar=False,
+            seed=42,
+            connectivity_key=Key.obsp.spatial_conn(),
+        )
+        means = res["means"].sparse.to_dense()
+        pvals = res["pvalues"].sparse.to_dense().values
+
+        # mean product over the edges from the first to the second cluster
+        i, j = np.unravel_index(np.argmax(means.values), means.shape)
+        (src, tgt), (c1, c2) = means.index[i], means.columns[j]
+        adj = adata.obsp[Key.obsp.spatial_conn()].tocoo()
+        labels = adata.obs[_CK].astype(str).values
+        edges = (labels[adj.row] == c1) & (labels[adj.col] == c2)
+        genes = adata.raw.var_names.str.upper()
+        x = adata.raw.X[:, [genes.get_loc(src), genes.get_loc(tgt)]].toarray()
+        expected = np.mean(x[adj.row[edges], 0] * x[adj.col[edges], 1])
+
+        assert expected > 0
+        np.testing.assert_allclose(means.iloc[i, j], expected)
+        assert np.nanmin(pvals) >= 0
+        assert np.nanmax(pvals) <= 1
+
+    def test_spatial_invalid(self, adata: AnnData, interactions: Interactions_t):
+        with pytest.raises(KeyError, match=r"Spatial connectivity key `foo` not found"):
+            ligrec(adata, _CK, interactions=interactions, connectivity_key="foo")
+
+        spatial_neighbors(adata)
+        with pytest.raises(ValueError, match=r"Spatially constrained test is only available if `engine='numba'`."):
+            ligrec(adata, _CK, interactions=interactions, connectivity_key=Key.obsp.spatial_conn(), engine="matmul")
+
+    @pytest.mark.parametrize("n_jobs", [1, 2])
+    def test_sample_key(self, adata: AnnData, interactions: Interactions_t, n_jobs: int):
+        adata.obs["sample"] = pd.Categorical(np.where(np.arange(adata.n_obs) % 3, "foo", "bar"))
+        kwargs = dict(n_perms=25, copy=True, show_progress_bar=False, seed=42)
+        res = ligrec(adata, _CK, interactions=interactions, sample_key="sample", n_jobs=n_jobs, **kwargs)
+
+        assert res["means"].columns.names == ["sample", "cluster_1", "cluster_2"]
+        assert res["pvalues"].columns.names == ["sample", "cluster_1", "cluster_2"]
+        assert res["means"].columns.get_level_values(0).unique().tolist() == ["bar", "foo"]
+        assert len(res["metadata"]) == len(res["means"])
+
+        for sample in ["bar", "foo"]:
+            expected = ligrec(adata[adata.obs["sample"] == sample].copy(), _CK, interactions=interactions, **kwargs)
+            for key in ["means", "pvalues"]:
+                actual = res[key][sample][expected[key].columns].sparse.to_dense().values
+                np.testing.assert_array_equal(actual, expected[key].sparse.to_dense().values)
+
+    @pytest.mark.parametrize("corr_method", [None, "fdr_bh"])
+    def test_result_format_array(
+        self, adata: AnnData, interactions: Interactions_t, corr_method: Optional[str], tmp_path
+    ):
+        kwargs = dict(n_perms=25, copy=True, show_progress_bar=False, seed=42, corr_method=corr_method)
+        expected = ligrec(adata, _CK, interactions=interactions, **kwargs)
+        res = ligrec(adata, _CK, interactions=interactions, result_format="array", **kwargs)
+
+        assert res["means"].dtype == np.float32
+        assert res["pvalues"].dtype == np.float32
+        np.testing.assert_array_equal(res["interactions"], np.asarray(expected["means"].index.tolist()))
+        np.testing.assert_array_equal(res["clusters"], np.asarray(expected["means"].columns.tolist()))
+        np.testing.assert_allclose(res["means"], expected["means"].sparse.to_dense().values, rtol=1e-6)
+        np.testing.assert_allclose(res["pvalues"], expected["pvalues"].sparse.to_dense().values, rtol=1e-6)
+
+        adata.uns["ligrec"] = res
+        adata.write_h5ad(tmp_path / "adata.h5ad")
+        np.testing.assert_array_equal(sc.read_h5ad(tmp_path / "adata.h5ad").uns["ligrec"]["pvalues"], res["pvalues"])
+
+    @pytest.mark.parametrize("corr_axis", ["clusters", "interactions"])
+    @pytest.mark.parametrize("corr_method", ["fdr_bh", "fdr_by", "bonferroni", "holm"])
+    def test_fdr_correct(self, corr_method: str, corr_axis: str):
+        from statsmodels.stats.multitest import multipletests
+
+        rng = np.random.default_rng(42)
+        pvals = rng.uniform(size=(50, 20)) ** 3
+        pvals[rng.uniform(size=pvals.shape) < 0.2] = np.nan
+
+        axis = 0 if corr_axis == "clusters" else 1
+        expected = np.apply_along_axis(
+            lambda p: multipletests(np.nan_to_num(p, nan=1.0), method=corr_method)[1], axis, pvals
+        )
+        expected[np.isclose(expected, 1.0)] = np.nan
+
+        np.testing.assert_allclose(_fdr_correct(pvals, corr_method, corr_axis), expected)
+
+    @pytest.mark.parametrize("engine", ["numba", "matmul"])
+    def test_multiple_cluster_keys(self, adata: AnnData, interactions: Interactions_t, engine: str):
+        adata.obs["foo"] = pd.Categorical(np.where(np.arange(adata.n_obs) % 3, "a", "b"))
+        kwargs = dict(n_perms=25, copy=True, show_progress_bar=False, seed=42, engine=engine, n_jobs=2)
+        res = ligrec(adata, [_CK, "foo"], interactions=interactions, **kwargs)
+
+        assert list(res.keys()) == [_CK, "foo"]
+        for key in [_CK, "foo"]:
+            # same permutations of the cells as when testing each key separately
+            expected = ligrec(adata, key, interactions=interactions, **kwargs)
+            for k in ["means", "pvalues"]:
+                assert_frame_equal(res[key][k], expected[k])
+
+    def test_multiple_cluster_keys_inplace(self, adata: AnnData, interactions: Interactions_t):
+        adata.obs["foo"] = pd.Categorical(np.where(np.arange(adata.n_obs) % 3, "a", "b"))
+        clusters = {_CK: adata.obs[_CK].cat.categories[:2], "foo": [("a", "b")]}
+        res = ligrec(
+            adata,
+            [_CK, "foo"],
+            interactions=interactions,
+            clusters=clusters,
+            n_perms=5,
+            show_progress_bar=False,
+            key_added="bar",
+        )
+
+        assert res is None
+        assert adata.uns[f"bar_{_CK}"]["means"].shape[1] == 4
+        assert adata.uns["bar_foo"]["means"].columns.tolist() == [("a", "b")]
+
+    @pytest.mark.parametrize("n_jobs", [1, 2])
+    def test_backed(self, adata: AnnData, interactions: Interactions_t, n_jobs: int, tmp_path):
+        kwargs = dict(n_perms=25, copy=True, show_progress_bar=False, seed=42, n_jobs=n_jobs)
+        clusters = list(adata.obs[_CK].cat.categories[:3])
+        expected = ligrec(adata, _CK, interactions=interactions, clusters=clusters, **kwargs)
+
+        adata.write_h5ad(tmp_path / "adata.h5ad")
+        backed = sc.read_h5ad(tmp_path / "adata.h5ad", backed="r")
+        res = ligrec(backed, _CK, interactions=interactions, clusters=clusters, **kwargs)
+
+        for key in ["means", "pvalues"]:
+            assert_frame_equal(res[key], expected[key])
+
     def test_paul15_correct_means(self, paul15: AnnData, paul15_means: pd.DataFrame):
         res = ligrec(
             paul15,
@@ -420,6 +697,19 @@ class TestValidBehavior:
         assert len(res["pvalues"]) == len(expected)
         assert set(res["pvalues"].index.to_list()) == expected
 
+    @pytest.mark.parametrize("sparse", [False, True])
+    def test_group_stats(self, adata: AnnData, sparse: bool):
+        data = adata.raw.X[:, :20]
+        clustering = adata.obs[_CK].cat.codes.values.astype(np.int32)
+        n_cls = len(adata.obs[_CK].cat.categories)
+
+        sums, nnz, sizes = _group_stats(data if sparse else data.toarray(), clustering, n_cls)
+        df = pd.DataFrame(data.toarray()).groupby(clustering)
+
+        np.testing.assert_array_equal(sizes, df.size().values)
+        np.testing.assert_allclose(sums, df.sum().values, rtol=1e-5)
+        np.testing.assert_array_equal(nnz, (df.apply(lambda c: (c > 0).sum())).values)
+
     @pytest.mark.xfail(reason="AnnData cannot handle writing MultiIndex")
     def test_writeable(self, adata: AnnData, interactions: Interactions_t, tmpdir):
         ligrec(adata, _CK, interactions=interactions, n_perms=5, copy=False, show_progress_bar=False, key_added="foo")
@@ -11,6 +11,7 @@ from squidpy.gr import (
     spatial_neighbors,
     interaction_matrix,
 )
+from squidpy.gr._nhood import _create_function
 from squidpy._constants._pkg_constants import Key
 
 _CK = "leiden"
@@ -38,6 +39,40 @@ class TestNhoodEnrichment:
 
         self._assert_common(adata)
 
+    @pytest.mark.parametrize("backend", ["threading", "loky"])
+    def test_numba_parallel(self, adata: AnnData, backend: str):
+        spatial_neighbors(adata)
+        kwargs = dict(cluster_key=_CK, seed=42, n_jobs=2, n_perms=20, copy=True, show_progress_bar=False)
+        expected = nhood_enrichment(adata, numba_parallel=False, **kwargs)
+        res = nhood_enrichment(adata, numba_parallel=True, backend=backend, **kwargs)
+
+        np.testing.assert_allclose(res[0], expected[0])
+        np.testing.assert_array_equal(res[1], expected[1])
+
+    def test_read_only_arrays(self, adata: AnnData):
+        # large arrays are passed to the workers as read-only memory-mapped files
+        spatial_neighbors(adata)
+        adj = adata.obsp[Key.obsp.spatial_conn()]
+        indices, indptr = adj.indices.astype(np.uint32), adj.indptr.astype(np.uint32)
+        clustering = adata.obs[_CK].cat.codes.values.astype(np.uint32)
+        fn = _create_function(len(adata.obs[_CK].cat.categories))
+
+        expected = fn(indices, indptr, clustering)
+        indices.flags.writeable = False
+        indptr.flags.writeable = False
+
+        np.testing.assert_array_equal(fn(indices, indptr, clustering), expected)
+
+    def test_reproducibility_n_jobs(self, adata: AnnData):
+        spatial_neighbors(adata)
+        kwargs = dict(cluster_key=_CK, seed=42, n_perms=20, copy=True, show_progress_bar=False)
+
+        res1 = nhood_enrichment(adata, n_jobs=1, **kwargs)
+        res4 = nhood_enrichment(adata, n_jobs=4, backend="threading", **kwargs)
+
+        np.testing.assert_array_equal(res1[0], res4[0])
+        np.testing.assert_array_equal(res1[1], res4[1])
+
     @pytest.mark.parametrize("n_jobs", [1, 2])
     def test_reproducibility(self, adata: AnnData, n_jobs: int):
         spatial_neighbors(adata)
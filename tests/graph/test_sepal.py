@@ -0,0 +1,62 @@
+import pytest
+
+from anndata import AnnData
+
+import numpy as np
+import pandas as pd
+
+from squidpy.gr import sepal, spatial_neighbors
+from squidpy._constants._pkg_constants import Key
+
+
+@pytest.fixture()
+def hex_adata() -> AnnData:
+    rng = np.random.default_rng(42)
+    ys, xs = np.meshgrid(np.arange(20), np.arange(20), indexing="ij")
+    coords = np.stack([2 * xs + (ys % 2), np.sqrt(3) * ys], axis=-1).reshape(-1, 2)
+
+    X = rng.poisson(1.0, size=(coords.shape[0], 3)).astype(np.float64)
+    X[:, 0] = 10 * np.exp(-((coords[:, 0] - 20) ** 2 + (coords[:, 1] - 17) ** 2) / 50)
+    adata = AnnData(X, var=pd.DataFrame(index=["pattern", "noise_1", "noise_2"]), dtype=np.float64)
+    adata.obsm[Key.obsm.spatial] = coords
+    spatial_neighbors(adata, coord_type="visium")
+
+    return adata
+
+
+def test_sepal(hex_adata: AnnData):
+    res = sepal(hex_adata, max_neighs=6, copy=True, show_progress_bar=False)
+
+    assert isinstance(res, pd.DataFrame)
+    assert res.columns.tolist() == ["sepal_score"]
+    assert not res["sepal_score"].isna().any()
+    assert res.index[0] == "pattern"
+    assert "sepal_score" not in hex_adata.uns
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_sepal_inplace(hex_adata: AnnData, n_jobs: int):
+    expected = sepal(hex_adata, max_neighs=6, copy=True, show_progress_bar=False)
+    res = sepal(hex_adata, max_neighs=6, copy=False, n_jobs=n_jobs, show_progress_bar=False)
+
+    assert res is None
+    pd.testing.assert_frame_equal(hex_adata.uns["sepal_score"], expected)
+
+
+def test_sepal_use_raw(hex_adata: AnnData):
+    genes = ["noise_2", "pattern"]
+    expected = sepal(hex_adata, genes=genes, max_neighs=6, copy=True, show_progress_bar=False)
+    hex_adata.raw = hex_adata.copy()
+    # `.X` differs from `.raw`, which has all the genes
+    hex_adata = hex_adata[:, ["noise_1"]].copy()
+    hex_adata.X[:] = 0
+    res = sepal(hex_adata, genes=genes, max_neighs=6, use_raw=True, copy=True, show_progress_bar=False)
+
+    pd.testing.assert_frame_equal(res, expected)
+
+
+def test_sepal_invalid_max_neighs(hex_adata: AnnData):
+    with pytest.raises(ValueError, match=r"Expected `max_neighs` to be either `4` or `6`"):
+        sepal(hex_adata, max_neighs=5)
+    with pytest.raises(ValueError, match=r"Expected at most `4` neighbors"):
+        sepal(hex_adata, max_neighs=4)
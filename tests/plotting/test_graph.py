@@ -1,5 +1,6 @@
 from copy import deepcopy
 from typing import Mapping
+from itertools import product
 import pytest
 
 from anndata import AnnData
@@ -184,3 +185,41 @@ class TestLigrec(PlotTester, metaclass=PlotTesterMeta):
     def test_plot_kwargs(self, ligrec_result: Mapping[str, pd.DataFrame]):
         # color_on is intentionally ignored
         pl.ligrec(ligrec_result, grid=False, color_on="square", x_padding=2, y_padding=2)
+
+    @pytest.mark.parametrize("kwargs", [{"means_range": (0.5, 1)}, {"pvalue_threshold": 0.05}])
+    def test_array_format(self, ligrec_result_array: Mapping[str, np.ndarray], kwargs: Mapping[str, float]):
+        pl.ligrec(ligrec_result_array, **kwargs)
+        # same figure as for the sparse format
+        self.compare("Ligrec_" + ("means_range" if "means_range" in kwargs else "pvalue_threshold"))
+
+    def test_array_format_source_clusters(self, ligrec_result_array: Mapping[str, np.ndarray]):
+        pl.ligrec(ligrec_result_array, source_groups=ligrec_result_array["clusters"][0, 0])
+        self.compare("Ligrec_source_clusters")
+
+    @pytest.mark.parametrize("result_format", ["array", "sparse"])
+    def test_sample_key(self, adata: AnnData, result_format: str):
+        # both samples contain all observations, i.e. each has the same result as `ligrec_result`
+        adata = adata[np.tile(np.arange(adata.n_obs), 2)].copy()
+        adata.obs_names_make_unique()
+        adata.obs["sample"] = pd.Categorical(np.repeat(["foo", "bar"], adata.n_obs // 2))
+        interactions = tuple(product(adata.raw.var_names[:5], adata.raw.var_names[:5]))
+        res = gr.ligrec(
+            adata,
+            C_KEY,
+            interactions=interactions,
+            sample_key="sample",
+            result_format=result_format,
+            n_perms=25,
+            n_jobs=1,
+            show_progress_bar=False,
+            copy=True,
+            seed=0,
+        )
+
+        with pytest.raises(ValueError, match=r"Please select a sample using `sample`."):
+            pl.ligrec(res)
+        with pytest.raises(ValueError, match=r"Invalid sample `baz`."):
+            pl.ligrec(res, sample="baz")
+
+        pl.ligrec(res, sample="foo", means_range=(0.5, 1))
+        self.compare("Ligrec_means_range")
@@ -0,0 +1,261 @@
+import os
+import json
+import time
+
+import pytest
+
+from anndata import AnnData
+
+import numba
+import numpy as np
+
+from squidpy import profile
+from squidpy.gr import nhood_enrichment, spatial_neighbors
+from squidpy._profiling import _stage
+from squidpy._utils import Signal, parallelize, worker_pool, _get_n_cores, _AUTO_CHUNKS_PER_JOB
+from squidpy._settings import settings
+
+_CK = "leiden"
+
+
+def _get_pid(_: np.ndarray, queue=None) -> int:
+    time.sleep(0.1)  # so that each worker receives a chunk
+    return os.getpid()
+
+
+def _take_sum(chunk: np.ndarray, arr: np.ndarray, queue=None) -> float:
+    assert queue is None
+    return float(arr[chunk].sum())
+
+
+def _count(chunk: np.ndarray, queue=None) -> int:
+    for _ in chunk:
+        queue.put(Signal.UPDATE)
+    queue.put(Signal.FINISH)
+
+    return len(chunk)
+
+
+class TestWorkerPool:
+    def test_reuse_workers(self):
+        kwargs = dict(show_progress_bar=False, extractor=set)
+
+        with worker_pool(n_jobs=2):
+            pids = parallelize(_get_pid, np.arange(4), n_jobs=2, **kwargs)()
+            pids_other = parallelize(_get_pid, np.arange(6), n_jobs=3, **kwargs)()
+        pids_after = parallelize(_get_pid, np.arange(4), n_jobs=2, **kwargs)()
+
+        # the chunks may run on any of the workers, but only on the 2 processes of the pool, regardless of `n_jobs`
+        pool = pids | pids_other
+        assert len(pool) <= 2
+        assert os.getpid() not in pool
+        # and stopped when exiting the context
+        assert pids_after.isdisjoint(pool)
+
+    def test_functions_use_pool(self, adata: AnnData, monkeypatch):
+        spatial_neighbors(adata)
+        kwargs = dict(cluster_key=_CK, seed=42, n_perms=20, copy=True, show_progress_bar=False)
+        expected = [nhood_enrichment(adata, n_jobs=n_jobs, **kwargs) for n_jobs in (2, 3)]
+
+        with worker_pool(n_jobs=2), monkeypatch.context() as m:
+            # without `backend`, the functions use the pool's instead of their own default
+            m.setattr("joblib.Parallel", None)
+            res = [nhood_enrichment(adata, n_jobs=n_jobs, **kwargs) for n_jobs in (2, 3)]
+
+        for r, e in zip(res, expected):
+            np.testing.assert_array_equal(r[0], e[0])
+            np.testing.assert_array_equal(r[1], e[1])
+
+
+class TestSettings:
+    def test_override(self, adata: AnnData, monkeypatch):
+        spatial_neighbors(adata)
+        pbars = []
+        monkeypatch.setattr("tqdm.notebook.tqdm", lambda **_: pbars.append(_))
+        kwargs = dict(cluster_key=_CK, seed=42, n_perms=20, copy=True)
+        expected = nhood_enrichment(adata, n_jobs=2, backend="threading", show_progress_bar=False, **kwargs)
+
+        with settings.override(n_jobs=2, backend="threading", show_progress_bar=False):
+            assert _get_n_cores(None) == 2
+            assert _get_n_cores(1) == 1
+            # all threads are in this process
+            pids = parallelize(lambda _, queue=None: os.getpid(), np.arange(4), n_jobs=2, extractor=set)()
+            assert pids == {os.getpid()}
+            res = nhood_enrichment(adata, **kwargs)
+
+        assert not pbars
+        assert settings.n_jobs is None and settings.backend is None and settings.show_progress_bar
+        np.testing.assert_array_equal(res[0], expected[0])
+        np.testing.assert_array_equal(res[1], expected[1])
+
+        with pytest.raises(AttributeError, match=r"Invalid settings"):
+            with settings.override(foo=1):
+                pass
+        with pytest.raises(ValueError, match=r"float32"):
+            settings.dtype = np.int32
+        with pytest.raises(ValueError, match=r"non-zero"):
+            with settings.override(n_jobs=0):
+                pass
+        assert settings.n_jobs is None
+
+
+class TestParallelize:
+    @pytest.mark.parametrize("backend", ["threading", "loky"])
+    def test_progress_bar(self, backend: str, monkeypatch):
+        pbars = []
+
+        class PBar:
+            def __init__(self, total: int, **_):
+                self.n, self.total, self.closed = 0, total, False
+                pbars.append(self)
+
+            def update(self, n: int = 1) -> None:
+                self.n += n
+
+            def close(self) -> None:
+                self.closed = True
+
+        def start(*_, **__):
+            raise AssertionError("Started a `multiprocessing.Manager`.")
+
+        monkeypatch.setattr("tqdm.notebook.tqdm", PBar)
+        monkeypatch.setattr("multiprocessing.managers.BaseManager.start", start)
+        res = parallelize(_count, np.arange(1000), n_jobs=2, backend=backend, extractor=sum)()
+
+        assert res == 1000
+        assert len(pbars) == 1
+        assert pbars[0].n == pbars[0].total == 1000
+        assert pbars[0].closed
+        if os.path.exists("/proc/self/maps"):
+            # the file of the progress is no longer mapped
+            with open("/proc/self/maps") as fin:
+                assert "squidpy_progress_" not in fin.read()
+
+    @pytest.mark.parametrize("n", [10, 1000])
+    @pytest.mark.parametrize("n_jobs", [1, 3])
+    def test_auto_split(self, n_jobs: int, n: int):
+        kwargs = dict(n_jobs=n_jobs, backend="threading", show_progress_bar=False)
+        chunks = parallelize(lambda x, queue=None: x, np.arange(n), n_split="auto", **kwargs)()
+        expected = parallelize(lambda x, queue=None: x, np.arange(n), n_split=None, **kwargs)()
+
+        assert len(chunks) == (1 if n_jobs == 1 else min(n, n_jobs * _AUTO_CHUNKS_PER_JOB))
+        # the chunks are balanced and the result keeps their order
+        assert max(map(len, chunks)) - min(map(len, chunks)) <= 1
+        np.testing.assert_array_equal(np.concatenate(chunks), np.concatenate(expected))
+        np.testing.assert_array_equal(np.concatenate(chunks), np.arange(n))
+
+
+@pytest.mark.xdist_group(name="dask")
+class TestDask:
+    @pytest.fixture(scope="class")
+    def client(self):
+        distributed = pytest.importorskip("distributed")
+        import dask
+
+        # in-process workers, so that the communication doesn't time out when the other tests load the machine
+        timeouts = {"distributed.comm.timeouts.connect": "120s", "distributed.comm.timeouts.tcp": "120s"}
+        with dask.config.set(timeouts), distributed.LocalCluster(
+            n_workers=2, threads_per_worker=1, processes=False, dashboard_address=":0"
+        ) as cluster:
+            with distributed.Client(cluster) as client:
+                yield client
+
+    def test_no_client(self):
+        pytest.importorskip("distributed")
+        with pytest.raises(ValueError, match=r"Unable to find a `distributed.Client`"):
+            parallelize(_take_sum, np.arange(10), n_jobs=2, backend="dask", show_progress_bar=False)(np.ones(10))
+
+    def test_scatter_and_progress(self, client, monkeypatch):
+        pbars, scattered = [], []
+
+        class PBar:
+            def __init__(self, total: int, **_):
+                self.n, self.total, self.closed = 0, total, False
+                pbars.append(self)
+
+            def update(self, n: int = 1) -> None:
+                self.n += n
+
+            def close(self) -> None:
+                self.closed = True
+
+        scatter = client.scatter
+
+        def scatter_spy(data, **kwargs):
+            scattered.append(data)
+            return scatter(data, **kwargs)
+
+        monkeypatch.setattr("tqdm.notebook.tqdm", PBar)
+        monkeypatch.setattr(client, "scatter", scatter_spy)
+        arr = np.arange(500_000, dtype=np.float64)  # larger than `max_nbytes`
+        ixs = np.arange(0, len(arr), 7)
+        res = parallelize(_take_sum, ixs, n_jobs=5, backend="dask")(arr)
+        expected = parallelize(_take_sum, ixs, n_jobs=5, backend="threading", show_progress_bar=False)(arr)
+
+        # the results keep the order of the chunks
+        assert len(res) == 5
+        np.testing.assert_array_equal(res, expected)
+        # the array is sent to the cluster once, not with each chunk
+        assert len(scattered) == 1
+        np.testing.assert_array_equal(scattered[0][0], arr)
+        assert len(pbars) == 1
+        assert pbars[0].n == pbars[0].total == len(ixs)
+        assert pbars[0].closed
+
+    def test_functions(self, client, adata: AnnData):
+        spatial_neighbors(adata)
+        kwargs = dict(cluster_key=_CK, seed=42, n_perms=20, n_jobs=2, copy=True, show_progress_bar=False)
+        expected = nhood_enrichment(adata, backend="threading", **kwargs)
+        res = nhood_enrichment(adata, backend="dask", **kwargs)
+
+        np.testing.assert_array_equal(res[0], expected[0])
+        np.testing.assert_array_equal(res[1], expected[1])
+
+
+class TestProfile:
+    def test_not_profiling(self):
+        with _stage("foo") as stage:
+            assert stage is None
+
+    def test_stages(self, adata: AnnData, tmp_path):
+        spatial_neighbors(adata)
+        kwargs = dict(cluster_key=_CK, seed=42, n_perms=20, n_jobs=2, backend="threading", show_progress_bar=False)
+
+        with profile(adata, key_added="foo") as report:
+            with _stage("outer"):
+                nhood_enrichment(adata, **kwargs)
+                nhood_enrichment(adata, **kwargs)
+        report.to_json(tmp_path / "report.json")
+
+        res = json.loads(adata.uns["foo"])
+        assert res == json.loads((tmp_path / "report.json").read_text())
+        stages = {s["stage"]: s for s in res["stages"]}
+        # in the order in which they were started, containing the nested stages
+        assert list(stages) == ["outer", "outer/gr.nhood_enrichment", "outer/gr.nhood_enrichment/parallelize"]
+        assert stages["outer/gr.nhood_enrichment"]["n_calls"] == 2
+        assert res["wall_time"] >= stages["outer"]["wall_time"] >= stages["outer/gr.nhood_enrichment"]["wall_time"]
+        assert stages["outer"]["peak_memory"] >= stages["outer/gr.nhood_enrichment"]["peak_memory"] > 0
+
+        par = stages["outer/gr.nhood_enrichment/parallelize"]
+        assert par["backend"] == "threading"
+        assert par["n_jobs"] == 2
+        assert par["n_chunks"] == 4
+        assert sum(w["n_chunks"] for w in par["workers"]) == 4
+        assert all(w["busy_time"] > 0 and w["max_rss"] > 0 for w in par["workers"])
+        assert 0 < par["utilization"] <= 1
+
+    def test_compile_time(self):
+        @numba.njit
+        def add(x: int) -> int:
+            return x + 1
+
+        with profile(memory=False) as report:
+            with _stage("compile"):
+                add(1)
+            with _stage("run"):
+                add(1)
+
+        stages = {s["stage"]: s for s in report.stages}
+        assert report.compile_time == stages["compile"]["compile_time"] > 0
+        assert stages["run"]["compile_time"] == 0
+        assert stages["run"]["peak_memory"] is None